@@ -0,0 +1,126 @@
+"""
+Compares compressed traces with uncompressed text:
+compression ratio and end-to-end throughput of building a GraphStore.
+
+The trace of data/sample is repeated to make a large workload.
+Build and run the sample first:
+    cd data/sample && make && ./program
+
+Usage: python -m benchmarks.compression [finstrument.txt] [--repeat N]
+"""
+import argparse
+import gzip
+import lzma
+import os
+import tempfile
+import time
+import zlib
+from hoshingak.core.store import GraphStore
+from hoshingak.core.trace import BinaryTraceReader, TextTraceReader, \
+    open_trace
+
+SAMPLE_TRACE = os.path.join(os.path.dirname(__file__), '..', 'data',
+                            'sample', 'finstrument.txt')
+
+
+def scale_trace(events, repeat):
+    """
+    Runs the sample trace 'repeat' times, one after another.
+    """
+    events = list(events)
+    duration = events[-1].time - events[0].time + 1
+    for index in range(repeat):
+        offset = index * duration
+        for event in events:
+            yield event._replace(time=event.time + offset)
+
+
+def write_text(path, events, opener=open):
+    with opener(path, 'wb') as fp:
+        for event in events:
+            fp.write(f'{hex(event.address)} {hex(event.call_site)} '
+                     f'{event.flag} {event.time} {event.thread}\n'.encode())
+
+
+def write_binary(path, events, opener=open, level=0):
+    """
+    :param level: writes zlib frames like HOSHINGAK_COMPRESS if not 0.
+    """
+    record = BinaryTraceReader.RECORDS[2]
+    flags = BinaryTraceReader.MONOTONIC
+    if level:
+        flags |= BinaryTraceReader.COMPRESSED
+    frame_size = BinaryTraceReader.CHUNK_RECORDS * record.size
+
+    with opener(path, 'wb') as fp:
+        fp.write(BinaryTraceReader.HEADER.pack(
+            BinaryTraceReader.MAGIC, 2, record.size, flags, 0, 0))
+        buffer = bytearray()
+
+        def flush():
+            if level:
+                data = zlib.compress(bytes(buffer), level)
+                fp.write(BinaryTraceReader.FRAME.pack(len(data), len(buffer)))
+                fp.write(data)
+            else:
+                fp.write(buffer)
+            buffer.clear()
+
+        for event in events:
+            buffer += record.pack(event.address, event.call_site, event.time,
+                                  event.flag.encode(), event.thread)
+            if len(buffer) >= frame_size:
+                flush()
+        if buffer:
+            flush()
+
+
+def measure(path):
+    start = time.perf_counter()
+    store = GraphStore()
+    store.extend(open_trace(path))
+    return time.perf_counter() - start, sum(store.calls) * 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('trace', nargs='?', default=SAMPLE_TRACE)
+    parser.add_argument('--repeat', type=int, default=5000)
+    args = parser.parse_args()
+
+    sample = list(TextTraceReader(args.trace))
+    variants = [
+        ('text', 'trace.txt', lambda path, events:
+            write_text(path, events)),
+        ('text, gzip', 'trace.txt.gz', lambda path, events:
+            write_text(path, events, gzip.open)),
+        ('text, xz', 'trace.txt.xz', lambda path, events:
+            write_text(path, events, lzma.open)),
+        ('binary', 'trace.bin', lambda path, events:
+            write_binary(path, events)),
+        ('binary, gzip', 'trace.bin.gz', lambda path, events:
+            write_binary(path, events, gzip.open)),
+        ('binary, zlib frames', 'trace.frames.bin', lambda path, events:
+            write_binary(path, events, level=1)),
+    ]
+
+    with tempfile.TemporaryDirectory() as directory:
+        print(f'{"format":<20} {"size":>12} {"ratio":>7} {"time":>9} '
+              f'{"events/s":>12} {"MiB/s":>8}')
+        text_size = None
+        for name, filename, write in variants:
+            path = os.path.join(directory, filename)
+            write(path, scale_trace(sample, args.repeat))
+            size = os.path.getsize(path)
+            if text_size is None:
+                text_size = size
+            elapsed, events = measure(path)
+            # Throughput in bytes of uncompressed text, the common unit.
+            print(f'{name:<20} {size:>12} {text_size / size:>6.1f}x '
+                  f'{elapsed:>8.2f}s {events / elapsed:>12.0f} '
+                  f'{text_size / elapsed / (1 << 20):>8.1f}')
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+Times and memory-profiles each stage of the analysis on a synthetic
+program, and stores the results as JSON to compare commits.
+
+Usage: python -m benchmarks.harness [--output result.json]
+                                    [--baseline previous.json]
+                                    [--functions N] [--events N] ...
+"""
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from benchmarks.synthetic import add_arguments, from_arguments
+from hoshingak.core.symbol import SymbolTable
+from hoshingak.core.graph import CallGraph
+
+LEVELS = (1, 2, 3)
+
+
+def stages(paths, directory):
+    """
+    Yields (name, function) in pipeline order.
+    Each function runs one stage on the state left by the previous ones.
+    """
+    state = dict()
+
+    def load():
+        state['symtab'] = SymbolTable(paths['symbols'], paths['decoded'])
+
+    def create():
+        for symbol in state['symtab'].values():
+            symbol.call_count = 0
+        state['graph'] = CallGraph(state['symtab'])
+        state['graph'].create(paths['trace'])
+
+    yield 'load', load
+    yield 'create', create
+
+    # Every level starts from a graph of its own.
+    for level in LEVELS:
+        yield f'prepare_{level}', create
+
+        def sensitivity(level=level):
+            state['graph'].set_sensitivity(level=level)
+        yield f'set_sensitivity_{level}', sensitivity
+
+    yield 'create_for_output', create
+
+    def coverage():
+        with open(os.devnull, 'w') as devnull, \
+                contextlib.redirect_stdout(devnull):
+            state['graph'].check_coverage()
+    yield 'check_coverage', coverage
+
+    def frequency():
+        state['graph'].normalize_frequency()
+    yield 'normalize_frequency', frequency
+
+    def draw():
+        # Layout by Graphviz is not part of hoshingak.
+        state['graph'].draw(os.path.join(directory, 'graph'), format='dot')
+    yield 'draw', draw
+
+
+def run(paths, directory, memory: bool):
+    """
+    :param memory: traces allocations to measure the peak of each stage.
+    Timings are only taken without tracing, which slows down Python.
+    """
+    results = dict()
+    gc.collect()
+    if memory:
+        tracemalloc.start()
+    try:
+        for name, stage in stages(paths, directory):
+            if memory:
+                tracemalloc.reset_peak()
+                before, _ = tracemalloc.get_traced_memory()
+            start = time.perf_counter()
+            stage()
+            elapsed = time.perf_counter() - start
+            if memory:
+                _, peak = tracemalloc.get_traced_memory()
+                results[name] = peak - before
+            else:
+                results[name] = elapsed
+    finally:
+        if memory:
+            tracemalloc.stop()
+    return results
+
+
+def revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(result, baseline):
+    print(f'{"stage":<22} {"baseline":>10} {"current":>10} {"change":>8}')
+    for name, stage in result['stages'].items():
+        try:
+            previous = baseline['stages'][name]['seconds']
+        except KeyError:
+            continue
+        change = (stage['seconds'] / previous - 1) * 100 if previous else 0
+        print(f'{name:<22} {previous:>9.3f}s {stage["seconds"]:>9.3f}s '
+              f'{change:>+7.1f}%')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_arguments(parser)
+    parser.add_argument('--output', help='JSON file, default to stdout.')
+    parser.add_argument('--baseline', help='JSON file of a previous run.')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the memory profile.')
+    args = parser.parse_args()
+
+    program = from_arguments(args)
+    with tempfile.TemporaryDirectory() as directory:
+        paths = program.write(directory)
+        seconds = run(paths, directory, memory=False)
+        peaks = dict() if args.no_memory else \
+            run(paths, directory, memory=True)
+
+    result = {
+        'revision': revision(),
+        'python': platform.python_version(),
+        'config': program.config(),
+        'stages': {name: {'seconds': round(elapsed, 6),
+                          'peak_bytes': peaks.get(name)}
+                   for name, elapsed in seconds.items()
+                   if not name.startswith(('prepare_', 'create_for_'))},
+    }
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            fp.write(text + '\n')
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            compare(result, json.load(fp))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
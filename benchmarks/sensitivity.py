@@ -0,0 +1,106 @@
+"""
+Times CallGraph._merge_nodes, CallGraph._link_nodes and
+CallGraph._gather_nodes on synthetic graphs
+of growing size. The time per node should stay flat.
+
+Usage: python -m benchmarks.sensitivity [--max-nodes N]
+"""
+import argparse
+import gc
+import time
+from hoshingak.core.symbol import Symbol, SymbolTable
+from hoshingak.core.graph import CallGraph, CallGraphNode
+
+
+def build_graph(blocks, chain_length=4):
+    """
+    Each block is the following, where 'a' is called at 3 call sites of main.
+        main -> a#1, a#2, a#3 -> b -> c1 -> ... -> cN
+    """
+    table = SymbolTable(symbol_file=None, decoded_file=None)
+    graph = CallGraph(table)
+    address = 0x1000
+    call_site = 1
+
+    def new_symbol(name):
+        nonlocal address
+        symbol = Symbol.from_values('bench', address, 'global', 'F',
+                                    '.text', 0x10, name)
+        table[address] = symbol
+        address += 0x10
+        return symbol
+
+    def new_node(symbol):
+        nonlocal call_site
+        node = CallGraphNode(symbol, call_site)
+        graph.nodes[call_site] = node
+        call_site += 1
+        return node
+
+    graph.root = CallGraphNode(new_symbol('main'), 0)
+    graph.nodes[0] = graph.root
+    for block in range(blocks):
+        caller = new_symbol(f'a{block}')
+        callee = new_node(new_symbol(f'b{block}'))
+        for _ in range(3):
+            node = new_node(caller)
+            graph.root.link(node)
+            node.link(callee)
+
+        previous = callee
+        for index in range(chain_length):
+            node = new_node(new_symbol(f'c{block}_{index}'))
+            previous.link(node)
+            previous = node
+
+    return graph
+
+
+def measure(nodes):
+    # 3 + 1 + 4 nodes per block.
+    graph = build_graph(nodes // 8)
+    # Gathering replaces the graph, so it runs on a graph of its own.
+    gathered = build_graph(nodes // 8)
+    size = graph.size
+    # As timeit does, keep the cyclic collector from scanning the
+    # whole heap in the middle of a measurement.
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        graph._merge_nodes()
+        merge = time.perf_counter() - start
+        start = time.perf_counter()
+        graph._link_nodes()
+        link = time.perf_counter() - start
+        start = time.perf_counter()
+        gathered._gather_nodes()
+        gather = time.perf_counter() - start
+    finally:
+        gc.enable()
+    return size, merge, link, gather
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--max-nodes', type=int, default=100000)
+    args = parser.parse_args()
+
+    sizes = []
+    nodes = args.max_nodes
+    while nodes >= args.max_nodes // 8:
+        sizes.insert(0, nodes)
+        nodes //= 2
+
+    print(f'{"nodes":>8} {"merge":>10} {"link":>10} {"gather":>10} '
+          f'{"merge/node":>12} {"link/node":>12} {"gather/node":>12}')
+    for nodes in sizes:
+        size, merge, link, gather = measure(nodes)
+        print(f'{size:>8} {merge * 1000:>8.1f}ms {link * 1000:>8.1f}ms '
+              f'{gather * 1000:>8.1f}ms '
+              f'{merge / size * 1e6:>10.2f}us {link / size * 1e6:>10.2f}us '
+              f'{gather / size * 1e6:>10.2f}us')
+
+
+if __name__ == '__main__':
+    main()
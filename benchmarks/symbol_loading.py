@@ -0,0 +1,81 @@
+"""
+Compares the objdump and the ELF loaders of SymbolTable.
+
+Usage: python -m benchmarks.symbol_loading [a.out] [--functions N]
+Without an executable, a program with N functions is generated and compiled.
+"""
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+from hoshingak.core.symbol import SymbolTable
+
+
+def generate_program(directory, functions, units):
+    """
+    Writes 'units' C files holding 'functions' functions in total
+    and compiles them with debugging information.
+    """
+    sources = []
+    per_unit = max(1, functions // units)
+    for unit in range(units):
+        path = os.path.join(directory, f'unit{unit}.c')
+        with open(path, 'w') as fp:
+            for index in range(per_unit):
+                fp.write(f'int unit{unit}_fn{index}(int x) '
+                         f'{{ return x * {index + 1} + {unit}; }}\n')
+        sources.append(path)
+
+    main = os.path.join(directory, 'main.c')
+    with open(main, 'w') as fp:
+        fp.write('int main(void) { return 0; }\n')
+    sources.append(main)
+
+    executable = os.path.join(directory, 'a.out')
+    subprocess.check_call(['gcc', '-g', '-O0', '-o', executable, *sources])
+    return executable
+
+
+def measure(load, repeat):
+    best = None
+    table = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        table = load()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, table
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('executable', nargs='?')
+    parser.add_argument('--functions', type=int, default=20000)
+    parser.add_argument('--units', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        executable = args.executable or generate_program(
+            directory, args.functions, args.units)
+        size = os.path.getsize(executable)
+        objdump_time, objdump_table = measure(
+            lambda: SymbolTable.load(executable, loader='objdump'),
+            args.repeat)
+        elf_time, elf_table = measure(
+            lambda: SymbolTable.load(executable, loader='elf'), args.repeat)
+
+    same = (objdump_table.prefixes == elf_table.prefixes
+            and {k: str(v) for k, v in objdump_table.items()}
+            == {k: str(v) for k, v in elf_table.items()})
+    print(f'{executable}: {size} bytes, {len(elf_table)} functions, '
+          f'{len(elf_table.prefixes)} compilation units')
+    print(f'objdump: {objdump_time * 1000:.1f}ms')
+    print(f'elf:     {elf_time * 1000:.1f}ms '
+          f'({objdump_time / elf_time:.1f}x)')
+    print(f'identical tables: {same}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""
+Generates the inputs of hoshingak without a compiler: the output of
+'objdump -t' and 'objdump -WL' for a synthetic program, and a
+finstrument.txt trace of its execution.
+
+Usage: python -m benchmarks.synthetic DIRECTORY [--functions N] [--events N]
+"""
+import argparse
+import os
+import random
+from typing import List
+
+TEXT_BASE = 0x1000
+FUNCTION_SIZE = 0x40
+# Return address of main in the C library.
+LIBC_CALL_SITE = 0x7f0000029d90
+
+
+class SyntheticProgram:
+    """
+    Functions are laid out back to back, unit by unit. Each function
+    calls 'fanout' others picked at random, and itself with the
+    probability 'recursion'. The trace is a random walk over these calls.
+    """
+
+    def __init__(self, functions: int = 1000, units: int = 10,
+                 depth: int = 16, fanout: int = 4, recursion: float = 0.05,
+                 events: int = 100000, seed: int = 0):
+        """
+        :param functions: number of functions, main included.
+        :param units: number of compilation units.
+        :param depth: maximum call depth of the trace.
+        :param fanout: number of callees of each function.
+        :param recursion: probability that a call is recursive.
+        :param events: approximate number of enter and exit events.
+        :param seed: the same seed generates the same files.
+        """
+        if functions < 2 or units < 1 or units > functions:
+            raise ValueError('Need at least 2 functions and '
+                             'between 1 and functions units.')
+
+        self.functions = functions
+        self.units = units
+        self.depth = depth
+        self.fanout = fanout
+        self.recursion = recursion
+        self.events = events
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.callees: List[List[int]] = [
+            self.random.sample(range(1, functions), min(fanout, functions - 1))
+            for _ in range(functions)]
+
+    def address(self, function: int) -> int:
+        return TEXT_BASE + function * FUNCTION_SIZE
+
+    def name(self, function: int) -> str:
+        return 'main' if function == 0 else f'fn{function}'
+
+    def unit_functions(self, unit: int) -> range:
+        per_unit = self.functions // self.units
+        stop = self.functions if unit == self.units - 1 \
+            else (unit + 1) * per_unit
+        return range(unit * per_unit, stop)
+
+    def write_symbols(self, path):
+        """
+        Same layout as 'objdump -t'.
+        """
+        with open(path, 'w') as fp:
+            fp.write('\nprogram:     file format elf64-x86-64\n\n'
+                     'SYMBOL TABLE:\n')
+            for function in range(self.functions):
+                scope = 'g' if function % 3 == 0 else 'l'
+                fp.write(f'{self.address(function):016x} {scope}     F '
+                         f'.text\t{FUNCTION_SIZE:016x}              '
+                         f'{self.name(function)}\n')
+
+    def write_decoded_line(self, path):
+        """
+        Same layout as 'objdump -WL', with a few lines per function.
+        """
+        with open(path, 'w') as fp:
+            fp.write('\nprogram:     file format elf64-x86-64\n\n'
+                     'Contents of the .debug_line section:\n\n')
+            for unit in range(self.units):
+                source = f'unit{unit}.c'
+                fp.write(f'CU: ./{source}:\n'
+                         f'File name                            Line number'
+                         f'    Starting address    View    Stmt\n')
+                functions = self.unit_functions(unit)
+                line = 1
+                for function in functions:
+                    for offset in range(0, FUNCTION_SIZE, 0x10):
+                        fp.write(f'{source:<38}{line:>8}'
+                                 f'{hex(self.address(function) + offset):>20}'
+                                 f'               x\n')
+                        line += 1
+                end = self.address(functions[-1]) + FUNCTION_SIZE
+                fp.write(f'{source:<38}{"-":>8}{hex(end):>20}\n\n\n')
+
+    def write_trace(self, path, thread: int = 1):
+        """
+        Same layout as finstrument.txt.
+        """
+        rand = self.random
+        time = 1 << 40
+        # Each frame is (function, call site).
+        stack = [(0, LIBC_CALL_SITE)]
+        with open(path, 'w') as fp:
+            def record(function, call_site, flag):
+                fp.write(f'{hex(self.address(function))} {hex(call_site)} '
+                         f'{flag} {time} {thread}\n')
+
+            record(0, LIBC_CALL_SITE, 'E')
+            # Leave room for unwinding the stack at the end.
+            for _ in range(self.events - 1 - self.depth * 2):
+                time += rand.randint(1, 100)
+                caller = stack[-1][0]
+                if len(stack) == 1 or (len(stack) < self.depth
+                                       and rand.random() < 0.5):
+                    index = rand.randrange(len(self.callees[caller]))
+                    callee = self.callees[caller][index]
+                    if len(stack) > 1 and rand.random() < self.recursion:
+                        # The recursive call has its own instruction,
+                        # after those of the callees.
+                        callee = caller
+                        index = len(self.callees[caller])
+                    # A call instruction in the caller per callee.
+                    call_site = self.address(caller) + 5 + 4 * index
+                    stack.append((callee, call_site))
+                    record(callee, call_site, 'E')
+                else:
+                    callee, call_site = stack.pop()
+                    record(callee, call_site, 'X')
+
+            while stack:
+                time += rand.randint(1, 100)
+                callee, call_site = stack.pop()
+                record(callee, call_site, 'X')
+
+    def write(self, directory) -> dict:
+        """
+        :return: paths of the symbol table, line table and trace files.
+        """
+        os.makedirs(directory, exist_ok=True)
+        paths = {
+            'symbols': os.path.join(directory, 'symbols.objdump'),
+            'decoded': os.path.join(directory, 'debug_line.objdump'),
+            'trace': os.path.join(directory, 'finstrument.txt'),
+        }
+        self.write_symbols(paths['symbols'])
+        self.write_decoded_line(paths['decoded'])
+        self.write_trace(paths['trace'])
+        return paths
+
+    def config(self) -> dict:
+        return {
+            'functions': self.functions,
+            'units': self.units,
+            'depth': self.depth,
+            'fanout': self.fanout,
+            'recursion': self.recursion,
+            'events': self.events,
+            'seed': self.seed,
+        }
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--functions', type=int, default=1000)
+    parser.add_argument('--units', type=int, default=10)
+    parser.add_argument('--depth', type=int, default=16)
+    parser.add_argument('--fanout', type=int, default=4)
+    parser.add_argument('--recursion', type=float, default=0.05)
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def from_arguments(args: argparse.Namespace) -> SyntheticProgram:
+    return SyntheticProgram(functions=args.functions, units=args.units,
+                            depth=args.depth, fanout=args.fanout,
+                            recursion=args.recursion, events=args.events,
+                            seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('directory')
+    add_arguments(parser)
+    args = parser.parse_args()
+    for name, path in from_arguments(args).write(args.directory).items():
+        print(f'{name}: {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,55 +1,702 @@
 #include "injection.h"
 #include <stdio.h>
 #include <stdint.h>
+#include <inttypes.h>
 #include <stdlib.h>
+#include <string.h>
 
 #include <time.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <pthread.h>
+#include <sys/syscall.h>
+#include <sys/types.h>
+#include <zlib.h>
 
 #define __USE_GNU
 #include <dlfcn.h>
 
+/* Number of records held in memory with HOSHINGAK_MODE=buffered. */
+#define FINSTRUMENT_BUFFER_RECORDS (1 << 16)
+/* Address ranges of HOSHINGAK_INCLUDE and HOSHINGAK_EXCLUDE. */
+#define FINSTRUMENT_MAX_RANGES 64
+/* Depth up to which the decision of each call is kept for its exit. */
+#define FINSTRUMENT_TRACKED_DEPTH 4096
+/* Sampling counters, shared by functions whose addresses collide. */
+#define FINSTRUMENT_SAMPLE_SLOTS 4096
+/* No call of the thread is skipped or sampled. Deeper than any call. */
+#define FINSTRUMENT_NO_DEPTH ((unsigned long)-1)
+/* Length of the trace path once HOSHINGAK_OUTPUT is expanded. */
+#define FINSTRUMENT_MAX_PATH 4096
+
+struct address_range {
+	uint64_t start;
+	uint64_t end;
+};
+
 static FILE *finstrument_fp = NULL;
 
+/* State of HOSHINGAK_MODE=buffered. */
+static int finstrument_fd = -1;
+static void *load_base = NULL;
+static size_t buffer_records = FINSTRUMENT_BUFFER_RECORDS;
+static pthread_key_t buffer_key;
+/* zlib level of HOSHINGAK_COMPRESS, 0 when not compressed. */
+static int compress_level = 0;
+
+/*
+ * Record-time filters, read from the environment in main_constructor.
+ * Addresses are relative to the load base, as in the trace.
+ */
+static int filtering = 0;
+static struct address_range include_ranges[FINSTRUMENT_MAX_RANGES];
+static size_t include_count = 0;
+static struct address_range exclude_ranges[FINSTRUMENT_MAX_RANGES];
+static size_t exclude_count = 0;
+static unsigned long max_depth = 0;
+static unsigned long sample_rate = 1;
+
+/*
+ * Process of the trace, written after the header of every trace.
+ * See FINSTRUMENT_PROCESS in injection.h.
+ */
+static int forked = 0;
+static int64_t fork_time = 0;
+static uint32_t fork_thread = 0;
+
+/*
+ * Each thread fills its own buffer, so the hooks never take a lock.
+ * Buffers are appended to the file as a whole and records stay intact.
+ */
+static __thread struct finstrument_record *buffer = NULL;
+static __thread size_t buffer_used = 0;
+static __thread uint32_t thread_id = 0;
+
+/* Call depth of the thread and whether each open call was recorded. */
+static __thread unsigned long depth = 0;
+static __thread uint8_t recorded[FINSTRUMENT_TRACKED_DEPTH];
+static __thread uint32_t sample_counters[FINSTRUMENT_SAMPLE_SLOTS];
+/*
+ * Depth of the open call that was not sampled, whose callees are skipped
+ * too, and of the open sampled call, whose callees are all recorded.
+ */
+static __thread unsigned long skipped_depth = FINSTRUMENT_NO_DEPTH;
+static __thread unsigned long sampled_depth = FINSTRUMENT_NO_DEPTH;
+
 static void fprint_dlinfo(void *this_fn, void *call_site, char flag)
 	__attribute__ ((no_instrument_function));
+static void fwrite_dlinfo(void *this_fn, void *call_site, char flag)
+	__attribute__ ((no_instrument_function));
+static void buffer_dlinfo(void *this_fn, void *call_site, char flag)
+	__attribute__ ((no_instrument_function));
+static void open_buffered(void)
+	__attribute__ ((no_instrument_function));
+static void open_output(void)
+	__attribute__ ((no_instrument_function));
+static void output_path(char *path, size_t size, const char *fallback)
+	__attribute__ ((no_instrument_function));
+static void init_process(struct finstrument_record *record)
+	__attribute__ ((no_instrument_function));
+static void prepare_fork(void)
+	__attribute__ ((no_instrument_function));
+static void reopen_in_child(void)
+	__attribute__ ((no_instrument_function));
+static void flush_buffer(void)
+	__attribute__ ((no_instrument_function));
+static void write_frame(const void *data, size_t size)
+	__attribute__ ((no_instrument_function));
+static void write_all(const void *data, size_t size)
+	__attribute__ ((no_instrument_function));
+static void init_header(struct finstrument_header *header, uint32_t flags)
+	__attribute__ ((no_instrument_function));
+static void read_filters(void)
+	__attribute__ ((no_instrument_function));
+static size_t read_ranges(const char *name, struct address_range *ranges)
+	__attribute__ ((no_instrument_function));
+static unsigned long read_limit(const char *name, unsigned long fallback)
+	__attribute__ ((no_instrument_function));
+static char accept_enter(void *this_fn)
+	__attribute__ ((no_instrument_function));
+static int accept_exit(void *this_fn)
+	__attribute__ ((no_instrument_function));
+static int in_ranges(void *this_fn)
+	__attribute__ ((no_instrument_function));
+static void release_buffer(void *data)
+	__attribute__ ((no_instrument_function));
+static uint32_t current_thread(void)
+	__attribute__ ((no_instrument_function));
+static int64_t current_time(void)
+	__attribute__ ((no_instrument_function));
+
+/* One of fprint_dlinfo (text), fwrite_dlinfo (binary) or buffer_dlinfo. */
+static void (*record_dlinfo)(void *, void *, char) = fprint_dlinfo;
 
 void main_constructor(void)
 {
+	read_filters();
+
 	/*
-	 * Write result to disk.
-	 * Close at exit.
+	 * Compressed frames are written by the buffered mode only.
+	 * 0 or an empty value turns compression off.
 	 */
-	finstrument_fp = fopen("finstrument.txt", "w");
-	if (finstrument_fp == NULL)
+	const char *level = getenv("HOSHINGAK_COMPRESS");
+	if (level != NULL && *level != '\0')
 	{
-		fprintf(stderr, "Fail to create finstrument.txt.\n");
-		exit(EXIT_FAILURE);
+		char *end;
+		compress_level = (int)strtol(level, &end, 10);
+		/* Anything but a zlib level, e.g. 'yes', is the fastest one. */
+		if (*end != '\0' || compress_level < 0 || compress_level > 9)
+			compress_level = Z_BEST_SPEED;
+	}
+
+	const char *mode = getenv("HOSHINGAK_MODE");
+	if (compress_level > 0 || (mode != NULL && strcmp(mode, "buffered") == 0))
+	{
+		open_buffered();
+	}
+	else
+	{
+		const char *format = getenv("HOSHINGAK_FORMAT");
+		if (format != NULL && strcmp(format, "binary") == 0)
+			record_dlinfo = fwrite_dlinfo;
+		open_output();
+	}
+
+	/* A forked child writes a trace of its own. */
+	pthread_atfork(prepare_fork, NULL, reopen_in_child);
+}
+
+/*
+ * Write result to disk.
+ * Close at exit.
+ */
+static void open_output(void)
+{
+	char path[FINSTRUMENT_MAX_PATH];
+	output_path(path, sizeof(path), record_dlinfo == fprint_dlinfo
+			? "finstrument.txt" : "finstrument.bin");
+
+	if (record_dlinfo == buffer_dlinfo)
+	{
+		/* O_APPEND keeps the buffers of concurrent threads apart. */
+		finstrument_fd = open(path,
+				O_WRONLY | O_CREAT | O_TRUNC | O_APPEND, 0644);
+		if (finstrument_fd == -1)
+		{
+			fprintf(stderr, "Fail to create %s.\n", path);
+			exit(EXIT_FAILURE);
+		}
 	}
+	else
+	{
+		finstrument_fp = fopen(path, "w");
+		if (finstrument_fp == NULL)
+		{
+			fprintf(stderr, "Fail to create %s.\n", path);
+			exit(EXIT_FAILURE);
+		}
+	}
+
+	if (record_dlinfo == fprint_dlinfo)
+	{
+		/*
+		 * The reader scales the counts of a sampled trace and links
+		 * the traces of forked processes.
+		 */
+		struct finstrument_record record;
+		init_process(&record);
+		fprintf(finstrument_fp,
+				"# hoshingak sample=%lu max_depth=%lu filtered=%d"
+				" pid=%" PRIu64 " ppid=%" PRIu64
+				" fork_time=%" PRId64 " fork_thread=%u\n",
+				sample_rate, max_depth,
+				include_count > 0 || exclude_count > 0,
+				record.address, record.call_site,
+				record.time, record.thread);
+		return;
+	}
+
+	struct finstrument_header header;
+	struct finstrument_record record;
+	init_header(&header, FINSTRUMENT_MONOTONIC
+			| (compress_level > 0 ? FINSTRUMENT_COMPRESSED : 0)
+			| FINSTRUMENT_PROCESS);
+	init_process(&record);
+	if (record_dlinfo == buffer_dlinfo)
+	{
+		write_all(&header, sizeof(header));
+		write_all(&record, sizeof(record));
+	}
+	else
+	{
+		fwrite(&header, sizeof(header), 1, finstrument_fp);
+		fwrite(&record, sizeof(record), 1, finstrument_fp);
+	}
+}
+
+/*
+ * HOSHINGAK_OUTPUT is the path of the trace, where
+ * %p is the pid, %t the time in seconds since the Epoch,
+ * %g the value of HOSHINGAK_TAG and %% a '%'.
+ * A forked child appends its pid if the path has no %p.
+ */
+static void output_path(char *path, size_t size, const char *fallback)
+{
+	const char *template = getenv("HOSHINGAK_OUTPUT");
+	if (template == NULL || *template == '\0')
+		template = fallback;
+
+	const char *tag = getenv("HOSHINGAK_TAG");
+	int has_pid = 0;
+	size_t used = 0;
+	const char *cursor;
+	for (cursor = template; *cursor != '\0' && used + 1 < size; cursor++)
+	{
+		if (*cursor != '%' || cursor[1] == '\0')
+		{
+			path[used++] = *cursor;
+			continue;
+		}
+
+		switch (*++cursor)
+		{
+		case 'p':
+			used += snprintf(path + used, size - used, "%d", (int)getpid());
+			has_pid = 1;
+			break;
+		case 't':
+			used += snprintf(path + used, size - used, "%lld",
+					(long long)time(NULL));
+			break;
+		case 'g':
+			used += snprintf(path + used, size - used, "%s",
+					tag != NULL ? tag : "");
+			break;
+		case '%':
+			path[used++] = '%';
+			break;
+		default:
+			path[used++] = '%';
+			if (used + 1 < size)
+				path[used++] = *cursor;
+			break;
+		}
+		/* snprintf returns the length it would have written. */
+		if (used >= size)
+			used = size - 1;
+	}
+
+	if (forked && !has_pid)
+	{
+		used += snprintf(path + used, size - used, ".%d", (int)getpid());
+		if (used >= size)
+			used = size - 1;
+	}
+	path[used] = '\0';
+}
+
+static void init_process(struct finstrument_record *record)
+{
+	memset(record, 0, sizeof(*record));
+	record->address = (uint64_t)getpid();
+	record->call_site = (uint64_t)getppid();
+	record->flag = 'P';
+	if (forked)
+	{
+		record->time = fork_time;
+		record->thread = fork_thread;
+	}
+}
+
+/*
+ * Records held in stdio or in the buffer of the forking thread are
+ * written before fork(), so that the child does not write them again.
+ */
+static void prepare_fork(void)
+{
+	if (record_dlinfo == buffer_dlinfo)
+	{
+		if (buffer != NULL && finstrument_fd != -1)
+			flush_buffer();
+	}
+	else if (finstrument_fp != NULL)
+	{
+		fflush(finstrument_fp);
+	}
+}
+
+/*
+ * The child keeps the call stack of the forking thread: its first
+ * records are the exits of the calls open at the fork.
+ */
+static void reopen_in_child(void)
+{
+	/* Forked after main_destructor. */
+	if (finstrument_fd == -1 && finstrument_fp == NULL)
+		return;
+
+	forked = 1;
+	fork_time = current_time();
+	fork_thread = thread_id;
+	/* The child is a new thread with a new id. */
+	thread_id = 0;
+
+	if (record_dlinfo == buffer_dlinfo)
+	{
+		close(finstrument_fd);
+	}
+	else
+	{
+		/*
+		 * Records buffered by other threads after prepare_fork belong
+		 * to the parent: closing the descriptor first drops them.
+		 */
+		close(fileno(finstrument_fp));
+		fclose(finstrument_fp);
+	}
+	open_output();
 }
 
 void main_destructor(void)
 {
+	if (record_dlinfo == buffer_dlinfo)
+	{
+		/*
+		 * Buffers of the other threads are flushed when they exit.
+		 * Threads still running at this point lose their last buffer.
+		 */
+		release_buffer(buffer);
+		pthread_setspecific(buffer_key, NULL);
+		close(finstrument_fd);
+		finstrument_fd = -1;
+		return;
+	}
+
+	/* Not opened when main_constructor exits on a bad setting. */
+	if (finstrument_fp == NULL)
+		return;
 	fclose(finstrument_fp);
+	finstrument_fp = NULL;
 }
 
 void __cyg_profile_func_enter(void *this_fn, void *call_site)
 {
-	fprint_dlinfo(this_fn, call_site, 'E');
+	char flag = 'E';
+	if (filtering && (flag = accept_enter(this_fn)) == 0)
+		return;
+	record_dlinfo(this_fn, call_site, flag);
 }
 
 void __cyg_profile_func_exit(void *this_fn, void *call_site)
 {
-	fprint_dlinfo(this_fn, call_site, 'X');
+	if (filtering && !accept_exit(this_fn))
+		return;
+	record_dlinfo(this_fn, call_site, 'X');
+}
+
+/*
+ * HOSHINGAK_INCLUDE=start-end,...	record only these address ranges.
+ * HOSHINGAK_EXCLUDE=start-end,...	do not record these address ranges.
+ * HOSHINGAK_MAX_DEPTH=n		record calls up to depth n.
+ * HOSHINGAK_SAMPLE=n			record 1 in n calls of each function.
+ *
+ * The first n calls of each function are recorded as usual. Then 1 in n
+ * calls is recorded with the flag 'S' and stands for n calls, with all
+ * of its callees. The callees of the other calls are not recorded, so
+ * that they are not attached to a caller that did not call them.
+ */
+static void read_filters(void)
+{
+	include_count = read_ranges("HOSHINGAK_INCLUDE", include_ranges);
+	exclude_count = read_ranges("HOSHINGAK_EXCLUDE", exclude_ranges);
+
+	max_depth = read_limit("HOSHINGAK_MAX_DEPTH", 0);
+	sample_rate = read_limit("HOSHINGAK_SAMPLE", 1);
+
+	filtering = include_count > 0 || exclude_count > 0
+		|| max_depth > 0 || sample_rate > 1;
+	if (filtering)
+	{
+		Dl_info info = { 0 };
+		dladdr((void *)main_constructor, &info);
+		load_base = info.dli_fbase;
+	}
+}
+
+static size_t read_ranges(const char *name, struct address_range *ranges)
+{
+	const char *value = getenv(name);
+	size_t count = 0;
+	while (value != NULL && *value != '\0'
+			&& count < FINSTRUMENT_MAX_RANGES)
+	{
+		char *end;
+		ranges[count].start = strtoull(value, &end, 0);
+		if (*end != '-')
+		{
+			fprintf(stderr, "%s: expected start-end ranges.\n", name);
+			exit(EXIT_FAILURE);
+		}
+		ranges[count].end = strtoull(end + 1, &end, 0);
+		count++;
+		value = *end == ',' ? end + 1 : end;
+	}
+	return count;
+}
+
+/*
+ * The binary header keeps the value in 16 bits,
+ * so a larger one would be read back wrong.
+ */
+static unsigned long read_limit(const char *name, unsigned long fallback)
+{
+	const char *value = getenv(name);
+	if (value == NULL || atol(value) <= (long)fallback)
+		return fallback;
+	if (atol(value) > UINT16_MAX)
+	{
+		fprintf(stderr, "%s: must be at most %u.\n", name, UINT16_MAX);
+		exit(EXIT_FAILURE);
+	}
+	return atol(value);
+}
+
+static int in_ranges(void *this_fn)
+{
+	uint64_t address = (uint64_t)(this_fn - load_base);
+	size_t index;
+	for (index = 0; index < exclude_count; index++)
+		if (exclude_ranges[index].start <= address
+				&& address < exclude_ranges[index].end)
+			return 0;
+
+	if (include_count == 0)
+		return 1;
+	for (index = 0; index < include_count; index++)
+		if (include_ranges[index].start <= address
+				&& address < include_ranges[index].end)
+			return 1;
+	return 0;
+}
+
+/*
+ * :return: the flag of the enter record, or 0 if the call is not recorded.
+ */
+static char accept_enter(void *this_fn)
+{
+	unsigned long level = depth++;
+	if (level > skipped_depth)
+		return 0;
+
+	int accept = (max_depth == 0 || level < max_depth) && in_ranges(this_fn);
+	if (level >= FINSTRUMENT_TRACKED_DEPTH)
+		/* Not sampled, since the exit could not tell. */
+		return accept ? 'E' : 0;
+
+	char flag = accept ? 'E' : 0;
+	if (accept && sample_rate > 1 && sampled_depth == FINSTRUMENT_NO_DEPTH)
+	{
+		size_t slot = ((uintptr_t)this_fn >> 4)
+			& (FINSTRUMENT_SAMPLE_SLOTS - 1);
+		uint32_t count = sample_counters[slot]++;
+		if (count >= sample_rate && count % sample_rate == 0)
+		{
+			flag = 'S';
+			sampled_depth = level;
+		}
+		else if (count >= sample_rate)
+		{
+			flag = 0;
+			skipped_depth = level;
+		}
+	}
+	recorded[level] = flag != 0;
+	return flag;
+}
+
+static int accept_exit(void *this_fn)
+{
+	/* Exits of the calls entered before main_constructor. */
+	if (depth == 0)
+		return 0;
+
+	unsigned long level = --depth;
+	if (level >= skipped_depth)
+	{
+		if (level == skipped_depth)
+			skipped_depth = FINSTRUMENT_NO_DEPTH;
+		return 0;
+	}
+	if (level == sampled_depth)
+		sampled_depth = FINSTRUMENT_NO_DEPTH;
+	if (level < FINSTRUMENT_TRACKED_DEPTH)
+		return recorded[level];
+	return (max_depth == 0 || level < max_depth) && in_ranges(this_fn);
 }
 
 static void fprint_dlinfo(void *this_fn, void *call_site, char flag)
 {
 	Dl_info info = { 0 };
 	dladdr(this_fn, &info);
-	struct timespec spec;
-	clock_gettime(CLOCK_REALTIME, &spec);
-	fprintf(finstrument_fp, "%p %p %c %ld\n",
+	fprintf(finstrument_fp, "%p %p %c %" PRId64 " %u\n",
 			(this_fn - info.dli_fbase),
 			(call_site - info.dli_fbase),
-			flag, spec.tv_nsec);
+			flag, current_time(), current_thread());
+}
+
+static void fwrite_dlinfo(void *this_fn, void *call_site, char flag)
+{
+	Dl_info info = { 0 };
+	dladdr(this_fn, &info);
+	struct finstrument_record record = {
+		.address = (uint64_t)(this_fn - info.dli_fbase),
+		.call_site = (uint64_t)(call_site - info.dli_fbase),
+		.time = current_time(),
+		.flag = flag,
+		.thread = current_thread(),
+	};
+	fwrite(&record, sizeof(record), 1, finstrument_fp);
+}
+
+/*
+ * Low-overhead recording:
+ * the load base is resolved once and raw records are written with write(2) only when the buffer is full.
+ */
+static void open_buffered(void)
+{
+	Dl_info info = { 0 };
+	dladdr((void *)main_constructor, &info);
+	load_base = info.dli_fbase;
+
+	const char *size = getenv("HOSHINGAK_BUFFER_RECORDS");
+	if (size != NULL && atol(size) > 0)
+		buffer_records = atol(size);
+
+	/* Flush the buffer of a thread when it exits. */
+	pthread_key_create(&buffer_key, release_buffer);
+
+	record_dlinfo = buffer_dlinfo;
+	open_output();
+}
+
+static void buffer_dlinfo(void *this_fn, void *call_site, char flag)
+{
+	/* Functions running after main_destructor are not recorded. */
+	if (finstrument_fd == -1)
+		return;
+
+	if (buffer == NULL)
+	{
+		buffer = calloc(buffer_records, sizeof(*buffer));
+		if (buffer == NULL)
+		{
+			fprintf(stderr, "Fail to allocate the trace buffer.\n");
+			exit(EXIT_FAILURE);
+		}
+		pthread_setspecific(buffer_key, buffer);
+	}
+
+	struct finstrument_record *record = &buffer[buffer_used];
+	record->address = (uint64_t)(this_fn - load_base);
+	record->call_site = (uint64_t)(call_site - load_base);
+	record->time = current_time();
+	record->flag = flag;
+	record->thread = current_thread();
+
+	if (++buffer_used == buffer_records)
+		flush_buffer();
+}
+
+static void release_buffer(void *data)
+{
+	if (data == NULL)
+		return;
+
+	flush_buffer();
+	free(buffer);
+	buffer = NULL;
+}
+
+static void flush_buffer(void)
+{
+	if (compress_level > 0)
+		write_frame(buffer, buffer_used * sizeof(*buffer));
+	else
+		write_all(buffer, buffer_used * sizeof(*buffer));
+	buffer_used = 0;
+}
+
+/*
+ * The frame and its data are written at once,
+ * so frames of concurrent threads do not interleave.
+ */
+static void write_frame(const void *data, size_t size)
+{
+	if (size == 0)
+		return;
+
+	uLongf compressed = compressBound(size);
+	struct finstrument_frame *frame = malloc(sizeof(*frame) + compressed);
+	if (frame == NULL)
+	{
+		fprintf(stderr, "Fail to allocate the compression buffer.\n");
+		return;
+	}
+
+	if (compress2((Bytef *)(frame + 1), &compressed, data, size,
+				compress_level) == Z_OK)
+	{
+		frame->size = compressed;
+		frame->raw_size = size;
+		write_all(frame, sizeof(*frame) + compressed);
+	}
+	free(frame);
+}
+
+static void write_all(const void *data, size_t size)
+{
+	const char *cursor = data;
+	while (size > 0)
+	{
+		ssize_t written = write(finstrument_fd, cursor, size);
+		if (written == -1)
+		{
+			perror("finstrument");
+			return;
+		}
+		cursor += written;
+		size -= written;
+	}
+}
+
+static void init_header(struct finstrument_header *header, uint32_t flags)
+{
+	memset(header, 0, sizeof(*header));
+	memcpy(header->magic, FINSTRUMENT_MAGIC, sizeof(header->magic));
+	header->version = FINSTRUMENT_VERSION;
+	header->record_size = sizeof(struct finstrument_record);
+	header->flags = flags;
+	if (sample_rate > 1)
+		header->flags |= FINSTRUMENT_SAMPLED;
+	if (include_count > 0 || exclude_count > 0)
+		header->flags |= FINSTRUMENT_FILTERED;
+	if (max_depth > 0)
+		header->flags |= FINSTRUMENT_DEPTH_LIMITED;
+	header->sample = sample_rate;
+	header->max_depth = max_depth;
+}
+
+static uint32_t current_thread(void)
+{
+	if (thread_id == 0)
+		thread_id = (uint32_t)syscall(SYS_gettid);
+	return thread_id;
+}
+
+/* Nanoseconds from CLOCK_MONOTONIC, which never wraps nor jumps. */
+static int64_t current_time(void)
+{
+	struct timespec spec;
+	clock_gettime(CLOCK_MONOTONIC, &spec);
+	return (int64_t)spec.tv_sec * 1000000000 + spec.tv_nsec;
 }
@@ -1,5 +1,58 @@
 #ifndef INJECTION_H
 #define INJECTION_H
+#include <stdint.h>
+
+/*
+ * Binary trace format, selected with HOSHINGAK_FORMAT=binary
+ * or HOSHINGAK_MODE=buffered.
+ * A header is followed by fixed-width little-endian records.
+ */
+#define FINSTRUMENT_MAGIC "HSGK"
+#define FINSTRUMENT_VERSION 2
+
+/* Header flags. */
+#define FINSTRUMENT_MONOTONIC 0x1	/* time is CLOCK_MONOTONIC in ns. */
+#define FINSTRUMENT_SAMPLED 0x2		/* 'S' calls stand for 'sample' calls. */
+#define FINSTRUMENT_FILTERED 0x4	/* address ranges left out. */
+#define FINSTRUMENT_DEPTH_LIMITED 0x8	/* calls below 'max_depth' left out. */
+#define FINSTRUMENT_COMPRESSED 0x10	/* records in zlib frames. */
+#define FINSTRUMENT_PROCESS 0x20	/* followed by a process record. */
+
+struct finstrument_header {
+	char magic[4];
+	uint16_t version;
+	uint16_t record_size;
+	uint32_t flags;
+	uint16_t sample;	/* 0 or 1 when every call is recorded. */
+	uint16_t max_depth;	/* 0 when the depth is not limited. */
+};
+
+struct finstrument_record {
+	uint64_t address;
+	uint64_t call_site;
+	int64_t time;
+	uint8_t flag;		/* 'E'nter, 'S'ampled enter or e'X'it. */
+	uint8_t padding[3];
+	uint32_t thread;	/* since version 2 */
+};
+
+/*
+ * With FINSTRUMENT_PROCESS, the header is followed by one uncompressed
+ * record whose flag is 'P': address is the pid, call_site the parent pid,
+ * time the time of the fork and thread the thread that called fork() in
+ * the parent. time and thread are 0 if the process was not forked from a
+ * traced process.
+ */
+
+/*
+ * With HOSHINGAK_COMPRESS, the header is followed by frames
+ * instead of records. Each frame holds whole records compressed by zlib.
+ */
+struct finstrument_frame {
+	uint32_t size;		/* compressed bytes following the frame. */
+	uint32_t raw_size;	/* size of the records once inflated. */
+};
+
 void __cyg_profile_func_enter(void *this_fn, void *call_site)
 	__attribute__ ((no_instrument_function));
 void __cyg_profile_func_exit(void *this_fn, void *call_site)
@@ -0,0 +1,68 @@
+/*
+ * Measures the overhead of the injection hooks per recorded event.
+ * Run it once for each recording mode (see 'make bench').
+ */
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+
+#define DEFAULT_CALLS 1000000L
+
+static int sink;
+
+__attribute__ ((noinline))
+static void leaf(int i)
+{
+	sink += i;
+}
+
+__attribute__ ((no_instrument_function))
+static long now(void)
+{
+	struct timespec spec;
+	clock_gettime(CLOCK_MONOTONIC, &spec);
+	return spec.tv_sec * 1000000000L + spec.tv_nsec;
+}
+
+__attribute__ ((no_instrument_function))
+static void baseline(long calls)
+{
+	for (long i = 0; i < calls; i++)
+		sink += i;
+}
+
+int main(int argc, const char *argv[])
+{
+	long calls = argc > 1 ? atol(argv[1]) : DEFAULT_CALLS;
+	const char *mode = getenv("HOSHINGAK_MODE");
+	const char *format = getenv("HOSHINGAK_FORMAT");
+	/*
+	 * Compressed frames are written by the buffered mode.
+	 * As in main_constructor, 0 or an empty value is off.
+	 */
+	const char *level = getenv("HOSHINGAK_COMPRESS");
+	if (level != NULL && *level != '\0')
+	{
+		char *end;
+		if (strtol(level, &end, 10) != 0 || *end != '\0')
+			mode = "compressed";
+	}
+	/* Buffered mode always writes binary records. */
+	if (mode != NULL)
+		format = "binary";
+
+	long start = now();
+	baseline(calls);
+	long bare = now() - start;
+
+	start = now();
+	for (long i = 0; i < calls; i++)
+		leaf(i);
+	long traced = now() - start;
+
+	/* Every call records an enter and an exit event. */
+	printf("mode=%s format=%s: %.1f ns/event (%ld calls, %.3f s)\n",
+			mode ? mode : "stdio", format ? format : "text",
+			(double)(traced - bare) / (2 * calls), calls, traced / 1e9);
+	return 0;
+}
@@ -1,22 +1,66 @@
 import sys
 import os
+from hoshingak.core.cache import SymbolCache
 from hoshingak.core.symbol import SymbolTable
+from hoshingak.core.graph import CallGraph
+from hoshingak.core.trace import Progress
 
 
-def main(executable_object, finstrument_file, level=0):
-    SymbolTable.dump(executable_object)
-    table = SymbolTable()
-    graph = table.create_graph(finstrument_file)
+def main(executable_object, finstrument_file, level=0, loader='objdump',
+         cache=True, follow=False):
+    table = SymbolTable.load(executable_object, loader=loader,
+                             cache=SymbolCache() if cache else None)
+    if follow:
+        # Runs until interrupted with Ctrl-C.
+        graph = CallGraph(table)
+        table.graph = graph
+        graph.follow(finstrument_file)
+    else:
+        graph = table.create_graph(finstrument_file, progress=Progress())
     graph.set_sensitivity(level=level)
     graph.check_coverage()
     graph.draw(f'./test')
 
 
+def diff(before, after, loader='objdump', cache=True):
+    """
+    :param before: (executable file, finstrument.txt) of the baseline.
+    :param after: (executable file, finstrument.txt) to compare with it.
+    """
+    graphs = []
+    for executable_object, finstrument_file in (before, after):
+        table = SymbolTable.load(executable_object, loader=loader,
+                                 cache=SymbolCache() if cache else None)
+        graphs.append(table.create_graph(finstrument_file,
+                                         progress=Progress()))
+    profile_diff = graphs[0].diff(graphs[1])
+    profile_diff.pretty_print()
+    profile_diff.draw(f'./diff')
+
+
 if __name__ == '__main__':
     # Expects two files: executable file and finstrument.txt
-    if len(sys.argv) < 3:
-        print('Usage: ./main.py a.out finstrument.txt')
+    # --follow keeps reading the trace while the program is running.
+    # --diff compares two pairs of them: before and after.
+    if '--diff' in sys.argv:
+        args = [arg for arg in sys.argv if arg != '--diff']
+        if len(args) < 5:
+            print('Usage: ./main.py --diff a.out finstrument.txt '
+                  'b.out finstrument.txt [objdump|elf]')
+            exit(1)
+        diff((args[1], args[2]), (args[3], args[4]),
+             loader=args[5] if len(args) > 5 else 'objdump')
+        exit(0)
+
+    follow = '--follow' in sys.argv
+    args = [arg for arg in sys.argv if arg != '--follow']
+    if len(args) < 3:
+        print('Usage: ./main.py [--follow] a.out finstrument.txt [level] '
+              '[objdump|elf]')
         exit(1)
 
-    main(sys.argv[1], sys.argv[2], level=int(sys.argv[3]))
+    main(args[1], args[2],
+         level=int(args[3]) if len(args) > 3 else 0,
+         loader=args[4] if len(args) > 4 else 'objdump',
+         follow=follow)
 
@@ -0,0 +1,73 @@
+import os
+from multiprocessing import Pool
+from os import PathLike
+from typing import Union, Iterable, Optional, Tuple, List
+from hoshingak.core.store import GraphStore
+from hoshingak.core.trace import open_trace, Progress
+
+BATCHES_PER_PROCESS = 4
+
+
+class EventCounter(Progress):
+    """
+    Counts the events the readers consume without reporting them.
+    """
+
+    def report(self, now: float):
+        pass
+
+
+def build_store(call_traces: List[Union[str, bytes, PathLike]]
+                ) -> Tuple[int, int, GraphStore]:
+    """
+    Partial graph of a batch of traces. Runs in a worker process.
+    :return: number of bytes and events read, and the graph.
+    """
+    store = GraphStore()
+    counter = EventCounter()
+    nbytes = 0
+    for call_trace in call_traces:
+        events = open_trace(call_trace, progress=counter)
+        store.set_metadata(events.metadata)
+        store.extend(events)
+        # Each trace starts with empty call stacks.
+        store.close()
+        nbytes += os.path.getsize(call_trace)
+    return nbytes, counter.nevents, store
+
+
+def create_store(call_traces: Iterable[Union[str, bytes, PathLike]],
+                 processes: Optional[int] = None,
+                 progress: Optional[Progress] = None) -> GraphStore:
+    """
+    Builds a partial graph of the traces over a process pool and
+    reduces them into one store with summed counts and times.
+
+    Partial graphs only refer to function addresses, so the workers do
+    not need the symbol table: they receive file names and send back
+    compact GraphStore arrays. Each worker first merges a whole batch of
+    traces, so the parent only merges a few partial graphs.
+
+    :param call_traces: finstrument files, e.g. one per test case.
+    :param processes: number of workers. Defaults to os.cpu_count().
+    :param progress: receives the bytes and the events of each batch.
+    """
+    call_traces = list(call_traces)
+    processes = processes or os.cpu_count() or 1
+    # A few batches per worker balance traces of different sizes.
+    batch_count = min(len(call_traces), processes * BATCHES_PER_PROCESS)
+    batches = [call_traces[index::batch_count]
+               for index in range(batch_count)]
+
+    total = GraphStore()
+    with Pool(processes) as pool:
+        # Merged in batch order, so that node order and roots do not
+        # depend on which worker finishes first.
+        for nbytes, nevents, store in pool.imap(build_store, batches):
+            total.merge(store)
+            if progress:
+                progress.update(nbytes, nevents)
+
+    if progress:
+        progress.finish()
+    return total
@@ -0,0 +1,169 @@
+import hashlib
+import marshal
+import os
+import tempfile
+from array import array
+from os import PathLike
+from typing import Union
+from hoshingak.core.elf import ElfFile
+from hoshingak.core.symbol import Symbol, SymbolTable
+
+
+class SymbolCache:
+    """
+    On-disk cache of parsed symbol tables, keyed by the identity of the
+    executable: its GNU build-id, or its size, mtime and content hash.
+    The least recently used entries are evicted above max_bytes.
+    """
+    VERSION = 1
+    SUFFIX = '.symtab'
+
+    def __init__(self, directory: Union[str, PathLike, None] = None,
+                 max_bytes: int = 64 << 20):
+        """
+        :param directory: defaults to $XDG_CACHE_HOME/hoshingak.
+        :param max_bytes: total size of the cache files kept on disk.
+        """
+        if directory is None:
+            directory = os.path.join(
+                os.environ.get('XDG_CACHE_HOME',
+                               os.path.expanduser('~/.cache')), 'hoshingak')
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, obj: Union[str, PathLike]) -> str:
+        try:
+            with ElfFile(obj) as elf:
+                build_id = elf.build_id()
+        except ValueError:
+            build_id = None
+
+        if build_id:
+            return f'v{self.VERSION}-{build_id.hex()}'
+
+        stat = os.stat(obj)
+        digest = hashlib.sha1(f'{stat.st_size}:{stat.st_mtime_ns}'.encode())
+        with open(obj, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(1 << 20), b''):
+                digest.update(chunk)
+        return f'v{self.VERSION}-{digest.hexdigest()}'
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def get(self, key: str) -> Union[SymbolTable, None]:
+        """
+        :param key: self.key() of the executable.
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as fp:
+                data = fp.read()
+        except FileNotFoundError:
+            return None
+
+        try:
+            table = self.loads(data)
+        except (ValueError, EOFError, TypeError, IndexError):
+            # Truncated, corrupt or written by another Python version.
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return None
+
+        # Mark as recently used.
+        os.utime(path)
+        return table
+
+    def put(self, key: str, table: SymbolTable):
+        """
+        :param key: self.key() of the executable.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        # Write to a temporary file first so that concurrent runs
+        # never read a partial entry.
+        fd, temp = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(self.dumps(table))
+        os.replace(temp, self.path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(self.SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    @staticmethod
+    def dumps(table: SymbolTable) -> bytes:
+        """
+        Stores the symbols column by column:
+        numbers in arrays, strings in tables referenced by index.
+        """
+        prefixes = list(table.prefixes)
+        prefix_index = {prefix: index for index, prefix in enumerate(prefixes)}
+        strings = []
+        string_index = dict()
+
+        def intern(value):
+            try:
+                return string_index[value]
+            except KeyError:
+                string_index[value] = len(strings)
+                strings.append(value)
+                return string_index[value]
+
+        symbols = list(table.values())
+        columns = (
+            array('Q', (symbol.address for symbol in symbols)),
+            array('Q', (symbol.offset for symbol in symbols)),
+            array('I', (intern(symbol.scope) for symbol in symbols)),
+            array('I', (intern(symbol.kind) for symbol in symbols)),
+            array('I', (intern(symbol.section) for symbol in symbols)),
+            array('i', (prefix_index.get(symbol.prefix, -1)
+                        for symbol in symbols)),
+        )
+        return marshal.dumps((
+            SymbolCache.VERSION,
+            [(prefix, *table.prefixes[prefix]) for prefix in prefixes],
+            '\0'.join(symbol.name for symbol in symbols),
+            '\0'.join(strings),
+            [column.tobytes() for column in columns],
+        ))
+
+    @staticmethod
+    def loads(data: bytes) -> Union[SymbolTable, None]:
+        version, prefixes, names, strings, columns = marshal.loads(data)
+        if version != SymbolCache.VERSION:
+            return None
+
+        table = SymbolTable(symbol_file=None, decoded_file=None)
+        for prefix, start_addr, end_addr in prefixes:
+            table.prefixes[prefix] = (start_addr, end_addr)
+
+        names = names.split('\0') if names else []
+        strings = strings.split('\0')
+        prefix_names = [prefix for prefix, _, _ in prefixes]
+        addresses, offsets, scopes, kinds, sections, prefix_indices = (
+            array(typecode, column) for typecode, column
+            in zip('QQIIIi', columns))
+        for values in zip(addresses, offsets, scopes, kinds, sections,
+                          prefix_indices, names):
+            address, offset, scope, kind, section, prefix, name = values
+            table._name_table[address] = Symbol.from_values(
+                prefix_names[prefix] if prefix >= 0 else 'Unknown', address,
+                strings[scope], strings[kind], strings[section], offset, name)
+
+        return table
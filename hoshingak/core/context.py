@@ -0,0 +1,192 @@
+from __future__ import annotations
+import heapq
+import sys
+from typing import Dict, List, Tuple, Iterable, Iterator, Optional
+from hoshingak.core.stats import CallStatistics
+from hoshingak.core.trace import open_trace, Progress, TraceEvent, weigh
+
+
+class ContextNode:
+    """
+    One calling context: a function reached through a call site
+    from the context of its caller.
+    """
+    __slots__ = ('symbol', 'address', 'call_site', 'parent', 'depth',
+                 'children', 'stats', 'folded')
+
+    def __init__(self, symbol, address: int, call_site: int,
+                 parent: Optional[ContextNode]):
+        self.symbol = symbol
+        self.address = address
+        self.call_site = call_site
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent is not None else 0
+        # Keyed by (call site, callee address): a call site through
+        # a function pointer may reach more than one function.
+        self.children: Dict[Tuple[int, int], ContextNode] = dict()
+        self.stats = CallStatistics()
+        # Recursive calls folded into this context.
+        self.folded = 0
+
+    def __str__(self):
+        return f'{self.symbol.prefix}/{self.symbol.name}#{self.call_site}' \
+            if self.symbol is not None else '(root)'
+
+    @property
+    def name(self):
+        return self.symbol.name if self.symbol is not None else '(root)'
+
+    @property
+    def elapsed(self):
+        return self.stats.total
+
+    @property
+    def actual_elapsed(self):
+        return self.stats.exclusive
+
+    def path(self) -> List[ContextNode]:
+        """
+        :return: the contexts from the entry point down to this one.
+        """
+        nodes = []
+        node = self
+        while node.parent is not None:
+            nodes.append(node)
+            node = node.parent
+        return nodes[::-1]
+
+
+class CallingContextTree:
+    """
+    Statistics of every calling context, unlike CallGraph which keeps
+    one node per call site whatever the path to it was.
+    A child is looked up in a dict of its parent, so each event costs
+    O(1) and memory grows with the number of unique contexts.
+    """
+    # Kinds of stack frames.
+    CALL = 0
+    FOLDED = 1
+    TRUNCATED = 2
+
+    def __init__(self, symtab, max_depth: int = 0,
+                 fold_recursion: bool = False):
+        """
+        :param symtab: SymbolTable resolving the function addresses.
+        :param max_depth: contexts deeper than this are not created and
+                    their time is counted as self time of the deepest
+                    context above them. 0 means no limit.
+        :param fold_recursion: a call to a function already on the stack
+                    is attributed to the context of its first activation,
+                    so recursion does not grow the tree.
+        """
+        if max_depth < 0:
+            raise ValueError(f'max_depth must not be negative: {max_depth}')
+
+        self.symtab = symtab
+        self.max_depth = max_depth
+        self.fold_recursion = fold_recursion
+        # Parent of the entry point of every thread.
+        self.root = ContextNode(None, 0, 0, None)
+        self.size = 0
+        # Call stack of each thread, kept between calls to self.extend().
+        # Each frame is [context, start time, weighted inclusive time of
+        # callees, kind] where kind is one of the constants below.
+        self.stacks: Dict[int, List[list]] = dict()
+        # Number of calls each frame stands for, see trace.weigh().
+        self.weights: Dict[int, List[int]] = dict()
+        # Context of the outermost activation of each function on the
+        # stack of each thread, used to fold recursion.
+        self.active: Dict[int, Dict[int, ContextNode]] = dict()
+        # Calls each sampled call stands for in a sampled trace.
+        self.scale = 1
+
+    def create(self, call_trace, progress: Optional[Progress] = None):
+        events = open_trace(call_trace, progress=progress)
+        self.scale = events.metadata.sample
+        self.extend(events)
+
+    def extend(self, events: Iterable[TraceEvent]):
+        stacks = self.stacks
+        max_depth = self.max_depth
+        fold_recursion = self.fold_recursion
+        for (addr, call_site, flag, time, thread), weight \
+                in weigh(events, self.scale, self.weights):
+            try:
+                stack = stacks[thread]
+                active = self.active[thread]
+            except KeyError:
+                stack = stacks[thread] = []
+                active = self.active[thread] = dict()
+
+            if flag != 'X':
+                if stack:
+                    parent, _, _, kind = stack[-1]
+                    if kind == self.TRUNCATED:
+                        stack.append([parent, time, 0, kind])
+                        continue
+                else:
+                    parent = self.root
+
+                if fold_recursion and addr in active:
+                    stack.append([active[addr], time, 0, self.FOLDED])
+                    continue
+
+                if max_depth and parent.depth >= max_depth:
+                    stack.append([parent, time, 0, self.TRUNCATED])
+                    continue
+
+                try:
+                    node = parent.children[call_site, addr]
+                except KeyError:
+                    node = ContextNode(self.symtab[addr], addr, call_site,
+                                       parent)
+                    parent.children[call_site, addr] = node
+                    self.size += 1
+                if fold_recursion:
+                    active[addr] = node
+                stack.append([node, time, 0, self.CALL])
+
+            elif stack:
+                node, stime, callees, kind = stack.pop(-1)
+                elapsed = time - stime
+                if kind == self.TRUNCATED:
+                    # Left in the self time of the context above.
+                    continue
+
+                exclusive = max(elapsed - callees // weight, 0)
+                if kind == self.FOLDED:
+                    # The first activation covers the inclusive time.
+                    node.stats.exclusive += exclusive * weight
+                    node.folded += weight
+                else:
+                    node.stats.add(elapsed, exclusive, weight)
+                    if fold_recursion:
+                        del active[node.address]
+                if stack:
+                    stack[-1][2] += elapsed * weight
+
+    def __iter__(self) -> Iterator[ContextNode]:
+        """
+        Yields every context, parents before their children.
+        """
+        pending = list(self.root.children.values())
+        while pending:
+            node = pending.pop()
+            yield node
+            pending.extend(node.children.values())
+
+    def hottest(self, top: int = 10) -> List[ContextNode]:
+        """
+        :return: the contexts with the longest self time.
+        """
+        return heapq.nlargest(top, self,
+                              key=lambda node: node.actual_elapsed)
+
+    def pretty_print(self, top: int = 10, file=sys.stdout):
+        for node in self.hottest(top):
+            print(f'{node.actual_elapsed}ns actual, {node.elapsed}ns elapsed, '
+                  f'{node.stats.count} calls'
+                  f'{f", {node.folded} folded" if node.folded else ""}',
+                  file=file)
+            print(f'\t{";".join(context.name for context in node.path())}',
+                  file=file)
@@ -0,0 +1,177 @@
+import os
+import sys
+from array import array
+from multiprocessing import Pool
+from os import PathLike
+from typing import Union, Dict, Iterable, List, Optional, Tuple
+from hoshingak.core.batch import BATCHES_PER_PROCESS
+from hoshingak.core.trace import open_trace, Progress, weigh
+
+# Ordinal of each function address, set in every worker process.
+_ordinals: Dict[int, int] = dict()
+
+
+def _set_ordinals(addresses: List[int]):
+    global _ordinals
+    _ordinals = {address: ordinal for ordinal, address in enumerate(addresses)}
+
+
+def count_calls(call_traces: List[Union[str, bytes, PathLike]]
+                ) -> Tuple[int, int, List[Tuple[str, int]], array]:
+    """
+    Coverage of a batch of traces. Runs in a worker process.
+    :return: number of bytes and events read, the bitmap of the functions
+                called by each trace, and the calls summed over the batch.
+    """
+    counts = array('Q', bytes(8 * len(_ordinals)))
+    runs = []
+    nbytes = 0
+    nevents = 0
+    for call_trace in call_traces:
+        events = open_trace(call_trace)
+        calls: Dict[int, int] = dict()
+        for (address, _, flag, _, _), weight \
+                in weigh(events, events.metadata.sample, dict()):
+            nevents += 1
+            if flag != 'X':
+                try:
+                    calls[address] += weight
+                except KeyError:
+                    calls[address] = weight
+
+        bitmap = bytearray((len(_ordinals) + 7) // 8)
+        for address, count in calls.items():
+            ordinal = _ordinals.get(address)
+            # Addresses outside of the symbol table are not functions.
+            if ordinal is None:
+                continue
+            bitmap[ordinal >> 3] |= 1 << (ordinal & 7)
+            counts[ordinal] += count
+        runs.append((os.fspath(call_trace),
+                     int.from_bytes(bitmap, 'little')))
+        nbytes += os.path.getsize(call_trace)
+    return nbytes, nevents, runs, counts
+
+
+class SuiteCoverage:
+    """
+    Function coverage of many runs, e.g. one trace per test case, without
+    building a graph or touching Symbol.call_count.
+    Each run is a bitmap indexed by the ordinal of the symbols in address
+    order, kept as a Python int so that merging runs is a bitwise OR.
+    """
+
+    def __init__(self, symtab):
+        """
+        :param symtab: SymbolTable of the executable the runs traced.
+        """
+        self.symtab = symtab
+        self.symbols = sorted(symtab.values(),
+                              key=lambda symbol: symbol.address)
+        # Functions called by each run.
+        self.runs: Dict[str, int] = dict()
+        # Functions called by any run.
+        self.covered = 0
+        # Calls of each function summed over the runs.
+        self.counts = array('Q', bytes(8 * len(self.symbols)))
+
+    def add(self, call_traces: Iterable[Union[str, bytes, PathLike]],
+            processes: Optional[int] = None,
+            progress: Optional[Progress] = None):
+        """
+        Reads the traces over a process pool, like batch.create_store().
+        :param processes: number of workers. Defaults to os.cpu_count().
+        :param progress: receives the bytes and the events of each batch.
+        """
+        call_traces = list(call_traces)
+        if not call_traces:
+            return
+
+        processes = processes or os.cpu_count() or 1
+        batch_count = min(len(call_traces), processes * BATCHES_PER_PROCESS)
+        batches = [call_traces[index::batch_count]
+                   for index in range(batch_count)]
+
+        addresses = [symbol.address for symbol in self.symbols]
+        with Pool(processes, initializer=_set_ordinals,
+                  initargs=(addresses,)) as pool:
+            for nbytes, nevents, runs, counts in \
+                    pool.imap_unordered(count_calls, batches):
+                self.merge(runs, counts)
+                if progress:
+                    progress.update(nbytes, nevents)
+
+        if progress:
+            progress.finish()
+
+    def merge(self, runs: Iterable[Tuple[str, int]],
+              counts: Optional[array] = None):
+        """
+        :param runs: (name, bitmap) of each run.
+        :param counts: calls of each function summed over these runs.
+        """
+        for name, bits in runs:
+            self.runs[name] = self.runs.get(name, 0) | bits
+            self.covered |= bits
+        if counts is not None:
+            for ordinal, count in enumerate(counts):
+                if count:
+                    self.counts[ordinal] += count
+
+    def symbols_of(self, bits: int) -> List:
+        """
+        :return: the symbols whose bit is set.
+        """
+        symbols = []
+        while bits:
+            lowest = bits & -bits
+            symbols.append(self.symbols[lowest.bit_length() - 1])
+            bits ^= lowest
+        return symbols
+
+    def called(self) -> List:
+        return self.symbols_of(self.covered)
+
+    def per_prefix(self) -> Dict[str, Tuple[int, int]]:
+        """
+        :return: number of functions called by any run and number of
+                    functions of each compilation unit.
+        """
+        coverage = {prefix: [0, 0] for prefix in self.symtab.prefixes}
+        # Shifting a large int is linear in its size; indexing bytes is not.
+        bitmap = self.covered.to_bytes((len(self.symbols) + 7) // 8, 'little')
+        for ordinal, symbol in enumerate(self.symbols):
+            try:
+                totals = coverage[symbol.prefix]
+            except KeyError:
+                totals = coverage[symbol.prefix] = [0, 0]
+            totals[0] += bitmap[ordinal >> 3] >> (ordinal & 7) & 1
+            totals[1] += 1
+        return {prefix: (called, total)
+                for prefix, (called, total) in coverage.items()}
+
+    def unique(self) -> Dict[str, List]:
+        """
+        :return: the functions called by a single run, for each run
+                    that has some.
+        """
+        once = 0
+        twice = 0
+        for bits in self.runs.values():
+            twice |= once & bits
+            once |= bits
+        only = once & ~twice
+
+        return {name: self.symbols_of(bits & only)
+                for name, bits in self.runs.items() if bits & only}
+
+    def report(self, file=sys.stdout):
+        called_count = bin(self.covered).count('1')
+        total = len(self.symbols)
+        print(f'Coverage of {len(self.runs)} runs: {called_count} out of '
+              f'{total} ({round((called_count / (total or 1)) * 100, 2)}%).',
+              file=file)
+        for prefix, (called, total) in sorted(self.per_prefix().items()):
+            print(f'\t{prefix}: {called} out of {total}', file=file)
+        for name, symbols in self.unique().items():
+            print(f'Only {name}: {", ".join(map(str, symbols))}', file=file)
@@ -0,0 +1,204 @@
+from __future__ import annotations
+import heapq
+import sys
+from typing import Dict, List, Tuple, Optional, Iterable, NamedTuple
+from hoshingak.core import render
+from hoshingak.core.stats import CallStatistics
+
+# (CU prefix, function name): stays the same when addresses move.
+FunctionKey = Tuple[str, str]
+
+
+def function_key(node) -> FunctionKey:
+    return node.symbol.prefix, node.symbol.name
+
+
+class FunctionProfile:
+    """
+    Statistics of a function summed over its nodes,
+    and the functions it calls and is called by.
+    """
+    __slots__ = ('key', 'stats', 'calls', 'callees', 'callers')
+
+    def __init__(self, key: FunctionKey):
+        self.key = key
+        self.stats = CallStatistics()
+        # Number of enter events of the function in this graph.
+        self.calls = 0
+        self.callees: Dict[FunctionKey, None] = dict()
+        self.callers: Dict[FunctionKey, None] = dict()
+
+
+def profile(nodes: Iterable) -> Dict[FunctionKey, FunctionProfile]:
+    """
+    Aggregates the nodes of a graph by function in one pass.
+    Use a graph at sensitivity 0 or 3, where every node has its own
+    statistics.
+    """
+    functions: Dict[FunctionKey, FunctionProfile] = dict()
+
+    def get(key):
+        try:
+            return functions[key]
+        except KeyError:
+            function = functions[key] = FunctionProfile(key)
+            return function
+
+    for node in nodes:
+        function = get(function_key(node))
+        function.stats.merge(node.stats)
+        function.calls += node.enter_count
+        for inode in node.incoming_nodes.values():
+            caller = get(function_key(inode))
+            caller.callees[function.key] = None
+            function.callers[caller.key] = None
+
+    return functions
+
+
+class ProfileDelta(NamedTuple):
+    key: FunctionKey
+    before: Optional[FunctionProfile]
+    after: Optional[FunctionProfile]
+    # Change in the share of the total self time and of the calls,
+    # in percentage points.
+    score: float
+
+    @property
+    def name(self) -> str:
+        return f'{self.key[0]}/{self.key[1]}'
+
+    @property
+    def calls(self) -> Tuple[int, int]:
+        return (self.before.calls if self.before else 0,
+                self.after.calls if self.after else 0)
+
+    @property
+    def elapsed(self) -> Tuple[int, int]:
+        return (self.before.stats.total if self.before else 0,
+                self.after.stats.total if self.after else 0)
+
+    @property
+    def actual_elapsed(self) -> Tuple[int, int]:
+        return (self.before.stats.exclusive if self.before else 0,
+                self.after.stats.exclusive if self.after else 0)
+
+
+class ProfileDiff:
+    """
+    Compares two runs or two builds function by function.
+    Functions are matched by CU prefix and name with a dict,
+    so the cost is linear in the number of nodes.
+    """
+
+    def __init__(self, before: Iterable, after: Iterable):
+        """
+        :param before: nodes of the baseline graph, e.g. graph.nodes.values().
+        :param after: nodes of the graph to compare with the baseline.
+        """
+        self.before = profile(before)
+        self.after = profile(after)
+        self.deltas: Dict[FunctionKey, ProfileDelta] = dict()
+
+        def totals(functions):
+            return (sum(function.stats.exclusive
+                        for function in functions.values()) or 1,
+                    sum(function.calls for function in functions.values())
+                    or 1)
+
+        time_before, calls_before = totals(self.before)
+        time_after, calls_after = totals(self.after)
+        for key in {**self.before, **self.after}:
+            old = self.before.get(key)
+            new = self.after.get(key)
+            time_share = (new.stats.exclusive / time_after if new else 0) \
+                - (old.stats.exclusive / time_before if old else 0)
+            calls_share = (new.calls / calls_after if new else 0) \
+                - (old.calls / calls_before if old else 0)
+            score = max(abs(time_share), abs(calls_share)) * 100
+            self.deltas[key] = ProfileDelta(key, old, new, score)
+
+    def ranked(self, top: Optional[int] = None) -> List[ProfileDelta]:
+        """
+        :return: the most significant changes first.
+        """
+        if top is None:
+            return sorted(self.deltas.values(),
+                          key=lambda delta: delta.score, reverse=True)
+
+        return heapq.nlargest(top, self.deltas.values(),
+                              key=lambda delta: delta.score)
+
+    def pretty_print(self, top: Optional[int] = 20, file=sys.stdout):
+        print(f'{"function":<40} {"calls":>19} {"elapsed (ns)":>27} '
+              f'{"actual (ns)":>27} {"score":>6}', file=file)
+        for delta in self.ranked(top):
+            (calls_before, calls_after), (total_before, total_after), \
+                (actual_before, actual_after) = \
+                delta.calls, delta.elapsed, delta.actual_elapsed
+            print(f'{delta.name:<40} '
+                  f'{calls_before:>8} {calls_after - calls_before:>+10} '
+                  f'{total_before:>12} {total_after - total_before:>+14} '
+                  f'{actual_before:>12} {actual_after - actual_before:>+14} '
+                  f'{delta.score:>6.2f}', file=file)
+
+    @staticmethod
+    def get_color(delta: ProfileDelta) -> str:
+        before, after = delta.actual_elapsed
+        if delta.before is None or delta.after is None:
+            # Only called in one of the runs.
+            return '#bbbbbb'
+        if before == after:
+            return '#ffffff'
+        # Slower in red, faster in green, stronger with the change.
+        ratio = min(abs(after - before) / max(before, after), 1)
+        fade = int(255 - 200 * ratio)
+        return f'#ff{fade:02x}{fade:02x}' if after > before \
+            else f'#{fade:02x}ff{fade:02x}'
+
+    def draw(self, name, format: str = 'pdf',
+             top: Optional[int] = 50) -> str:
+        """
+        Draws the functions with the most significant changes and the
+        calls between them, colored by the change of their self time.
+        :return: the path of the output file.
+        """
+        if format not in ('pdf', 'svg', 'dot'):
+            raise ValueError(f'Unknown format: {format}')
+
+        deltas = self.ranked(top)
+        kept = {delta.key for delta in deltas}
+        source = f'{name}.dot'
+        with open(source, 'w') as fp:
+            dot = render.DotWriter(fp, name='Profile diff',
+                                   graph_attr={'ordering': 'out'})
+            for delta in deltas:
+                (calls_before, calls_after), _, \
+                    (actual_before, actual_after) = \
+                    delta.calls, delta.elapsed, delta.actual_elapsed
+                dot.node(delta.name, shape='box', style='filled',
+                         fillcolor=self.get_color(delta),
+                         xlabel=f'calls {calls_after - calls_before:+}, '
+                                f'actual {actual_after - actual_before:+}ns')
+
+            edges = set()
+            for functions, style in ((self.after, 'solid'),
+                                     (self.before, 'dashed')):
+                for key in kept:
+                    function = functions.get(key)
+                    if function is None:
+                        continue
+                    for callee in function.callees:
+                        if callee in kept and (key, callee) not in edges:
+                            # Dashed calls exist only in the baseline.
+                            edges.add((key, callee))
+                            dot.edge(self.deltas[key].name,
+                                     self.deltas[callee].name, style=style)
+            dot.close()
+
+        if format == 'dot':
+            return source
+
+        output = f'{name}.{format}'
+        render.render(source, output, format=format)
+        return output
@@ -0,0 +1,395 @@
+import mmap
+import struct
+from os import PathLike
+from typing import Union, Dict, Iterator, Tuple, NamedTuple
+
+
+class ElfSection(NamedTuple):
+    name: str
+    type: int
+    address: int
+    offset: int
+    size: int
+    link: int
+
+
+class ElfSymbol(NamedTuple):
+    name: str
+    address: int
+    size: int
+    bind: int
+    type: int
+    visibility: int
+    section: str
+
+
+class ElfFile:
+    """
+    Reads the symbol table and the DWARF line tables
+    straight from an ELF executable, without objdump.
+    """
+    # e_ident
+    ELFCLASS64 = 2
+    ELFDATA2MSB = 2
+    # sh_type
+    SHT_SYMTAB = 2
+    SHT_NOBITS = 8
+    # st_info
+    STB_LOCAL = 0
+    STT_FUNC = 2
+    # st_shndx
+    SHN_LORESERVE = 0xff00
+
+    def __init__(self, file: Union[str, bytes, PathLike]):
+        self.file = file
+        with open(file, 'rb') as fp:
+            self.data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.data[:4] != b'\x7fELF':
+            self.close()
+            raise ValueError(f'{file} is not an ELF file.')
+
+        self.is_64 = self.data[4] == self.ELFCLASS64
+        self.endian = '>' if self.data[5] == self.ELFDATA2MSB else '<'
+        self.sections: Dict[str, ElfSection] = self.read_sections()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.data.close()
+
+    def unpack(self, fmt: str, offset: int) -> tuple:
+        return struct.unpack_from(self.endian + fmt, self.data, offset)
+
+    def read_sections(self) -> Dict[str, ElfSection]:
+        if self.is_64:
+            shoff, = self.unpack('Q', 0x28)
+            shentsize, shnum, shstrndx = self.unpack('HHH', 0x3a)
+            fmt = 'IIQQQQIIQQ'
+        else:
+            shoff, = self.unpack('I', 0x20)
+            shentsize, shnum, shstrndx = self.unpack('HHH', 0x2e)
+            fmt = 'IIIIIIIIII'
+
+        headers = [self.unpack(fmt, shoff + index * shentsize)
+                   for index in range(shnum)]
+        names_offset = headers[shstrndx][4] if headers else 0
+        self.section_list = []
+        sections = dict()
+        for name, type_, _, address, offset, size, link, _, _, _ in headers:
+            section = ElfSection(self.string(names_offset + name),
+                                 type_, address, offset, size, link)
+            self.section_list.append(section)
+            sections.setdefault(section.name, section)
+
+        return sections
+
+    def string(self, offset: int) -> str:
+        end = self.data.find(b'\0', offset)
+        return self.data[offset:end].decode(errors='replace')
+
+    def section_data(self, name: str) -> bytes:
+        section = self.sections.get(name)
+        if section is None or section.type == self.SHT_NOBITS:
+            return b''
+
+        return self.data[section.offset:section.offset + section.size]
+
+    def symbols(self, kind: Union[int, None] = None) -> Iterator[ElfSymbol]:
+        """
+        :param kind: only symbols of this type (e.g. STT_FUNC) if given.
+        """
+        symtab = next((section for section in self.section_list
+                       if section.type == self.SHT_SYMTAB), None)
+        if symtab is None:
+            return
+
+        strtab = self.section_list[symtab.link]
+        strings = self.data[strtab.offset:strtab.offset + strtab.size]
+        entries = self.data[symtab.offset:symtab.offset + symtab.size]
+        names = [section.name for section in self.section_list]
+        if self.is_64:
+            entries = struct.iter_unpack(self.endian + 'IBBHQQ', entries)
+        else:
+            entries = ((name, info, other, shndx, value, size)
+                       for name, value, size, info, other, shndx
+                       in struct.iter_unpack(self.endian + 'IIIBBH', entries))
+
+        for name, info, other, shndx, value, size in entries:
+            if kind is not None and info & 0xf != kind:
+                continue
+
+            if shndx >= self.SHN_LORESERVE or shndx >= len(names):
+                section = ''
+            else:
+                section = names[shndx]
+
+            end = strings.index(b'\0', name)
+            yield ElfSymbol(strings[name:end].decode(errors='replace'),
+                            value, size, info >> 4, info & 0xf, other & 0x3,
+                            section)
+
+    def functions(self, section: str = '.text') -> Iterator[ElfSymbol]:
+        """
+        Same entries as the functions of 'objdump -t' in the given section.
+        """
+        for symbol in self.symbols(self.STT_FUNC):
+            # objdump prints .hidden/.protected on an extra column, which
+            # SymbolTable.read_symbol_table() skips. Keep both loaders equal.
+            if symbol.section == section and symbol.visibility == 0:
+                yield symbol
+
+    def compilation_units(self) -> Iterator[Tuple[str, int, int]]:
+        """
+        Yields (name, start address, end address) of each line table
+        in .debug_line, as printed by 'objdump -WL'.
+        """
+        return DebugLineReader(self).units()
+
+    def build_id(self) -> Union[bytes, None]:
+        note = self.section_data('.note.gnu.build-id')
+        if len(note) < 12:
+            return None
+
+        namesz, descsz, _ = struct.unpack_from(self.endian + 'III', note)
+        start = 12 + (namesz + 3) // 4 * 4
+        return bytes(note[start:start + descsz])
+
+
+class DebugLineReader:
+    """
+    Runs the DWARF (version 2 to 5) line number programs only far enough
+    to know the address range covered by each compilation unit.
+    """
+    # Standard opcodes
+    DW_LNS_copy = 1
+    DW_LNS_advance_pc = 2
+    DW_LNS_const_add_pc = 8
+    DW_LNS_fixed_advance_pc = 9
+    # Extended opcodes
+    DW_LNE_end_sequence = 1
+    DW_LNE_set_address = 2
+    # Line table content types and forms (DWARF 5)
+    DW_LNCT_path = 1
+    DW_FORM_block = 0x09
+    DW_FORM_data1 = 0x0b
+    DW_FORM_data2 = 0x05
+    DW_FORM_data4 = 0x06
+    DW_FORM_data8 = 0x07
+    DW_FORM_data16 = 0x1e
+    DW_FORM_string = 0x08
+    DW_FORM_strp = 0x0e
+    DW_FORM_udata = 0x0f
+    DW_FORM_line_strp = 0x1f
+
+    def __init__(self, elf: ElfFile):
+        self.elf = elf
+        self.endian = elf.endian
+        self.data = elf.section_data('.debug_line')
+        self.debug_str = elf.section_data('.debug_str')
+        self.debug_line_str = elf.section_data('.debug_line_str')
+        self.address_size = 8 if elf.is_64 else 4
+
+    def units(self) -> Iterator[Tuple[str, int, int]]:
+        offset = 0
+        while offset < len(self.data):
+            offset, unit = self.read_unit(offset)
+            if unit is not None:
+                yield unit
+
+    def read_unit(self, offset: int):
+        data = self.data
+        unit_length, = struct.unpack_from(self.endian + 'I', data, offset)
+        offset += 4
+        offset_size = 4
+        if unit_length == 0xffffffff:
+            unit_length, = struct.unpack_from(self.endian + 'Q', data, offset)
+            offset += 8
+            offset_size = 8
+        end = offset + unit_length
+
+        version, = struct.unpack_from(self.endian + 'H', data, offset)
+        offset += 2
+        address_size = self.address_size
+        if version >= 5:
+            address_size = data[offset]
+            offset += 2
+        header_length = self.read_offset(offset, offset_size)
+        offset += offset_size
+        program = offset + header_length
+
+        min_inst_length = data[offset]
+        offset += 1
+        if version >= 4:
+            offset += 1
+        offset += 1
+        line_range = data[offset + 1]
+        opcode_base = data[offset + 2]
+        offset += 3
+        standard_opcode_lengths = data[offset:offset + opcode_base - 1]
+        offset += opcode_base - 1
+
+        if version >= 5:
+            name = self.read_v5_file_names(offset, offset_size)
+        else:
+            name = self.read_file_names(offset)
+
+        start, stop = self.run_program(program, end, address_size,
+                                       min_inst_length, line_range,
+                                       opcode_base, standard_opcode_lengths)
+        if start is None:
+            return end, None
+
+        return end, (name, start, stop)
+
+    def read_offset(self, offset: int, size: int) -> int:
+        fmt = self.endian + ('Q' if size == 8 else 'I')
+        return struct.unpack_from(fmt, self.data, offset)[0]
+
+    def read_cstring(self, offset: int) -> Tuple[str, int]:
+        end = self.data.index(b'\0', offset)
+        return self.data[offset:end].decode(errors='replace'), end + 1
+
+    def read_uleb128(self, offset: int) -> Tuple[int, int]:
+        data = self.data
+        result = shift = 0
+        while True:
+            byte = data[offset]
+            offset += 1
+            result |= (byte & 0x7f) << shift
+            shift += 7
+            if not byte & 0x80:
+                return result, offset
+
+    def read_file_names(self, offset: int) -> str:
+        # include_directories
+        while self.data[offset]:
+            _, offset = self.read_cstring(offset)
+        offset += 1
+
+        # The first entry of file_names is the primary source file.
+        name, offset = self.read_cstring(offset)
+        return name
+
+    def read_v5_file_names(self, offset: int, offset_size: int) -> str:
+        # directory_entry_format and directories
+        offset, _ = self.read_entries(offset, offset_size)
+        # file_name_entry_format and file_names
+        offset, paths = self.read_entries(offset, offset_size)
+        # File 0 is the primary source file.
+        return paths[0] if paths else ''
+
+    def read_entries(self, offset: int, offset_size: int):
+        count = self.data[offset]
+        offset += 1
+        formats = []
+        for _ in range(count):
+            content_type, offset = self.read_uleb128(offset)
+            form, offset = self.read_uleb128(offset)
+            formats.append((content_type, form))
+
+        entries, offset = self.read_uleb128(offset)
+        paths = []
+        for _ in range(entries):
+            for content_type, form in formats:
+                value, offset = self.read_form(offset, form, offset_size)
+                if content_type == self.DW_LNCT_path:
+                    paths.append(value)
+
+        return offset, paths
+
+    def read_form(self, offset: int, form: int, offset_size: int):
+        if form == self.DW_FORM_string:
+            return self.read_cstring(offset)
+        if form in (self.DW_FORM_line_strp, self.DW_FORM_strp):
+            table = self.debug_line_str \
+                if form == self.DW_FORM_line_strp else self.debug_str
+            position = self.read_offset(offset, offset_size)
+            end = table.index(b'\0', position)
+            return table[position:end].decode(errors='replace'), \
+                offset + offset_size
+        if form == self.DW_FORM_udata:
+            return self.read_uleb128(offset)
+        sizes = {
+            self.DW_FORM_data1: 1, self.DW_FORM_data2: 2,
+            self.DW_FORM_data4: 4, self.DW_FORM_data8: 8,
+            self.DW_FORM_data16: 16,
+        }
+        if form in sizes:
+            return None, offset + sizes[form]
+        if form == self.DW_FORM_block:
+            length, offset = self.read_uleb128(offset)
+            return None, offset + length
+
+        raise ValueError(f'{self.elf.file}: unsupported form {form:#x} '
+                         f'in .debug_line.')
+
+    def run_program(self, offset: int, end: int, address_size: int,
+                    min_inst_length: int, line_range: int, opcode_base: int,
+                    standard_opcode_lengths: bytes):
+        data = self.data
+        address_fmt = self.endian + ('Q' if address_size == 8 else 'I')
+        const_add_pc = (255 - opcode_base) // line_range * min_inst_length
+        # Address increment of every special opcode.
+        special = [0] * opcode_base + [
+            (opcode - opcode_base) // line_range * min_inst_length
+            for opcode in range(opcode_base, 256)]
+        # Number of ULEB128 operands of the other standard opcodes.
+        operands = [0, *standard_opcode_lengths]
+        start = stop = None
+        address = 0
+        sequence_start = None
+        while offset < end:
+            opcode = data[offset]
+            offset += 1
+            if opcode >= opcode_base:
+                address += special[opcode]
+                if sequence_start is None:
+                    sequence_start = address
+
+            elif opcode == 0:
+                length, offset = self.read_uleb128(offset)
+                sub_opcode = data[offset]
+                if sub_opcode == self.DW_LNE_end_sequence:
+                    # Sequences of functions discarded by the linker
+                    # start at address 0.
+                    if sequence_start:
+                        if start is None or sequence_start < start:
+                            start = sequence_start
+                        if stop is None or address > stop:
+                            stop = address
+                    address = 0
+                    sequence_start = None
+                elif sub_opcode == self.DW_LNE_set_address:
+                    address, = struct.unpack_from(address_fmt, data,
+                                                  offset + 1)
+                offset += length
+
+            elif opcode == self.DW_LNS_copy:
+                if sequence_start is None:
+                    sequence_start = address
+
+            elif opcode == self.DW_LNS_advance_pc:
+                operand, offset = self.read_uleb128(offset)
+                address += operand * min_inst_length
+
+            elif opcode == self.DW_LNS_const_add_pc:
+                address += const_add_pc
+
+            elif opcode == self.DW_LNS_fixed_advance_pc:
+                operand, = struct.unpack_from(self.endian + 'H', data, offset)
+                address += operand
+                offset += 2
+
+            else:
+                # Skip the ULEB128 operands of the other standard opcodes.
+                for _ in range(operands[opcode]):
+                    while data[offset] & 0x80:
+                        offset += 1
+                    offset += 1
+
+        return start, stop
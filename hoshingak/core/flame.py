@@ -0,0 +1,188 @@
+import zlib
+from html import escape
+from os import PathLike
+from typing import Union, Dict, List, Tuple, Iterable, Iterator, Optional, \
+    TextIO
+from hoshingak.core.trace import open_trace, Progress, TraceEvent, weigh
+
+
+class FlameGraph:
+    """
+    Exclusive time of every unique call path, built in one pass over
+    the trace. A path is stored once as (parent path, function), so
+    memory grows with the number of unique paths, not with the events.
+    """
+
+    def __init__(self, symtab):
+        """
+        :param symtab: SymbolTable resolving the function addresses.
+        """
+        self.symtab = symtab
+        # Path 0 is the empty path above the entry points.
+        self.parents: List[int] = [0]
+        self.addresses: List[int] = [0]
+        self.weights: List[int] = [0]
+        self._paths: Dict[Tuple[int, int], int] = dict()
+        # Each frame is [path, start time, weighted inclusive time of
+        # callees], as in CallGraph.stacks.
+        self.stacks: Dict[int, List[list]] = dict()
+        self._call_weights: Dict[int, List[int]] = dict()
+        # Calls each sampled call stands for in a sampled trace.
+        self.scale = 1
+
+    def __len__(self):
+        return len(self.parents) - 1
+
+    def create(self, call_trace, progress: Optional[Progress] = None):
+        events = open_trace(call_trace, progress=progress)
+        self.scale = events.metadata.sample
+        self.extend(events)
+
+    def extend(self, events: Iterable[TraceEvent]):
+        paths = self._paths
+        stacks = self.stacks
+        for (addr, call_site, flag, time, thread), weight \
+                in weigh(events, self.scale, self._call_weights):
+            try:
+                stack = stacks[thread]
+            except KeyError:
+                stack = stacks[thread] = []
+
+            if flag != 'X':
+                parent = stack[-1][0] if stack else 0
+                try:
+                    path = paths[parent, addr]
+                except KeyError:
+                    path = paths[parent, addr] = len(self.parents)
+                    self.parents.append(parent)
+                    self.addresses.append(addr)
+                    self.weights.append(0)
+                stack.append([path, time, 0])
+
+            elif stack:
+                path, stime, callees = stack.pop(-1)
+                elapsed = time - stime
+                self.weights[path] += max(elapsed * weight - callees, 0)
+                if stack:
+                    stack[-1][2] += elapsed * weight
+
+    def frame_name(self, address: int) -> str:
+        symbol = self.symtab.get(address)
+        return symbol.name if symbol is not None else hex(address)
+
+    def stack(self, path: int) -> List[str]:
+        names = []
+        while path:
+            names.append(self.frame_name(self.addresses[path]))
+            path = self.parents[path]
+        return names[::-1]
+
+    def collapsed(self) -> Iterator[Tuple[str, int]]:
+        """
+        Yields ('main;foo;bar', exclusive time) of every path with time.
+        """
+        names = [''] * len(self.parents)
+        for path in range(1, len(self.parents)):
+            # A parent is always created before its children.
+            name = self.frame_name(self.addresses[path])
+            parent = self.parents[path]
+            names[path] = f'{names[parent]};{name}' if parent else name
+            if self.weights[path]:
+                yield names[path], self.weights[path]
+
+    def write_collapsed(self, file: Union[str, PathLike, TextIO]):
+        """
+        Writes the 'a;b;c value' format read by flamegraph.pl.
+        """
+        if isinstance(file, (str, PathLike)):
+            with open(file, 'w') as fp:
+                self.write_collapsed(fp)
+            return
+
+        for stack, weight in sorted(self.collapsed()):
+            file.write(f'{stack} {weight}\n')
+
+    def inclusive(self) -> List[int]:
+        """
+        Time of each path including its descendants.
+        """
+        totals = list(self.weights)
+        # Children have larger indices than their parents.
+        for path in range(len(self.parents) - 1, 0, -1):
+            totals[self.parents[path]] += totals[path]
+        return totals
+
+    def write_svg(self, file: Union[str, PathLike, TextIO],
+                  title: str = 'Flame Graph', width: int = 1200,
+                  frame_height: int = 16, min_width: float = 0.1):
+        """
+        Renders a self-contained SVG without external tools or scripts.
+        :param min_width: frames narrower than this many pixels are omitted.
+        """
+        if isinstance(file, (str, PathLike)):
+            with open(file, 'w') as fp:
+                self.write_svg(fp, title=title, width=width,
+                               frame_height=frame_height, min_width=min_width)
+            return
+
+        totals = self.inclusive()
+        children: List[List[int]] = [[] for _ in self.parents]
+        for path in range(1, len(self.parents)):
+            children[self.parents[path]].append(path)
+
+        # Lay out the frames left to right, in name order like flamegraph.pl.
+        frames = []
+        scale = (width - 20) / totals[0] if totals[0] else 0
+        pending = [(0, 10.0, -1)]
+        while pending:
+            path, x, depth = pending.pop()
+            if path:
+                frames.append((path, x, depth))
+            for child in sorted(children[path], key=lambda child:
+                                self.frame_name(self.addresses[child])):
+                child_width = totals[child] * scale
+                if child_width >= min_width:
+                    pending.append((child, x, depth + 1))
+                x += child_width
+
+        height = (max((depth for _, _, depth in frames), default=0) + 1) \
+            * frame_height + 50
+        file.write(
+            f'<?xml version="1.0" standalone="no"?>\n'
+            f'<svg version="1.1" width="{width}" height="{height}" '
+            f'xmlns="http://www.w3.org/2000/svg">\n'
+            f'<style>text {{ font-family: monospace; font-size: 11px; }}'
+            f'</style>\n'
+            f'<rect width="100%" height="100%" fill="#f8f8f8"/>\n'
+            f'<text x="{width / 2}" y="24" text-anchor="middle">'
+            f'{escape(title)}</text>\n')
+        for path, x, depth in frames:
+            name = self.frame_name(self.addresses[path])
+            frame_width = totals[path] * scale
+            y = height - (depth + 1) * frame_height - 10
+            percent = totals[path] / totals[0] * 100
+            file.write(
+                f'<g><title>{escape(name)} ({totals[path]} ns, '
+                f'{percent:.2f}%)</title>'
+                f'<rect x="{x:.1f}" y="{y}" width="{frame_width:.1f}" '
+                f'height="{frame_height - 1}" fill="{frame_color(name)}" '
+                f'rx="2"/>')
+            # About 7 pixels per character at font-size 11.
+            length = int((frame_width - 6) / 7)
+            if length >= 3:
+                label = name if len(name) <= length \
+                    else name[:length - 2] + '..'
+                file.write(f'<text x="{x + 3:.1f}" '
+                           f'y="{y + frame_height - 5}">'
+                           f'{escape(label)}</text>')
+            file.write('</g>\n')
+        file.write('</svg>\n')
+
+
+def frame_color(name: str) -> str:
+    # Warm colors, stable for the same function across graphs.
+    value = zlib.crc32(name.encode())
+    red = 205 + value % 50
+    green = (value >> 8) % 230
+    blue = (value >> 16) % 55
+    return f'rgb({red},{green},{blue})'
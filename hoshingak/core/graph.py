@@ -1,21 +1,34 @@
 from __future__ import annotations
-import copy
+import heapq
 import sys
-from typing import Union, List, Dict, Type
+from time import perf_counter
+from typing import Union, List, Dict, Type, Optional, Iterable, Tuple
 from hoshingak.core.symbol import *
-from graphviz import Digraph
+from hoshingak.core.batch import create_store
+from hoshingak.core.stats import CallStatistics
+from hoshingak.core.store import GraphStore
+from hoshingak.core.trace import open_trace, Progress, TraceEvent, \
+    TraceFollower, TraceMetadata, weigh
+from hoshingak.core import render, vector
+from hoshingak.core.diff import ProfileDiff
+from hoshingak.core.index import TraceIndex
+from hoshingak.core.query import GraphQuery
 
 
 class CallGraphBaseNode:
+    __slots__ = ('symbol', 'call_site', 'incoming_nodes', 'outgoing_nodes',
+                 'order', 'stats', 'enter_count')
+
     def __init__(self, symbol: Symbol, call_site: int):
         self.symbol = symbol
         self.call_site = call_site
         self.incoming_nodes: Dict[int, Type[CallGraphBaseNode]] = dict()
         self.outgoing_nodes: Dict[int, Type[CallGraphBaseNode]] = dict()
         self.order = 0
-        self.stime = 0
-        self.etime = 0
-        self._actual_elapsed = None
+        self.stats = CallStatistics()
+        # Enter events of this node. Symbol.call_count is shared by
+        # every node and graph of the function.
+        self.enter_count = 0
 
     def __str__(self):
         return f'{self.basename}/{self.symbol.name}#{self.call_site}'
@@ -43,14 +56,17 @@ class CallGraphBaseNode:
 
     @property
     def elapsed(self):
-        return self.etime - self.stime
+        """
+        Inclusive time summed over all invocations.
+        """
+        return self.stats.total
 
     @property
     def actual_elapsed(self):
-        if not self._actual_elapsed:
-            self._actual_elapsed = self.elapsed - sum(
-                node.elapsed for node in self.outgoing_nodes.values())
-        return self._actual_elapsed
+        """
+        Exclusive time summed over all invocations.
+        """
+        return self.stats.exclusive
 
     def link(self, node: CallGraphBaseNode):
         """
@@ -65,15 +81,19 @@ class CallGraphBaseNode:
         self.outgoing_nodes.pop(node.call_site)
         node.incoming_nodes.pop(self.call_site)
 
-    def inc_count(self):
-        self.symbol.call_count += 1
+    def inc_count(self, count: int = 1):
+        self.enter_count += count
+        self.symbol.call_count += count
 
     def pretty_print(self):
         print(f'{self}\n'
               f'\torder: {self.order}\n'
               f'\tcount: {self.call_count}\n'
+              f'\tinvocations: {self.stats.count}\n'
               f'\telapsed time: {self.elapsed}ns\n'
               f'\tactual running time: {self.actual_elapsed}ns\n'
+              f'\tmin/mean/max: {self.stats.min}/{round(self.stats.mean)}/'
+              f'{self.stats.max}ns\n'
               f'\tcalled by:')
         if not self.incoming_nodes.values():
             print('\t\tNone')
@@ -83,17 +103,25 @@ class CallGraphBaseNode:
 
 
 class CallGraphMultipleNodes(CallGraphBaseNode):
+    __slots__ = ('nodes',)
+
     def __init__(self, *args: CallGraphNode):
         if not self.check_condition(*args):
             raise TypeError
         first_node = args[0]
-        for k, v in first_node.__dict__.items():
-            self.__dict__[k] = copy.deepcopy(v)
+        # A group refers to its members and takes over their edges.
+        # Nothing is copied, so grouping costs O(number of members).
+        super().__init__(first_node.symbol, first_node.call_site)
+        self.order = first_node.order
         self.nodes: List[CallGraphNode] = [*args]
+        self.combine_statistics()
 
     def check_condition(self, *args: CallGraphNode):
         raise Exception('self.check_condition is not implemented.')
 
+    def combine_statistics(self):
+        raise Exception('self.combine_statistics is not implemented.')
+
     def pretty_print(self):
         super().pretty_print()
         print(f'\tHaving:')
@@ -104,6 +132,8 @@ class CallGraphMultipleNodes(CallGraphBaseNode):
 
 
 class CallGraphNode(CallGraphBaseNode):
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -139,6 +169,7 @@ class CallGraphMergedNode(CallGraphMultipleNodes):
     only one outgoing edge pointing to the same node.
     This is generated at context sensitivity 1.
     """
+    __slots__ = ()
 
     def __init__(self, *args: CallGraphNode):
         super().__init__(*args)
@@ -150,12 +181,18 @@ class CallGraphMergedNode(CallGraphMultipleNodes):
             for inode in list(node.incoming_nodes.values()):
                 inode.dislink(node)
                 inode.link(self)
-        # Dislink the outgoing node.
+        # Dislink the members from the outgoing node.
         outgoing_node = next(iter(first_node.outgoing_nodes.values()))
-        for node in list(outgoing_node.incoming_nodes.values()):
+        for node in self.nodes:
             node.dislink(outgoing_node)
         self.link(outgoing_node)
 
+    def combine_statistics(self):
+        # Every member is a separate call site of the same function.
+        for node in self.nodes:
+            self.stats.merge(node.stats)
+            self.enter_count += node.enter_count
+
     def __str__(self):
         return f'{self.basename}/{self.symbol.name}#Merged'
 
@@ -190,24 +227,34 @@ class CallGraphLinkedNode(CallGraphMultipleNodes):
     and one incoming edge.
     This is generated at context sensitivity 2.
     """
+    __slots__ = ()
 
     def __init__(self, *args: CallGraphNode):
         super().__init__(*args)
         # inode -> node1 -> node2 -> node3 -> onode
         # becomes the following.
-        # inode -> node1 [node1, node2, node3] -> onode
+        # inode -> self [node1, node2, node3] -> onode
+        first_node = self.nodes[0]
         last_node = self.nodes[-1]
-        onode = next(iter(last_node.outgoing_nodes.values()))
+        for inode in list(first_node.incoming_nodes.values()):
+            inode.dislink(first_node)
+            inode.link(self)
+
+        for onode in list(last_node.outgoing_nodes.values()):
+            last_node.dislink(onode)
+            self.link(onode)
 
         # Remove all links in self.nodes
-        for node in self.nodes:
-            node.incoming_nodes.popitem()
-            node.outgoing_nodes.popitem()
+        for node, next_node in zip(self.nodes, self.nodes[1:]):
+            node.dislink(next_node)
 
-        # Link properly
-        onode.incoming_nodes.pop(last_node.call_site)
-        onode.incoming_nodes[self.call_site] = self.nodes[0]
-        self.outgoing_nodes[onode.call_site] = onode
+    def combine_statistics(self):
+        # The chain is entered through the first member, which includes
+        # the time of the others.
+        first_node = self.nodes[0]
+        self.stats.merge(first_node.stats)
+        self.enter_count = first_node.enter_count
+        self.stats.exclusive = sum(node.stats.exclusive for node in self.nodes)
 
     def __str__(self):
         return f'{self.basename}/{self.symbol.name}#Linked'
@@ -234,6 +281,52 @@ class CallGraphLinkedNode(CallGraphMultipleNodes):
         return True
 
 
+class CallGraphGatheredNode(CallGraphMultipleNodes):
+    """
+    It is a group of all the nodes of the same function,
+    whatever their call sites are.
+    Unlike the other groups, its members keep their edges:
+    the gathered nodes are linked to each other in a new graph.
+    This is generated at context sensitivity 3.
+    """
+    __slots__ = ('calls',)
+
+    def __init__(self, *args: CallGraphNode):
+        super().__init__(*args)
+        self.order = min(node.order for node in self.nodes)
+        # Statistics of the calls to each callee, keyed by its call_site.
+        # Empty when the calls could come from several caller functions.
+        self.calls: Dict[int, CallStatistics] = dict()
+
+    def combine_statistics(self):
+        # Recursive calls are also included in the inclusive time.
+        for node in self.nodes:
+            self.stats.merge(node.stats)
+            self.enter_count += node.enter_count
+
+    def add_call(self, node: CallGraphGatheredNode, stats: CallStatistics):
+        """
+        self -> node, adding the statistics of the calls to the edge.
+        """
+        self.link(node)
+        try:
+            self.calls[node.call_site].merge(stats)
+        except KeyError:
+            self.calls[node.call_site] = CallStatistics()
+            self.calls[node.call_site].merge(stats)
+
+    def __str__(self):
+        return f'{self.basename}/{self.symbol.name}#Gathered'
+
+    def check_condition(self, *args: CallGraphNode) -> bool:
+        symbol = args[0].symbol
+        for node in args[1:]:
+            if symbol != node.symbol:
+                return False
+
+        return True
+
+
 class CallGraph:
     COLOR_TABLE = [
         '#fc0303', '#fca103', '#fcfc03', '#8cfc03',
@@ -241,61 +334,275 @@ class CallGraph:
         '#0356fc', '#4e03fc', '#ad03fc', '#fc03f4',
         '#fc0398', '#fc0339', '#b1fc03', '#613387',
     ]
+    # Functions outside of every compilation unit.
+    UNKNOWN_COLOR = '#bbbbbb'
 
     def __init__(self, symtab: SymbolTable):
         self.symtab = symtab
         self.nodes: Dict[int, Type[CallGraphBaseNode]] = dict()
         self.root = None
+        # The first node entered by each thread.
+        self.roots: Dict[int, Type[CallGraphBaseNode]] = dict()
+        # Call stack of each thread, kept between calls to self.extend().
+        # Each frame is [node, start time, inclusive time of callees
+        # times their weight].
+        self.stacks: Dict[int, List[list]] = dict()
+        # Number of calls each frame stands for, see trace.weigh().
+        self.weights: Dict[int, List[int]] = dict()
+        self.order = 1
+        # Calls each sampled call stands for in a sampled trace.
+        self.scale = 1
+        # Thread that runs main(), None to take the first thread entered.
+        self.main_thread: Optional[int] = None
+        self._expect_main = True
+        # Incremented whenever the nodes or their statistics change.
+        self.version = 0
+        self._query: Optional[GraphQuery] = None
 
     @property
     def size(self):
         return len(self.nodes)
 
-    def create(self, call_trace):
+    def set_metadata(self, metadata: TraceMetadata):
+        self.scale = metadata.sample
+        # The main thread has the id of the process. The buffers of other
+        # threads may reach the trace before its first call.
+        self.main_thread = metadata.pid or None
+
+    @property
+    def query(self) -> GraphQuery:
+        """
+        Structured queries, cached until the graph changes.
+        """
+        if self._query is None:
+            self._query = GraphQuery(self)
+        return self._query
+
+    def create(self, call_trace, progress: Optional[Progress] = None,
+               thread: Optional[int] = None):
         """
-        :param call_trace: file of addresses
+        :param call_trace: file of addresses (text or binary)
                     generated by GCC -finstrument-functions with injection code.
+        :param progress: reports bytes and events per second while reading.
+        :param thread: only the events of this thread are used if given.
+                    Otherwise, the threads are merged into one graph.
         """
-        # For measuring elapsed time.
-        stack = []
-
-        with open(call_trace) as fp:
-            first_tokens = fp.readline().split()
-
-            # Push the first node (Must be main function in C).
-            callee_info = self.get_callee(int(first_tokens[0], 16))
-            # To indicate that it is main function, pass call_site as 0
-            self.root = self.set_node(callee_info, 0)
-            self.root.stime = int(first_tokens[3])
-            self.root.order = 1
-            stack.append(self.root)
-
-            # The first node in the stack starts with 1.
-            order = 2
-            # Note that all tokens separated here are all type of String.
-            tokens = (line.split() for line in fp.readlines())
-            for addr, call_site, flag, time in tokens:
-                deci_addr = int(addr, 16)
-                deci_call_site = int(call_site, 16)
-                # On enter
-                if flag == 'E':
-                    callee = self.get_callee(deci_addr)
-                    # The top node in the stack must be the caller.
-                    caller_node = stack[-1]
-                    callee_node = self.set_node(callee, deci_call_site)
-                    if not callee_node.order:
-                        callee_node.order = order
-                        order += 1
+        # The trace is streamed so that only the graph stays in memory.
+        events = open_trace(call_trace, progress=progress)
+        self.set_metadata(events.metadata)
+        if thread is not None:
+            self.main_thread = thread
+            events = (event for event in events if event.thread == thread)
+        self.extend(events)
+
+    @classmethod
+    def create_per_thread(cls, symtab: SymbolTable, call_trace,
+                          progress: Optional[Progress] = None
+                          ) -> Dict[int, CallGraph]:
+        """
+        Builds one graph for each thread in a single pass over the trace.
+        """
+        graphs: Dict[int, CallGraph] = dict()
+        events = open_trace(call_trace, progress=progress)
+        for event in events:
+            try:
+                graph = graphs[event.thread]
+            except KeyError:
+                graph = graphs[event.thread] = cls(symtab)
+                graph.set_metadata(events.metadata)
+                graph.main_thread = event.thread
+            graph.extend((event,))
+
+        return graphs
+
+    def create_store(self, call_trace, progress: Optional[Progress] = None,
+                     thread: Optional[int] = None) -> GraphStore:
+        """
+        Same as self.create(), but the graph is kept in a compact
+        GraphStore instead of node objects.
+        Use self.load_store() to turn it into nodes.
+        """
+        events = open_trace(call_trace, progress=progress)
+        store = GraphStore(self.symtab)
+        store.set_metadata(events.metadata)
+        if thread is not None:
+            store.main_thread = thread
+            events = (event for event in events if event.thread == thread)
+        store.extend(events)
+        return store
+
+    def follow(self, call_trace, summary_interval: float = 5.0,
+               top: int = 5, follower: Optional[TraceFollower] = None,
+               progress: Optional[Progress] = None, file=sys.stdout):
+        """
+        Extends the graph while the program is still writing the trace
+        and prints a summary every summary_interval seconds.
+        Runs until interrupted or until follower.stop() is called.
+        Memory is bounded by the number of call sites, not by the trace.
+        When the program is restarted, the calls of the new run are added
+        to the same graph.
+        :param top: number of the hottest nodes in each summary.
+        :param follower: TraceFollower to read call_trace with.
+        """
+        if follower is None:
+            follower = TraceFollower(call_trace, progress=progress)
+        last = perf_counter()
+        restarts = follower.restarts
+        try:
+            for events in follower.batches():
+                if follower.restarts != restarts:
+                    # Calls left open by the previous run never exit.
+                    restarts = follower.restarts
+                    self.close()
+                self.set_metadata(follower.metadata)
+                self.extend(events)
+                now = perf_counter()
+                if now - last >= summary_interval:
+                    last = now
+                    self.summarize(top=top, file=file)
+        except KeyboardInterrupt:
+            pass
+
+        self.summarize(top=top, file=file)
 
-                    callee_node.stime = int(time)
+    def create_window(self, call_trace, t0: int, t1: int,
+                      index: Optional[TraceIndex] = None):
+        """
+        Same as self.create() for the events with a timestamp in [t0, t1].
+        Reading starts from the nearest checkpoint of the index instead of
+        the beginning of the trace. Calls open at t0 or at t1 are cut to
+        the window.
+        :param index: TraceIndex of call_trace. Built or updated if not given.
+        """
+        if index is None:
+            index = TraceIndex(call_trace)
+        self.set_metadata(index.metadata)
+        self.extend(index.events_between(t0, t1))
+
+    def create_range(self, call_trace, start: int, stop: int,
+                     index: Optional[TraceIndex] = None):
+        """
+        Same as self.create() for the events from index start up to,
+        not including, stop.
+        :param index: TraceIndex of call_trace. Built or updated if not given.
+        """
+        if index is None:
+            index = TraceIndex(call_trace)
+        self.set_metadata(index.metadata)
+        self.extend(index.events_range(start, stop))
+
+    def create_vectorized(self, call_trace,
+                          progress: Optional[Progress] = None):
+        """
+        Same graph as self.create(), computed with NumPy array operations
+        over the whole trace instead of a Python loop over the events.
+        The trace must fit in memory.
+        """
+        columns = vector.load_columns(call_trace, progress=progress)
+        self.load_store(vector.create_store(columns, self.symtab))
+
+    def create_batch(self, call_traces, processes: Optional[int] = None,
+                     progress: Optional[Progress] = None):
+        """
+        Builds one graph from many traces (e.g. one per test case or per
+        process) in parallel. Counts and times of the same call site are
+        summed.
+        :param processes: number of worker processes.
+                    Defaults to os.cpu_count().
+        """
+        store = create_store(call_traces, processes=processes,
+                             progress=progress)
+        store.symtab = self.symtab
+        self.load_store(store)
+
+    def load_store(self, store: GraphStore):
+        """
+        Creates a node for every row of the store.
+        """
+        self.version += 1
+        nodes: List[CallGraphNode] = []
+        for row in range(len(store)):
+            symbol = self.get_callee(store.symbols[row])
+            call_site = store.call_sites[row]
+            try:
+                node = self.nodes[call_site]
+            except KeyError:
+                node = self.nodes[call_site] = CallGraphNode(symbol, call_site)
+                node.order = store.orders[row]
+            node.stats.merge(store.statistics(row))
+            node.inc_count(store.calls[row])
+            nodes.append(node)
+
+        for source, target in zip(store.sources, store.targets):
+            nodes[source].link(nodes[target])
+
+        for thread, row in store.roots.items():
+            self.roots.setdefault(thread, nodes[row])
+        if self.root is None and 0 in self.nodes:
+            self.root = self.nodes[0]
+            self._expect_main = False
+        self.order = max(self.order, len(self.nodes) + 1)
+
+    def extend(self, events: Iterable[TraceEvent]):
+        """
+        Adds trace events to the graph.
+        Each thread has its own call stack.
+        """
+        self.version += 1
+        stacks = self.stacks
+        for (addr, call_site, flag, time, thread), weight \
+                in weigh(events, self.scale, self.weights):
+            try:
+                stack = stacks[thread]
+            except KeyError:
+                stack = stacks[thread] = []
+
+            # On enter
+            if flag != 'X':
+                callee = self.get_callee(addr)
+                if self._expect_main and self.main_thread in (None, thread):
+                    # The first node of the main thread must be main function
+                    # in C. To indicate it, pass call_site as 0
+                    callee_node = self.root = self.set_node(callee, 0, weight)
+                    self.roots[thread] = callee_node
+                    self._expect_main = False
+
+                elif not stack:
+                    # Entry point of a thread.
+                    callee_node = self.set_node(callee, call_site, weight)
+                    self.roots.setdefault(thread, callee_node)
+
+                else:
+                    # The top node in the stack must be the caller.
+                    caller_node = stack[-1][0]
+                    callee_node = self.set_node(callee, call_site, weight)
                     # Link as 'caller_node -> callee_node'
                     caller_node.link(callee_node)
-                    stack.append(callee_node)
 
-                # On exit
-                else:
-                    node = stack.pop(-1)
-                    node.etime = int(time)
+                if not callee_node.order:
+                    callee_node.order = self.order
+                    self.order += 1
+
+                stack.append([callee_node, time, 0])
+
+            # On exit
+            elif stack:
+                node, stime, callees = stack.pop(-1)
+                elapsed = time - stime
+                # Sampled callees are slower than the calls they stand for.
+                node.stats.add(elapsed, max(elapsed - callees // weight, 0),
+                               weight)
+                if stack:
+                    stack[-1][2] += elapsed * weight
+
+    def close(self):
+        """
+        Drops the calls left open at the end of a trace,
+        so that the next trace starts with empty call stacks.
+        """
+        self.stacks.clear()
+        self.weights.clear()
+        self._expect_main = True
 
     def get_callee(self, address: int) -> Symbol:
         return self.symtab[address]
@@ -306,7 +613,7 @@ class CallGraph:
     def get_node(self, symbol: Symbol) -> Type[CallGraphBaseNode]:
         return self.nodes[symbol.address]
 
-    def set_node(self, symbol: Symbol, call_site: int):
+    def set_node(self, symbol: Symbol, call_site: int, count: int = 1):
         try:
             node = self.nodes[call_site]
 
@@ -314,12 +621,19 @@ class CallGraph:
             node = CallGraphNode(symbol, call_site)
             self.nodes[call_site] = node
 
-        node.inc_count()
+        node.inc_count(count)
         return node
 
     def get_color(self, node: Type[CallGraphBaseNode]) -> str:
-        prefixes = list(self.symtab.prefixes.keys())
-        return CallGraph.COLOR_TABLE[prefixes.index(node.symbol.prefix)]
+        return self.get_colors().get(node.symbol.prefix, self.UNKNOWN_COLOR)
+
+    def get_colors(self) -> Dict[str, str]:
+        """
+        Color of each compilation unit, computed once for all nodes.
+        """
+        table = CallGraph.COLOR_TABLE
+        return {prefix: table[index % len(table)]
+                for index, prefix in enumerate(self.symtab.prefixes)}
 
     def resolve_multiple_nodes(self, multiple_nodes: Type[CallGraphMultipleNodes]):
         for node in multiple_nodes.nodes:
@@ -330,6 +644,7 @@ class CallGraph:
         """
         Handles with context sensitivity of the graph.
         """
+        self.version += 1
         if level == 0:
             pass
 
@@ -348,7 +663,8 @@ class CallGraph:
 
     def _merge_nodes(self):
         # Do 'Group by' and merge them.
-        group: Dict[int, List[Type[CallGraphBaseNode]]] = dict()
+        # The callers of a node are grouped by function.
+        group: Dict[Tuple[int, int], List[Type[CallGraphBaseNode]]] = dict()
         for node in self.nodes.values():
             incoming_nodes = list(node.incoming_nodes.values())
             # Nothing to decrease
@@ -356,10 +672,11 @@ class CallGraph:
                 continue
 
             for inode in incoming_nodes:
+                key = (node.call_site, inode.symbol.address)
                 try:
-                    group[inode.symbol.address].append(inode)
+                    group[key].append(inode)
                 except KeyError:
-                    group[inode.symbol.address] = [inode]
+                    group[key] = [inode]
 
         for members in group.values():
             try:
@@ -379,20 +696,22 @@ class CallGraph:
         # Figure out a linked list.
         while len(nodes) > 0:
             key, node = nodes.popitem()
-            linked_node = [node]
-
+            # Collected backwards, then reversed.
+            previous_nodes = []
             current_node = node
             while True:
                 inode = next(iter(current_node.incoming_nodes.values()))
                 try:
-                    linked_node.insert(0, nodes.pop(inode.call_site))
+                    previous_nodes.append(nodes.pop(inode.call_site))
                     current_node = inode
                 except KeyError:
                     break
 
+            linked_node = previous_nodes[::-1]
+            linked_node.append(node)
             current_node = node
             while True:
-                onode = next(iter(node.outgoing_nodes.values()))
+                onode = next(iter(current_node.outgoing_nodes.values()))
                 try:
                     linked_node.append(nodes.pop(onode.call_site))
                     current_node = onode
@@ -404,40 +723,112 @@ class CallGraph:
                 self.resolve_multiple_nodes(linked_node)
 
     def _gather_nodes(self):
-        pass
-
-    def draw(self, name):
-        dot = Digraph(
-            name=f'Call graph by GCC',
-            comment='Call Tree',
-            strict=True,
-            format='PDF',
-            graph_attr={
-                'ordering': 'out',
-                'compound': 'true'
-            })
-        self.normalize_frequency()
+        # Do 'Group by' function and build a new graph from the groups.
+        # Every node and every edge is visited once.
+        group: Dict[int, List[Type[CallGraphBaseNode]]] = dict()
         for node in self.nodes.values():
-            label_contents = f''
-            if isinstance(node, CallGraphMergedNode):
-                label_contents = f'Merged Node'
+            try:
+                group[node.symbol.address].append(node)
+            except KeyError:
+                group[node.symbol.address] = [node]
 
-            elif isinstance(node, CallGraphLinkedNode):
-                label_contents = f'Linked Node'
+        gathered_nodes: Dict[int, CallGraphGatheredNode] = {
+            address: CallGraphGatheredNode(*members)
+            for address, members in group.items()}
 
-            else:
-                pass
+        for node in self.nodes.values():
+            callee = gathered_nodes[node.symbol.address]
+            callers = {inode.symbol.address
+                       for inode in node.incoming_nodes.values()}
+            if len(callers) == 1:
+                gathered_nodes[callers.pop()].add_call(callee, node.stats)
+                continue
 
-            dot.node(name=f'{node.name}', xlabel=f'{label_contents}',
-                     fontname='NanumSquare', width='2', height='1', shape='box',
-                     penwidth=f'{self.get_penwidth(node)}', color='#ff0000',
-                     style='filled',
-                     fillcolor=f'{self.get_color(node)}')
+            # Several caller functions reach the same call-site node, e.g.
+            # after merging nodes at a lower sensitivity. The graph does not
+            # count the calls along each edge, so the statistics of the node
+            # cannot be split between the callers. The edges are kept
+            # without statistics instead of counting the calls once per
+            # caller.
+            for address in callers:
+                gathered_nodes[address].add_call(callee, CallStatistics())
+
+        self.nodes = {node.call_site: node
+                      for node in gathered_nodes.values()}
+        if self.root is not None:
+            self.root = gathered_nodes[self.root.symbol.address]
+        self.roots = {thread: gathered_nodes[node.symbol.address]
+                      for thread, node in self.roots.items()}
+
+    def draw(self, name, format: str = 'pdf', top: Optional[int] = None,
+             min_elapsed: int = 0, min_calls: int = 0) -> str:
+        """
+        Writes the graph in DOT language to '{name}.dot' and lays it out.
+        Large graphs can be pruned to their hottest nodes. The other nodes
+        are collapsed into one node per compilation unit.
+        The layout requires the Graphviz 'dot' executable.
+        :param format: 'pdf', 'svg' or 'dot' to skip the layout.
+        :param top: keeps only the K nodes with the longest inclusive time.
+        :param min_elapsed: keeps the nodes with at least this inclusive time.
+        :param min_calls: keeps the nodes invoked at least this many times.
+        :return: the path of the output file.
+        """
+        if format not in ('pdf', 'svg', 'dot'):
+            raise ValueError(f'Unknown format: {format}')
 
-            for edge in node.incoming_nodes.values():
-                dot.edge(str(edge.name), str(node.name), label=str(node.order))
+        nodes = self.nodes.values()
+        kept = render.hottest(nodes, top=top, min_elapsed=min_elapsed,
+                              min_calls=min_calls)
+        groups = render.prune(nodes, kept)
 
-        dot.render(filename=f'{name}')
+        self.normalize_frequency()
+        colors = self.get_colors()
+        widths = render.penwidths(
+            self.frequency,
+            (node.call_count for node in set(groups.values())))
+        labels = {
+            CallGraphMergedNode: 'Merged Node',
+            CallGraphLinkedNode: 'Linked Node',
+            CallGraphGatheredNode: 'Gathered Node',
+            render.OtherNode: 'Other Nodes',
+        }
+
+        source = f'{name}.dot'
+        with open(source, 'w') as fp:
+            dot = render.DotWriter(fp, name='Call graph by GCC', graph_attr={
+                'ordering': 'out',
+                'compound': 'true'
+            })
+            written = set()
+            edges = set()
+            for node in nodes:
+                group = groups[node]
+                if group not in written:
+                    written.add(group)
+                    dot.node(group.name, xlabel=labels.get(type(group), ''),
+                             fontname='NanumSquare', width='2', height='1',
+                             shape='box', penwidth=widths[group.call_count],
+                             color='#ff0000', style='filled',
+                             fillcolor=colors.get(group.basename,
+                                                  self.UNKNOWN_COLOR))
+
+                for inode in node.incoming_nodes.values():
+                    tail = groups[inode]
+                    edge = (tail, group)
+                    if edge in edges or (tail is group
+                                         and group not in kept):
+                        continue
+                    edges.add(edge)
+                    dot.edge(tail.name, group.name,
+                             label=node.order if group in kept else '')
+            dot.close()
+
+        if format == 'dot':
+            return source
+
+        output = f'{name}.{format}'
+        render.render(source, output, format=format)
+        return output
 
     def normalize_frequency(self, step=10):
         """
@@ -459,24 +850,48 @@ class CallGraph:
 
         return len(self.frequency) * 2
 
+    def coverage(self) -> Tuple[int, int]:
+        """
+        :return: number of functions called and number of functions.
+        """
+        called_count = sum(1 for v in self.symtab.values() if v.call_count)
+        return called_count, len(self.symtab)
+
     def check_coverage(self):
+        uncalled = self.query.uncalled()
+        uncalled_count = sum(len(symbols) for symbols in uncalled.values())
         total = len(self.symtab)
-        called_count = 0
-        uncalled_count = 0
-        v: Symbol
-        for k, v in self.symtab:
-            if v.call_count == 0:
-                uncalled_count += 1
         called_count = total - uncalled_count
 
         print(f'Coverage: {called_count} out of {total} '
               f'({round((called_count / total) * 100, 2)}%).')
         print(f'Function not invoked: {uncalled_count}')
         print(f'Details:')
-        for k, v in self.symtab:
-            if v.call_count == 0:
+        for symbols in uncalled.values():
+            for v in symbols:
                 print(f'\t{v}')
 
+    def summarize(self, top: int = 5, file=sys.stdout):
+        """
+        Prints the size, the coverage and the hottest nodes by exclusive time.
+        """
+        called_count, total = self.coverage()
+        print(f'Nodes: {self.size}, coverage: {called_count} out of {total} '
+              f'({round((called_count / (total or 1)) * 100, 2)}%).',
+              file=file)
+        for node in heapq.nlargest(top, self.nodes.values(),
+                                   key=lambda node: node.actual_elapsed):
+            print(f'\t{node}: {node.stats.count} calls, '
+                  f'{node.actual_elapsed}ns actual, {node.elapsed}ns elapsed',
+                  file=file)
+
+    def diff(self, other: CallGraph) -> ProfileDiff:
+        """
+        Compares this graph, the baseline, with another run or build.
+        Both should be at sensitivity 0 or 3.
+        """
+        return ProfileDiff(self.nodes.values(), other.nodes.values())
+
     def pretty_print(self):
         for v in self.nodes.values():
             v.pretty_print()
@@ -0,0 +1,436 @@
+import os
+import struct
+import zlib
+from bisect import bisect_left, bisect_right
+from os import PathLike
+from typing import Union, Dict, List, Tuple, Iterator, Optional
+from hoshingak.core.trace import BinaryTraceReader, TextTraceReader, \
+    TraceEvent, is_compressed, open_trace
+
+INT64_MIN = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
+
+# (address, call site, enter time, enter flag) of each open call,
+# outermost first.
+Stacks = Dict[int, List[Tuple[int, int, int, str]]]
+
+
+class Checkpoint:
+    """
+    A position in the trace where reading can start:
+    the byte offset, the number of events before it and the calls
+    open at that point.
+    """
+    __slots__ = ('event', 'offset', 'stacks', 'min_time', 'max_time')
+
+    def __init__(self, event: int, offset: int, stacks: Stacks,
+                 min_time: int = INT64_MAX, max_time: int = INT64_MIN):
+        self.event = event
+        self.offset = offset
+        self.stacks = stacks
+        # Range of the timestamps from this checkpoint to the next one.
+        self.min_time = min_time
+        self.max_time = max_time
+
+
+def snapshot(stacks: Stacks) -> Stacks:
+    return {thread: list(stack) for thread, stack in stacks.items() if stack}
+
+
+class TraceIndex:
+    """
+    Sidecar file of checkpoints every 'interval' events, so that a time
+    window or a range of events can be read without going through the
+    whole trace. Plain text, binary and HOSHINGAK_COMPRESS traces can be
+    indexed; gzip and xz streams cannot be seeked.
+
+    Layout of the sidecar, little-endian:
+        header, then 'count' checkpoints and the checkpoint at the end
+        of the indexed part. Each checkpoint is followed by its open calls.
+    """
+    MAGIC = b'HSIX'
+    VERSION = 2
+    # magic, version, kind, interval, indexed bytes, indexed events,
+    # crc32 of the first bytes of the trace, number of checkpoints.
+    HEADER = struct.Struct('<4sHHQQQII')
+    # event, offset, min time, max time, number of open calls.
+    CHECKPOINT = struct.Struct('<QQqqI')
+    # address, call site, enter time, thread, enter flag.
+    FRAME = struct.Struct('<QQqIc')
+    SUFFIX = '.hsidx'
+    INTERVAL = 1 << 18
+    # Detects a trace replaced by another one, e.g. a new run.
+    PREFIX_SIZE = 4096
+    TEXT_CHUNK = 1 << 16
+    # Kinds of traces
+    TEXT = 0
+    BINARY = 1
+    FRAMES = 2
+
+    def __init__(self, file: Union[str, PathLike], interval: int = INTERVAL,
+                 path: Optional[Union[str, PathLike]] = None):
+        """
+        Loads the sidecar of the trace and indexes what was appended since.
+        :param file: trace generated by GCC -finstrument-functions
+                    with injection code.
+        :param interval: number of events between two checkpoints.
+                    In a HOSHINGAK_COMPRESS trace, checkpoints are at least
+                    a frame apart.
+        :param path: sidecar file, default to the trace path + SUFFIX.
+        """
+        if interval < 1:
+            raise ValueError(f'interval must be positive: {interval}')
+        if is_compressed(file):
+            raise ValueError(f'{file}: gzip and xz traces cannot be indexed.')
+
+        self.file = file
+        self.interval = interval
+        self.path = path if path is not None \
+            else f'{os.fspath(file)}{self.SUFFIX}'
+
+        reader = open_trace(file)
+        self.metadata = reader.metadata
+        if isinstance(reader, BinaryTraceReader):
+            self.kind = self.FRAMES if reader.flags & reader.COMPRESSED \
+                else self.BINARY
+            self.record = reader.record
+            self.decode = reader.decode
+            start = reader.start
+        else:
+            self.kind = self.TEXT
+            self.record = None
+            self.decode = None
+            start = 0
+
+        self.checkpoints: List[Checkpoint] = [Checkpoint(0, start, dict())]
+        self.tail = Checkpoint(0, start, dict())
+        self.load()
+        self.update()
+
+    @property
+    def events(self) -> int:
+        """
+        Number of events indexed.
+        """
+        return self.tail.event
+
+    def prefix_crc(self, size: int) -> int:
+        with open(self.file, 'rb') as fp:
+            return zlib.crc32(fp.read(min(size, self.PREFIX_SIZE)))
+
+    def load(self) -> bool:
+        """
+        :return: False if the sidecar is missing or does not match the
+                    trace anymore.
+        """
+        try:
+            with open(self.path, 'rb') as fp:
+                data = fp.read()
+        except FileNotFoundError:
+            return False
+
+        if len(data) < self.HEADER.size:
+            return False
+        magic, version, kind, interval, end, events, crc, count = \
+            self.HEADER.unpack_from(data)
+        if magic != self.MAGIC or version != self.VERSION \
+                or kind != self.kind or interval != self.interval:
+            return False
+        # A shorter trace or another beginning is a new trace.
+        if os.path.getsize(self.file) < end or self.prefix_crc(end) != crc:
+            return False
+
+        offset = self.HEADER.size
+        checkpoints = []
+        for _ in range(count + 1):
+            event, position, min_time, max_time, nframes = \
+                self.CHECKPOINT.unpack_from(data, offset)
+            offset += self.CHECKPOINT.size
+            stacks: Stacks = dict()
+            for address, call_site, time, thread, flag \
+                    in self.FRAME.iter_unpack(
+                        data[offset:offset + nframes * self.FRAME.size]):
+                stacks.setdefault(thread, []).append(
+                    (address, call_site, time, flag.decode()))
+            offset += nframes * self.FRAME.size
+            checkpoints.append(
+                Checkpoint(event, position, stacks, min_time, max_time))
+
+        self.tail = checkpoints.pop()
+        self.checkpoints = checkpoints
+        return True
+
+    def save(self):
+        chunks = [self.HEADER.pack(
+            self.MAGIC, self.VERSION, self.kind, self.interval,
+            self.tail.offset, self.tail.event,
+            self.prefix_crc(self.tail.offset), len(self.checkpoints))]
+        for checkpoint in self.checkpoints + [self.tail]:
+            chunks.append(self.CHECKPOINT.pack(
+                checkpoint.event, checkpoint.offset, checkpoint.min_time,
+                checkpoint.max_time,
+                sum(len(stack) for stack in checkpoint.stacks.values())))
+            for thread, stack in checkpoint.stacks.items():
+                for address, call_site, time, flag in stack:
+                    chunks.append(self.FRAME.pack(
+                        address, call_site, time, thread, flag.encode()))
+
+        # Readers never see a partially written sidecar.
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'wb') as fp:
+            fp.write(b''.join(chunks))
+        os.replace(temporary, self.path)
+
+    def update(self) -> bool:
+        """
+        Indexes the events appended since the last update, starting from
+        the end of the indexed part instead of the beginning of the trace.
+        The index is kept in memory when the sidecar cannot be written,
+        e.g. next to a trace in a read-only directory.
+        :return: True if the sidecar was written.
+        """
+        current = self.checkpoints[-1]
+        stacks = {thread: list(stack)
+                  for thread, stack in self.tail.stacks.items()}
+        event = self.tail.event
+        end = self.tail.offset
+        for offset, end, events in self.blocks(self.tail.offset,
+                                               self.interval):
+            if event - current.event >= self.interval:
+                current = Checkpoint(event, offset, snapshot(stacks))
+                self.checkpoints.append(current)
+
+            min_time = current.min_time
+            max_time = current.max_time
+            for addr, call_site, flag, time, thread in events:
+                if time < min_time:
+                    min_time = time
+                if time > max_time:
+                    max_time = time
+                try:
+                    stack = stacks[thread]
+                except KeyError:
+                    stack = stacks[thread] = []
+                if flag != 'X':
+                    stack.append((addr, call_site, time, flag))
+                elif stack:
+                    stack.pop()
+            current.min_time = min_time
+            current.max_time = max_time
+            event += len(events)
+
+        if end == self.tail.offset and os.path.exists(self.path):
+            return False
+
+        self.tail = Checkpoint(event, end, snapshot(stacks))
+        try:
+            self.save()
+        except OSError:
+            return False
+        return True
+
+    def blocks(self, offset: int, limit: Optional[int] = None
+               ) -> Iterator[Tuple[int, int, List[TraceEvent]]]:
+        """
+        Yields (start offset, end offset, events) of the complete records
+        from the given offset. A checkpoint can be at any block boundary.
+        :param limit: maximum number of events of a block. A frame of a
+                    HOSHINGAK_COMPRESS trace is never split, so checkpoints
+                    are at least a frame apart.
+        """
+        with open(self.file, 'rb') as fp:
+            fp.seek(offset)
+            if self.kind == self.FRAMES:
+                frame = BinaryTraceReader.FRAME
+                while True:
+                    header = fp.read(frame.size)
+                    if len(header) < frame.size:
+                        return
+                    size, raw_size = frame.unpack(header)
+                    data = fp.read(size)
+                    if len(data) < size:
+                        # Not fully written yet.
+                        return
+                    chunk = zlib.decompress(data, bufsize=raw_size)
+                    chunk = chunk[:len(chunk) - len(chunk) % self.record.size]
+                    end = offset + frame.size + size
+                    yield offset, end, list(self.decode(chunk))
+                    offset = end
+
+            elif self.kind == self.BINARY:
+                step = min(BinaryTraceReader.CHUNK_RECORDS,
+                           limit or BinaryTraceReader.CHUNK_RECORDS) \
+                    * self.record.size
+                while True:
+                    chunk = fp.read(step)
+                    chunk = chunk[:len(chunk) - len(chunk) % self.record.size]
+                    if not chunk:
+                        return
+                    end = offset + len(chunk)
+                    yield offset, end, list(self.decode(chunk))
+                    offset = end
+                    fp.seek(offset)
+
+            else:
+                remainder = b''
+                left = limit
+                while True:
+                    chunk = fp.read(self.TEXT_CHUNK)
+                    if not chunk:
+                        return
+                    data = remainder + chunk
+                    # The last line may not be complete yet.
+                    cut = data.rfind(b'\n') + 1
+                    remainder = data[cut:]
+                    if not cut:
+                        continue
+                    lines = data[:cut - 1].split(b'\n')
+                    if not limit:
+                        end = offset + cut
+                        yield offset, end, list(TextTraceReader.parse(lines))
+                        offset = end
+                        continue
+                    # Blocks end every 'limit' events, across chunks.
+                    while lines:
+                        part = lines[:left]
+                        del lines[:left]
+                        events = list(TextTraceReader.parse(part))
+                        left -= len(events)
+                        if left <= 0:
+                            left = limit
+                        end = offset + sum(len(line) + 1 for line in part)
+                        yield offset, end, events
+                        offset = end
+
+    def scan(self, checkpoint: Checkpoint
+             ) -> Iterator[Tuple[int, TraceEvent]]:
+        """
+        Yields (index, event) from the checkpoint to the end of the trace.
+        """
+        index = checkpoint.event
+        for _, _, events in self.blocks(checkpoint.offset):
+            for event in events:
+                yield index, event
+                index += 1
+
+    @staticmethod
+    def enter(stacks: Stacks, time: int, thread: int) -> Iterator[TraceEvent]:
+        """
+        Enters the calls open in the thread again at the given time.
+        """
+        for address, call_site, _, flag in stacks.get(thread, ()):
+            yield TraceEvent(address, call_site, flag, time, thread)
+
+    @staticmethod
+    def exit(stacks: Stacks, time: int, thread: int) -> Iterator[TraceEvent]:
+        """
+        Exits the calls open in the thread at the given time.
+        """
+        for address, call_site, _, _ in reversed(stacks.get(thread, ())):
+            yield TraceEvent(address, call_site, 'X', time, thread)
+
+    @staticmethod
+    def apply(stacks: Stacks, event: TraceEvent):
+        try:
+            stack = stacks[event.thread]
+        except KeyError:
+            stack = stacks[event.thread] = []
+        if event.flag != 'X':
+            stack.append((event.address, event.call_site, event.time,
+                          event.flag))
+        elif stack:
+            stack.pop()
+
+    def events_between(self, t0: int, t1: int) -> Iterator[TraceEvent]:
+        """
+        Yields the events with a timestamp in [t0, t1].
+        The calls open at t0 are entered at t0 and the calls still open
+        at t1 are exited at t1, so that their times are cut to the window.
+        """
+        if t0 > t1:
+            raise ValueError(f'Empty time window: [{t0}, {t1}]')
+
+        # Events before a checkpoint are all earlier than its prefix
+        # maximum, and events after it are all later than its suffix minimum.
+        prefix_max = [INT64_MIN]
+        for checkpoint in self.checkpoints[:-1]:
+            prefix_max.append(max(prefix_max[-1], checkpoint.max_time))
+        suffix_min = [INT64_MAX]
+        for checkpoint in reversed(self.checkpoints):
+            suffix_min.append(min(suffix_min[-1], checkpoint.min_time))
+        suffix_min = suffix_min[:0:-1]
+
+        start = max(bisect_left(prefix_max, t0) - 1, 0)
+        last = bisect_right(suffix_min, t1)
+        stop = self.checkpoints[last].event \
+            if last < len(self.checkpoints) else None
+
+        stacks = snapshot(self.checkpoints[start].stacks)
+        started = set()
+        ended = set()
+        for index, event in self.scan(self.checkpoints[start]):
+            if stop is not None and index >= stop:
+                break
+
+            thread = event.thread
+            if event.time < t0:
+                self.apply(stacks, event)
+                continue
+            if thread in ended:
+                continue
+            if thread not in started:
+                started.add(thread)
+                yield from self.enter(stacks, t0, thread)
+            if event.time > t1:
+                ended.add(thread)
+                yield from self.exit(stacks, t1, thread)
+                continue
+
+            self.apply(stacks, event)
+            yield event
+        else:
+            # Calls open at the end of the trace are left open, like in
+            # a trace of a crashed program.
+            return
+
+        # Every event from here on is later than t1.
+        for thread in list(stacks):
+            if thread in ended:
+                continue
+            if thread not in started:
+                yield from self.enter(stacks, t0, thread)
+            yield from self.exit(stacks, t1, thread)
+
+    def events_range(self, start: int, stop: int) -> Iterator[TraceEvent]:
+        """
+        Yields the events from index start up to, not including, stop.
+        The calls open before them are entered at the time of the first
+        event and the calls left open are exited at the time of the last.
+        """
+        if start < 0 or start > stop:
+            raise ValueError(f'Invalid range of events: [{start}, {stop})')
+
+        checkpoint = self.checkpoints[max(
+            bisect_right([checkpoint.event for checkpoint in self.checkpoints],
+                         start) - 1, 0)]
+        stacks = snapshot(checkpoint.stacks)
+        time = None
+        for index, event in self.scan(checkpoint):
+            if index >= stop:
+                break
+            if index < start:
+                self.apply(stacks, event)
+                continue
+            if index == start:
+                for thread in list(stacks):
+                    yield from self.enter(stacks, event.time, thread)
+
+            self.apply(stacks, event)
+            time = event.time
+            yield event
+        else:
+            return
+
+        if time is not None:
+            for thread in list(stacks):
+                yield from self.exit(stacks, time, thread)
@@ -0,0 +1,153 @@
+from __future__ import annotations
+import sys
+from os import PathLike
+from typing import Union, Dict, List, Iterable, Iterator, Optional, Tuple
+from hoshingak.core.symbol import SymbolTable
+from hoshingak.core.graph import CallGraph
+from hoshingak.core.trace import open_trace, Progress, TraceEvent, \
+    TraceMetadata
+
+
+class Process:
+    """
+    Trace of one process and its place in the process tree.
+    """
+    __slots__ = ('trace', 'metadata', 'graph', 'parent', 'children',
+                 'inherited')
+
+    def __init__(self, trace: Union[str, bytes, PathLike],
+                 metadata: TraceMetadata):
+        self.trace = trace
+        self.metadata = metadata
+        self.graph: Optional[CallGraph] = None
+        self.parent: Optional[Process] = None
+        self.children: List[Process] = []
+        # (node, enter flag) of the calls of the parent graph open at the
+        # fork, outermost first.
+        self.inherited: List[Tuple[object, str]] = []
+
+    def __str__(self):
+        return f'{self.pid} ({self.trace})'
+
+    @property
+    def pid(self):
+        return self.metadata.pid
+
+    @property
+    def is_forked(self):
+        return self.metadata.fork_time != 0
+
+    @property
+    def fork_point(self):
+        """
+        :return: the node of the parent graph that called fork().
+        """
+        return self.inherited[-1][0] if self.inherited else None
+
+
+class ProcessTree:
+    """
+    Graphs of the traces of a process and of the processes it forked.
+    The graph of a child starts with the calls open in the parent at the
+    fork, so its time is attributed to the same paths as in the parent.
+    """
+
+    def __init__(self, symtab: SymbolTable):
+        self.symtab = symtab
+        self.processes: List[Process] = []
+        self.roots: List[Process] = []
+
+    def create(self, call_traces: Iterable[Union[str, bytes, PathLike]],
+               progress: Optional[Progress] = None):
+        """
+        :param call_traces: traces of the processes, in any order.
+        """
+        processes: Dict[int, Process] = dict()
+        for call_trace in call_traces:
+            process = Process(call_trace, open_trace(call_trace).metadata)
+            self.processes.append(process)
+            # Traces of older injection libraries have no pid.
+            if process.pid:
+                processes[process.pid] = process
+
+        for process in self.processes:
+            parent = processes.get(process.metadata.ppid) \
+                if process.is_forked else None
+            if parent is None:
+                self.roots.append(process)
+            else:
+                process.parent = parent
+                parent.children.append(process)
+
+        # A parent is built before its children,
+        # which start from its call stack at the fork.
+        pending = list(self.roots)
+        while pending:
+            process = pending.pop()
+            self.create_graph(process, progress=progress)
+            pending.extend(process.children)
+
+    def create_graph(self, process: Process,
+                     progress: Optional[Progress] = None):
+        graph = process.graph = CallGraph(self.symtab)
+        events = open_trace(process.trace, progress=progress)
+        graph.set_metadata(events.metadata)
+        # The main thread of a child has the id of the process.
+        graph.extend(TraceEvent(node.symbol.address, node.call_site, flag,
+                                process.metadata.fork_time, process.pid)
+                     for node, flag in process.inherited)
+        graph.extend(self.watch_forks(process, events))
+
+    @classmethod
+    def watch_forks(cls, process: Process,
+                    events: Iterable[TraceEvent]) -> Iterator[TraceEvent]:
+        """
+        Passes the events on to the graph of the process and keeps its
+        call stack at the fork of each child. The graph has consumed the
+        events yielded before, so its stacks are those before the next one.
+        """
+        forks: Dict[int, List[Process]] = dict()
+        for child in sorted(process.children,
+                            key=lambda child: child.metadata.fork_time):
+            forks.setdefault(child.metadata.fork_thread, []).append(child)
+
+        graph = process.graph
+        for event in events:
+            children = forks.get(event.thread)
+            while children and children[0].metadata.fork_time < event.time:
+                child = children.pop(0)
+                child.inherited = cls.inherit(graph, event.thread)
+            yield event
+
+        # Forked after the last event of their thread.
+        for thread, children in forks.items():
+            for child in children:
+                child.inherited = cls.inherit(graph, thread)
+
+    @staticmethod
+    def inherit(graph, thread: int) -> List[Tuple[object, str]]:
+        """
+        :param graph: CallGraph of the parent process.
+        :param thread: thread of the parent that called fork().
+        :return: (node, enter flag) of each call open in the thread.
+                    The flag is 'S' where a sampled call starts.
+        """
+        inherited = []
+        weight = 1
+        for (node, _, _), frame_weight in zip(
+                graph.stacks.get(thread, ()), graph.weights.get(thread, ())):
+            inherited.append((node, 'E' if frame_weight == weight else 'S'))
+            weight = frame_weight
+        return inherited
+
+    def pretty_print(self, file=sys.stdout):
+        pending = [(process, 0) for process in reversed(self.roots)]
+        while pending:
+            process, level = pending.pop()
+            fork_point = process.fork_point
+            print(f'{"  " * level}{process}'
+                  f'{f" forked at {fork_point}" if fork_point else ""}: '
+                  f'{process.graph.size if process.graph else 0} nodes',
+                  file=file)
+            pending.extend((child, level + 1)
+                           for child in reversed(process.children))
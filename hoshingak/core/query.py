@@ -0,0 +1,133 @@
+import heapq
+from itertools import count
+from typing import Dict, List, Tuple, Callable
+from hoshingak.core.diff import FunctionKey, FunctionProfile, profile
+
+
+class GraphQuery:
+    """
+    Answers questions about a CallGraph with data structures instead of
+    printed text. Aggregates are computed by the first query that needs
+    them and kept until the graph changes.
+    """
+    ORDERS: Dict[str, Callable[[FunctionProfile], int]] = {
+        'exclusive': lambda function: function.stats.exclusive,
+        'total': lambda function: function.stats.total,
+        'count': lambda function: function.calls,
+    }
+
+    def __init__(self, graph):
+        """
+        :param graph: CallGraph, at sensitivity 0 or 3 for exact
+                    per-function statistics.
+        """
+        self.graph = graph
+        self._version = None
+        self._cache = dict()
+
+    def cached(self, key, compute: Callable):
+        if self._version != self.graph.version:
+            self._cache.clear()
+            self._version = self.graph.version
+        try:
+            return self._cache[key]
+        except KeyError:
+            value = self._cache[key] = compute()
+            return value
+
+    def functions(self) -> Dict[FunctionKey, FunctionProfile]:
+        """
+        :return: statistics of every called function,
+                    keyed by (CU prefix, name).
+        """
+        return self.cached('functions',
+                           lambda: profile(self.graph.nodes.values()))
+
+    def top_functions(self, top: int = 10,
+                      by: str = 'exclusive') -> List[FunctionProfile]:
+        """
+        :param by: 'exclusive' (self time), 'total' (inclusive time)
+                    or 'count' (number of calls).
+        """
+        try:
+            order = self.ORDERS[by]
+        except KeyError:
+            raise ValueError(f'Unknown order: {by}')
+
+        return self.cached(('top', top, by), lambda: heapq.nlargest(
+            top, self.functions().values(), key=order))
+
+    def hot_paths(self, top: int = 5) -> List[Tuple[int, List]]:
+        """
+        Heaviest paths from the roots, where the weight of a path is the
+        inclusive time of its lightest node. Each node is reached once,
+        through its heaviest path, like Dijkstra's algorithm for the widest
+        path, so recursion and other cycles cost O(E log V) and not one
+        path per cycle. A path ends at a node none of whose callees is
+        reached through it.
+        :return: (weight, nodes) of the heaviest paths, heaviest first.
+        """
+        return self.cached(('paths', top), lambda: self._hot_paths(top))
+
+    def _hot_paths(self, top: int) -> List[Tuple[int, List]]:
+        roots = dict.fromkeys(self.graph.roots.values())
+        if self.graph.root is not None:
+            roots[self.graph.root] = None
+
+        # Ties are broken by insertion order instead of comparing nodes.
+        order = count()
+        pending = [(-root.elapsed, next(order), root, None) for root in roots]
+        heapq.heapify(pending)
+        weights = dict()
+        parents = dict()
+        leaves = set()
+        while pending:
+            weight, _, node, parent = heapq.heappop(pending)
+            if node in weights:
+                continue
+            weights[node] = -weight
+            parents[node] = parent
+            leaves.discard(parent)
+            leaves.add(node)
+            for callee in node.outgoing_nodes.values():
+                if callee not in weights:
+                    heapq.heappush(pending, (max(weight, -callee.elapsed),
+                                             next(order), callee, node))
+
+        paths = []
+        for leaf in heapq.nlargest(top, leaves, key=weights.__getitem__):
+            path = []
+            node = leaf
+            while node is not None:
+                path.append(node)
+                node = parents[node]
+            paths.append((weights[leaf], path[::-1]))
+        return paths
+
+    def callers(self, symbol) -> List[FunctionProfile]:
+        """
+        :param symbol: Symbol of the function.
+        :return: the functions calling it.
+        """
+        functions = self.functions()
+        function = functions.get((symbol.prefix, symbol.name))
+        if function is None:
+            return []
+        return [functions[key] for key in function.callers]
+
+    def callees(self, symbol) -> List[FunctionProfile]:
+        """
+        :param symbol: Symbol of the function.
+        :return: the functions it calls.
+        """
+        functions = self.functions()
+        function = functions.get((symbol.prefix, symbol.name))
+        if function is None:
+            return []
+        return [functions[key] for key in function.callees]
+
+    def uncalled(self) -> Dict[str, List]:
+        """
+        :return: the symbols never called, grouped by CU prefix.
+        """
+        return self.cached('uncalled', self.graph.symtab.uncalled)
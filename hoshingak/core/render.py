@@ -0,0 +1,135 @@
+import heapq
+from bisect import bisect_right
+from os import PathLike
+from subprocess import check_call
+from typing import Union, Dict, Iterable, List, Optional, Set, TextIO
+
+
+class OtherNode:
+    """
+    Nodes of one compilation unit left out of a pruned graph.
+    Only their totals are kept.
+    """
+    __slots__ = ('prefix', 'size', 'elapsed', 'actual_elapsed', 'call_count')
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.size = 0
+        self.elapsed = 0
+        self.actual_elapsed = 0
+        self.call_count = 0
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def basename(self):
+        return self.prefix
+
+    @property
+    def name(self):
+        return f'{self.prefix}/({self.size} others)'
+
+    def add(self, node):
+        self.size += 1
+        self.elapsed += node.elapsed
+        self.actual_elapsed += node.actual_elapsed
+        self.call_count += node.stats.count
+
+
+def hottest(nodes: Iterable, top: Optional[int] = None,
+            min_elapsed: int = 0, min_calls: int = 0) -> Set:
+    """
+    :param nodes: nodes of a CallGraph.
+    :param top: keeps only the K nodes with the longest inclusive time.
+    :param min_elapsed: keeps the nodes with at least this inclusive time.
+    :param min_calls: keeps the nodes invoked at least this many times.
+    :return: the nodes to draw. The root is always kept.
+    """
+    nodes = [node for node in nodes
+             if node.is_root or (node.elapsed >= min_elapsed
+                                 and node.stats.count >= min_calls)]
+    if top is not None and len(nodes) > top:
+        kept = set(heapq.nlargest(top, nodes, key=lambda node: node.elapsed))
+        kept.update(node for node in nodes if node.is_root)
+        return kept
+
+    return set(nodes)
+
+
+def prune(nodes: Iterable, kept: Set) -> Dict:
+    """
+    Maps every node to itself if it is kept, otherwise to the OtherNode
+    of its compilation unit. The edges are collapsed accordingly.
+    """
+    groups = dict()
+    others: Dict[str, OtherNode] = dict()
+    for node in nodes:
+        if node in kept:
+            groups[node] = node
+            continue
+
+        prefix = node.basename
+        try:
+            other = others[prefix]
+        except KeyError:
+            other = others[prefix] = OtherNode(prefix)
+        other.add(node)
+        groups[node] = other
+
+    return groups
+
+
+def quote(value) -> str:
+    value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{value}"'
+
+
+class DotWriter:
+    """
+    Writes a graph in DOT language line by line,
+    without keeping the nodes and edges in memory.
+    """
+
+    def __init__(self, fp: TextIO, name: str, strict: bool = True,
+                 graph_attr: Optional[Dict[str, str]] = None):
+        self.fp = fp
+        self.fp.write(f'{"strict " if strict else ""}digraph {quote(name)} {{\n')
+        for key, value in (graph_attr or {}).items():
+            self.fp.write(f'\t{key}={quote(value)}\n')
+
+    @staticmethod
+    def attributes(attrs: Dict[str, object]) -> str:
+        return ' '.join(f'{key}={quote(value)}' for key, value in attrs.items())
+
+    def node(self, name: str, **attrs):
+        self.fp.write(f'\t{quote(name)} [{self.attributes(attrs)}]\n')
+
+    def edge(self, tail: str, head: str, **attrs):
+        self.fp.write(f'\t{quote(tail)} -> {quote(head)}'
+                      f' [{self.attributes(attrs)}]\n')
+
+    def close(self):
+        self.fp.write('}\n')
+
+
+def penwidths(frequency: List[int], call_counts: Iterable[int]) -> Dict:
+    """
+    Same as CallGraph.get_penwidth() for many call counts at once.
+    """
+    widths = dict()
+    for call_count in call_counts:
+        if call_count not in widths:
+            index = bisect_right(frequency, call_count)
+            widths[call_count] = index if index < len(frequency) \
+                else len(frequency) * 2
+    return widths
+
+
+def render(source: Union[str, PathLike], output: Union[str, PathLike],
+           format: str = 'pdf'):
+    """
+    Lays out a DOT file with Graphviz.
+    The 'dot' executable must be on PATH.
+    """
+    check_call(['dot', f'-T{format}', '-o', f'{output}', f'{source}'])
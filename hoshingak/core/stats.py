@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+
+class CallStatistics:
+    """
+    Running statistics of every invocation of a node, in nanoseconds.
+    Only the aggregates are kept, not the individual calls.
+    """
+    __slots__ = ('count', 'total', 'exclusive', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        # Inclusive time, including callees.
+        self.total = 0
+        # Self time, excluding callees.
+        self.exclusive = 0
+        self.min = 0
+        self.max = 0
+
+    def __repr__(self):
+        return f'<CallStatistics> (count: {self.count}, total: {self.total}' \
+               f', exclusive: {self.exclusive}, min: {self.min}' \
+               f', max: {self.max})'
+
+    @classmethod
+    def from_values(cls, count: int, total: int, exclusive: int, min: int,
+                    max: int) -> CallStatistics:
+        stats = cls()
+        stats.count = count
+        stats.total = total
+        stats.exclusive = exclusive
+        stats.min = min
+        stats.max = max
+        return stats
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def add(self, inclusive: int, exclusive: int, count: int = 1):
+        """
+        :param count: number of invocations the given one stands for,
+                    e.g. the sampling rate of the trace.
+        """
+        if not self.count or inclusive < self.min:
+            self.min = inclusive
+        if inclusive > self.max:
+            self.max = inclusive
+        self.count += count
+        self.total += inclusive * count
+        self.exclusive += exclusive * count
+
+    def merge(self, other: CallStatistics):
+        if not other.count:
+            return
+        if not self.count or other.min < self.min:
+            self.min = other.min
+        if other.max > self.max:
+            self.max = other.max
+        self.count += other.count
+        self.total += other.total
+        self.exclusive += other.exclusive
@@ -0,0 +1,355 @@
+from __future__ import annotations
+from array import array
+from typing import Dict, List, Iterable, Iterator, Tuple, Optional
+from hoshingak.core.stats import CallStatistics
+from hoshingak.core.trace import TraceEvent, TraceMetadata, weigh
+
+
+class GraphStore:
+    """
+    Call graph kept in parallel arrays instead of node objects.
+    A node is a row indexed like CallGraph.nodes (by call site)
+    and an edge is a (source row, target row) pair.
+    Adjacency queries use CSR offsets built on demand.
+    """
+
+    def __init__(self, symtab=None):
+        """
+        :param symtab: SymbolTable resolving the function addresses.
+                    Only needed by the node views.
+        """
+        self.symtab = symtab
+        # Nodes
+        self.symbols = array('Q')
+        self.call_sites = array('Q')
+        self.orders = array('Q')
+        # Number of enter events, like Symbol.call_count.
+        self.calls = array('Q')
+        # CallStatistics of the completed invocations.
+        self.counts = array('Q')
+        self.totals = array('q')
+        self.exclusives = array('q')
+        self.mins = array('q')
+        self.maxs = array('q')
+        # Edges
+        self.sources = array('I')
+        self.targets = array('I')
+        self.edge_counts = array('Q')
+        # The first node entered by each thread.
+        self.roots: Dict[int, int] = dict()
+        self._nodes: Dict[int, int] = dict()
+        self._edges: Dict[int, int] = dict()
+        # Each frame is [row, start time, weighted inclusive time of
+        # callees], as in CallGraph.stacks.
+        self._stacks: Dict[int, List[list]] = dict()
+        self._weights: Dict[int, List[int]] = dict()
+        # Calls each sampled call stands for in a sampled trace.
+        self.scale = 1
+        # Thread that runs main(), None to take the first thread entered.
+        self.main_thread: Optional[int] = None
+        # The next enter event of the main thread is the main function.
+        self._expect_main = True
+        self._csr = None
+        self._symbol_calls: Optional[Dict[int, int]] = None
+
+    def __len__(self):
+        return len(self.call_sites)
+
+    def __getstate__(self):
+        # Sent between processes without the symbol table.
+        state = self.__dict__.copy()
+        state['symtab'] = None
+        state['_csr'] = None
+        state['_symbol_calls'] = None
+        return state
+
+    @property
+    def edge_size(self):
+        return len(self.sources)
+
+    def index(self, call_site: int) -> int:
+        return self._nodes[call_site]
+
+    def reindex(self):
+        """
+        Rebuilds the lookup tables after the columns were filled directly.
+        """
+        self._nodes = {call_site: row
+                       for row, call_site in enumerate(self.call_sites)}
+        self._edges = {source << 32 | target: edge for edge, (source, target)
+                       in enumerate(zip(self.sources, self.targets))}
+        self._csr = None
+        self._symbol_calls = None
+
+    def add_node(self, address: int, call_site: int) -> int:
+        try:
+            return self._nodes[call_site]
+        except KeyError:
+            pass
+
+        row = self._nodes[call_site] = len(self.call_sites)
+        self.symbols.append(address)
+        self.call_sites.append(call_site)
+        self.orders.append(0)
+        self.calls.append(0)
+        for column in (self.counts, self.totals, self.exclusives,
+                       self.mins, self.maxs):
+            column.append(0)
+        return row
+
+    def add_edge(self, source: int, target: int, count: int = 1) -> int:
+        key = source << 32 | target
+        try:
+            edge = self._edges[key]
+        except KeyError:
+            edge = self._edges[key] = len(self.sources)
+            self.sources.append(source)
+            self.targets.append(target)
+            self.edge_counts.append(0)
+        self.edge_counts[edge] += count
+        return edge
+
+    def add_invocation(self, row: int, inclusive: int, exclusive: int,
+                       count: int = 1):
+        if not self.counts[row] or inclusive < self.mins[row]:
+            self.mins[row] = inclusive
+        if inclusive > self.maxs[row]:
+            self.maxs[row] = inclusive
+        self.counts[row] += count
+        self.totals[row] += inclusive * count
+        self.exclusives[row] += exclusive * count
+
+    def set_metadata(self, metadata: TraceMetadata):
+        """
+        Same as CallGraph.set_metadata().
+        """
+        self.scale = metadata.sample
+        self.main_thread = metadata.pid or None
+
+    def extend(self, events: Iterable[TraceEvent]):
+        """
+        Same as CallGraph.extend(), without creating node objects.
+        """
+        stacks = self._stacks
+        add_node = self.add_node
+        calls = self.calls
+        orders = self.orders
+        order = len(self._nodes) + 1
+        main_thread = self.main_thread
+        self._symbol_calls = None
+        for (addr, call_site, flag, time, thread), weight \
+                in weigh(events, self.scale, self._weights):
+            try:
+                stack = stacks[thread]
+            except KeyError:
+                stack = stacks[thread] = []
+
+            if flag != 'X':
+                if self._expect_main and main_thread in (None, thread):
+                    # To indicate that it is main function, use call_site 0
+                    row = add_node(addr, 0)
+                    self.roots.setdefault(thread, row)
+                    self._expect_main = False
+                elif not stack:
+                    # Entry point of a thread.
+                    row = add_node(addr, call_site)
+                    self.roots.setdefault(thread, row)
+                else:
+                    row = add_node(addr, call_site)
+                    self.add_edge(stack[-1][0], row, weight)
+
+                calls[row] += weight
+                if not orders[row]:
+                    orders[row] = order
+                    order += 1
+                stack.append([row, time, 0])
+
+            elif stack:
+                row, stime, callees = stack.pop(-1)
+                elapsed = time - stime
+                self.add_invocation(row, elapsed,
+                                    max(elapsed - callees // weight, 0),
+                                    weight)
+                if stack:
+                    stack[-1][2] += elapsed * weight
+
+    def close(self):
+        """
+        Drops the calls left open at the end of a trace,
+        so that the next trace starts with empty call stacks.
+        """
+        self._stacks.clear()
+        self._weights.clear()
+        self._expect_main = True
+
+    def merge(self, other: GraphStore):
+        """
+        Adds the nodes and edges of another store, summing counts and times.
+        """
+        self._symbol_calls = None
+        rows = array('I')
+        for row in range(len(other)):
+            target = self.add_node(other.symbols[row], other.call_sites[row])
+            rows.append(target)
+            if not self.orders[target]:
+                self.orders[target] = other.orders[row]
+            self.calls[target] += other.calls[row]
+            count = other.counts[row]
+            if not count:
+                continue
+            if not self.counts[target] or other.mins[row] < self.mins[target]:
+                self.mins[target] = other.mins[row]
+            if other.maxs[row] > self.maxs[target]:
+                self.maxs[target] = other.maxs[row]
+            self.counts[target] += count
+            self.totals[target] += other.totals[row]
+            self.exclusives[target] += other.exclusives[row]
+
+        for source, target, count in zip(other.sources, other.targets,
+                                         other.edge_counts):
+            self.add_edge(rows[source], rows[target], count)
+
+        for thread, row in other.roots.items():
+            self.roots.setdefault(thread, rows[row])
+
+    def statistics(self, row: int) -> CallStatistics:
+        return CallStatistics.from_values(
+            self.counts[row], self.totals[row], self.exclusives[row],
+            self.mins[row], self.maxs[row])
+
+    def compress(self):
+        """
+        Builds the CSR offsets of the outgoing and the incoming edges.
+        """
+        if self._csr is not None and self._csr[0] == self.edge_size:
+            return self._csr
+
+        size = len(self)
+        self._csr = (self.edge_size,
+                     self._csr_index(self.sources, self.targets, size),
+                     self._csr_index(self.targets, self.sources, size))
+        return self._csr
+
+    @staticmethod
+    def _csr_index(keys: array, values: array,
+                   size: int) -> Tuple[array, array]:
+        # Counting sort of the edges by key.
+        offsets = array('Q', bytes(8 * (size + 1)))
+        for key in keys:
+            offsets[key + 1] += 1
+        for row in range(size):
+            offsets[row + 1] += offsets[row]
+
+        cursor = array('Q', offsets)
+        ordered = array('I', bytes(4 * len(values)))
+        for key, value in zip(keys, values):
+            ordered[cursor[key]] = value
+            cursor[key] += 1
+        return offsets, ordered
+
+    def callees(self, row: int) -> array:
+        _, (offsets, targets), _ = self.compress()
+        return targets[offsets[row]:offsets[row + 1]]
+
+    def callers(self, row: int) -> array:
+        _, _, (offsets, sources) = self.compress()
+        return sources[offsets[row]:offsets[row + 1]]
+
+    def symbol_calls(self) -> Dict[int, int]:
+        """
+        Number of calls of each function, summed over its call sites.
+        """
+        if self._symbol_calls is None:
+            calls: Dict[int, int] = dict()
+            for address, count in zip(self.symbols, self.calls):
+                calls[address] = calls.get(address, 0) + count
+            self._symbol_calls = calls
+        return self._symbol_calls
+
+    def node(self, call_site: int) -> GraphNodeView:
+        return GraphNodeView(self, self._nodes[call_site])
+
+    def nodes(self) -> Iterator[GraphNodeView]:
+        for row in range(len(self)):
+            yield GraphNodeView(self, row)
+
+
+class GraphNodeView:
+    """
+    Read-only node of a GraphStore with the interface of CallGraphBaseNode.
+    It holds no data besides its row.
+    """
+    __slots__ = ('store', 'row')
+
+    def __init__(self, store: GraphStore, row: int):
+        self.store = store
+        self.row = row
+
+    def __str__(self):
+        return f'{self.basename}/{self.symbol.name}#{self.call_site}'
+
+    def __eq__(self, other):
+        return (isinstance(other, GraphNodeView)
+                and self.store is other.store and self.row == other.row)
+
+    def __hash__(self):
+        return hash((id(self.store), self.row))
+
+    @property
+    def symbol(self):
+        return self.store.symtab[self.store.symbols[self.row]]
+
+    @property
+    def call_site(self) -> int:
+        return self.store.call_sites[self.row]
+
+    @property
+    def order(self) -> int:
+        return self.store.orders[self.row]
+
+    @property
+    def stats(self) -> CallStatistics:
+        return self.store.statistics(self.row)
+
+    @property
+    def enter_count(self) -> int:
+        return self.store.calls[self.row]
+
+    @property
+    def call_count(self) -> int:
+        return self.store.symbol_calls()[self.store.symbols[self.row]]
+
+    @property
+    def basename(self):
+        return self.symbol.prefix
+
+    @property
+    def name(self):
+        return f'{self.basename}/{self.symbol.name}({self.call_count})' \
+               f'#{self.call_site}'
+
+    @property
+    def is_root(self):
+        return self.call_site == 0
+
+    @property
+    def address(self) -> int:
+        return self.store.symbols[self.row]
+
+    @property
+    def elapsed(self) -> int:
+        return self.store.totals[self.row]
+
+    @property
+    def actual_elapsed(self) -> int:
+        return self.store.exclusives[self.row]
+
+    @property
+    def incoming_nodes(self) -> Dict[int, GraphNodeView]:
+        return {self.store.call_sites[row]: GraphNodeView(self.store, row)
+                for row in self.store.callers(self.row)}
+
+    @property
+    def outgoing_nodes(self) -> Dict[int, GraphNodeView]:
+        return {self.store.call_sites[row]: GraphNodeView(self.store, row)
+                for row in self.store.callees(self.row)}
@@ -1,12 +1,26 @@
-from collections import MutableMapping
+from __future__ import annotations
+from array import array
+from bisect import bisect_right
+from collections.abc import MutableMapping
 from os import PathLike
 from subprocess import check_call
 from typing import Union, List, Dict, Iterable,\
     Tuple, ValuesView, ItemsView, KeysView
+from hoshingak.core.elf import ElfFile
 from hoshingak.core.graph import CallGraph
 
 
+def source_prefix(name: str) -> str:
+    """
+    e.g) './test/example.c:' -> 'test/example'
+    """
+    return name.rstrip('.c:').lstrip('./')
+
+
 class Symbol:
+    __slots__ = ('address', 'scope', 'kind', 'section', 'offset', 'prefix',
+                 'name', 'call_count')
+
     def __init__(self, prefix: str, tokens: List[str]):
         """
         :param prefix: is a name of .c file that hold the given function.
@@ -21,6 +35,23 @@ class Symbol:
         self.name = tokens[5]
         self.call_count = 0
 
+    @classmethod
+    def from_values(cls, prefix: str, address: int, scope: str, kind: str,
+                    section: str, offset: int, name: str) -> Symbol:
+        """
+        Creates a symbol from decoded values instead of objdump tokens.
+        """
+        symbol = cls.__new__(cls)
+        symbol.address = address
+        symbol.scope = scope
+        symbol.kind = kind
+        symbol.section = section
+        symbol.offset = offset
+        symbol.prefix = prefix
+        symbol.name = name
+        symbol.call_count = 0
+        return symbol
+
     def __repr__(self):
         return f'{self.prefix}/{self.name}'
 
@@ -34,6 +65,51 @@ class Symbol:
             return False
 
 
+class IntervalIndex:
+    """
+    Sorted array of non-overlapping [start, end) ranges.
+    An address is resolved with a binary search on the start addresses.
+    """
+
+    def __init__(self, intervals: Iterable[Tuple[int, int, object]]):
+        """
+        :param intervals: (start, end, value) of each range.
+        """
+        intervals = sorted(intervals, key=lambda interval: interval[0])
+        self.starts = array('Q', (start for start, _, _ in intervals))
+        self.ends = array('Q', (end for _, end, _ in intervals))
+        self.values = [value for _, _, value in intervals]
+
+    def __len__(self):
+        return len(self.values)
+
+    def find(self, address: int, default=None):
+        index = bisect_right(self.starts, address) - 1
+        if index >= 0 and address < self.ends[index]:
+            return self.values[index]
+
+        return default
+
+    def find_many(self, addresses, default=None) -> List:
+        """
+        Resolves a whole array of addresses with a single sweep
+        over the ranges in address order.
+        """
+        results = [default] * len(addresses)
+        starts, ends, values = self.starts, self.ends, self.values
+        index = -1
+        last = len(starts) - 1
+        for position in sorted(range(len(addresses)),
+                               key=addresses.__getitem__):
+            address = addresses[position]
+            while index < last and starts[index + 1] <= address:
+                index += 1
+            if index >= 0 and address < ends[index]:
+                results[position] = values[index]
+
+        return results
+
+
 class SymbolTable(MutableMapping):
     OBJDUMP_SYMBOLS = '/tmp/symbols.objdump'
     OBJDUMP_DECODED = '/tmp/debug_line.objdump'
@@ -43,6 +119,9 @@ class SymbolTable(MutableMapping):
         self.prefixes: Dict[str, (int, int)] = dict()
         self._name_table: Dict[int, Symbol] = dict()
         self.graph = None
+        # Built on demand and dropped whenever the table changes.
+        self._symbol_index: Union[IntervalIndex, None] = None
+        self._prefix_index: Union[IntervalIndex, None] = None
 
         if decoded_file:
             self.read_decoded_line(decoded_file)
@@ -60,9 +139,11 @@ class SymbolTable(MutableMapping):
 
     def __setitem__(self, k: int, v: Symbol) -> None:
         self._name_table[k] = v
+        self._symbol_index = None
 
     def __delitem__(self, k: int) -> None:
         del self._name_table[k]
+        self._symbol_index = None
 
     def __contains__(self, item) -> bool:
         return item in self._name_table
@@ -88,21 +169,86 @@ class SymbolTable(MutableMapping):
     def update(self, item: Dict[int, Symbol],
                **kwargs: Dict[int, Symbol]) -> None:
         self._name_table.update(item, **kwargs)
+        self._symbol_index = None
 
     def pop(self, address: int) -> Symbol:
+        self._symbol_index = None
         return self._name_table.pop(address)
 
     def popitem(self) -> Tuple[int, Symbol]:
+        self._symbol_index = None
         return self._name_table.popitem()
 
     def clear(self) -> None:
         self._name_table.clear()
+        self._symbol_index = None
+
+    def create_graph(self, finstrument_file, progress=None) -> CallGraph:
+        self.graph = CallGraph(self)
+        self.graph.create(finstrument_file, progress=progress)
+        return self.graph
 
-    def create_graph(self, finstrument_file) -> CallGraph:
+    def create_batch_graph(self, finstrument_files, processes=None,
+                           progress=None) -> CallGraph:
         self.graph = CallGraph(self)
-        self.graph.create(finstrument_file)
+        self.graph.create_batch(finstrument_files, processes=processes,
+                                progress=progress)
         return self.graph
 
+    @classmethod
+    def load(cls, obj, loader='objdump', cache=None) -> SymbolTable:
+        """
+        :param obj: executable object compiled with debugging information.
+        :param loader: 'objdump' parses the output of objdump,
+                    'elf' reads the ELF file directly.
+        :param cache: SymbolCache to look up before loading
+                    and to store the loaded table in.
+        """
+        if cache is not None:
+            # Hashes the whole executable when it has no build-id.
+            key = cache.key(obj)
+            table = cache.get(key)
+            if table is not None:
+                return table
+
+        if loader == 'elf':
+            table = cls.from_elf(obj)
+
+        elif loader == 'objdump':
+            cls.dump(obj)
+            table = cls()
+
+        else:
+            raise ValueError(f'Unknown loader: {loader}')
+
+        if cache is not None:
+            cache.put(key, table)
+        return table
+
+    @classmethod
+    def from_elf(cls, obj: Union[str, bytes, PathLike]) -> SymbolTable:
+        """
+        Reads .symtab and the CU ranges of .debug_line in memory,
+        without objdump and temporary files.
+        """
+        table = cls(symbol_file=None, decoded_file=None)
+        with ElfFile(obj) as elf:
+            for name, start_addr, end_addr in elf.compilation_units():
+                table.prefixes[source_prefix(name)] = (start_addr, end_addr)
+
+            functions = list(elf.functions())
+
+        prefixes = table.find_prefixes(
+            [symbol.address for symbol in functions])
+        for prefix, symbol in zip(prefixes, functions):
+            scope = 'static' if symbol.bind == ElfFile.STB_LOCAL \
+                else 'global'
+            table._name_table[symbol.address] = Symbol.from_values(
+                prefix, symbol.address, scope, 'F', symbol.section,
+                symbol.size, symbol.name)
+
+        return table
+
     @classmethod
     def dump(cls, obj):
         cmd = ['objdump', '-t', f'{obj}']
@@ -125,17 +271,21 @@ class SymbolTable(MutableMapping):
                     continue
 
                 # e.g) CU: test/example.c:
-                if tokens[0].startswith('CU'):
+                # Recent binutils omit 'CU:' e.g) example.c:
+                if tokens[0].startswith('CU') or (
+                        len(tokens) == 1 and tokens[0].endswith(':')):
                     # Skip the first entrance.
                     if index >= 3:
                         end_addr = int(token_list[index - 3][2], 16)
                         self.prefixes[source_code_name] = (start_addr, end_addr)
-                    source_code_name = tokens[1].rstrip('.c:').lstrip('./')
+                    source_code_name = source_prefix(tokens[-1])
                     start_addr = int(token_list[index + 2][2], 16)
             else:
                 end_addr = int(token_list[index - 2][2], 16)
                 self.prefixes[source_code_name] = (start_addr, end_addr)
 
+        self._prefix_index = None
+
     def read_symbol_table(self, file: Union[str, int, bytes, PathLike]):
         assert len(self.prefixes) != 0,\
             f'self.prefixes is not initialized.\nYou must call ' \
@@ -155,23 +305,65 @@ class SymbolTable(MutableMapping):
                     symbol = Symbol(self.find_prefix(address), tokens)
                     self[address] = symbol
 
+    @property
+    def symbol_index(self) -> IntervalIndex:
+        if self._symbol_index is None:
+            self._symbol_index = IntervalIndex(
+                (symbol.address, symbol.address + symbol.offset, symbol)
+                for symbol in self.values())
+        return self._symbol_index
+
+    @property
+    def prefix_index(self) -> IntervalIndex:
+        if (self._prefix_index is None
+                or len(self._prefix_index) != len(self.prefixes)):
+            self._prefix_index = IntervalIndex(
+                (start_addr, end_addr, prefix)
+                for prefix, (start_addr, end_addr) in self.prefixes.items())
+        return self._prefix_index
+
     def find_prefix(self, address: int) -> str:
-        for prefix, (start_addr, end_addr) in self.prefixes.items():
-            if start_addr <= address < end_addr:
-                return prefix
+        return self.prefix_index.find(address, 'Unknown')
+
+    def find_prefixes(self, addresses) -> List[str]:
+        return self.prefix_index.find_many(addresses, 'Unknown')
+
+    def find_caller(self, call_site: int) -> Union[Symbol, None]:
+        """
+        :param call_site: return address of a call.
+        :return: the function containing call_site.
+        """
+        # A return address may equal the end of the caller when the call is
+        # its last instruction, so look up the byte before it.
+        return self.symbol_index.find(call_site - 1)
 
-        return 'Unknown'
+    def find_callers(self, call_sites) -> List[Union[Symbol, None]]:
+        """
+        :param call_sites: sequence of addresses, e.g. a list or an array.
+        :return: the function containing each call site, in the same order.
+        """
+        return self.symbol_index.find_many(
+            [call_site - 1 for call_site in call_sites])
 
-    def find_caller(self, call_site):
+    def uncalled(self) -> Dict[str, List[Symbol]]:
         """
-        :param call_site:
-        :return:
+        :return: the symbols never called, grouped by CU prefix.
         """
+        symbols: Dict[str, List[Symbol]] = dict()
         for symbol in self.values():
-            if symbol.is_caller(call_site):
-                return symbol
+            if symbol.call_count == 0:
+                symbols.setdefault(symbol.prefix, []).append(symbol)
+        return symbols
 
-        return None
+    def address_ranges(self, prefixes: Iterable[str]) -> str:
+        """
+        Address ranges of compilation units, in the format of
+        HOSHINGAK_INCLUDE and HOSHINGAK_EXCLUDE of the injection library.
+        e.g) table.address_ranges(['foo', 'bar']) -> '0x1189-0x1225,...'
+        """
+        return ','.join(f'{hex(start_addr)}-{hex(end_addr)}'
+                        for start_addr, end_addr
+                        in (self.prefixes[prefix] for prefix in prefixes))
 
     def pretty_print(self):
         for k, v in self.items():
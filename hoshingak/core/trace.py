@@ -0,0 +1,556 @@
+import gzip
+import lzma
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from os import PathLike
+from typing import Union, Iterator, NamedTuple, Optional, TextIO, List, \
+    Dict, Iterable, Tuple
+
+
+class TraceEvent(NamedTuple):
+    """
+    A single record of the call trace.
+    """
+    address: int
+    call_site: int
+    # 'E' on enter, 'X' on exit, and 'S' on the enter of a sampled call,
+    # which stands for 'sample' calls together with its callees.
+    flag: str
+    time: int
+    thread: int = 0
+
+
+# Flag of each raw record. Anything else is an exit.
+ENTER_FLAGS = {b'E': 'E', b'S': 'S'}
+
+
+class TraceMetadata(NamedTuple):
+    """
+    Record-time filters of the injection library.
+    See read_filters() in data/injection/injection.c.
+    """
+    # 1 in 'sample' calls of each function was recorded, with flag 'S'.
+    sample: int = 1
+    # Calls deeper than max_depth were not recorded. 0 is unlimited.
+    max_depth: int = 0
+    # Some address ranges were not recorded.
+    filtered: bool = False
+    # Process of the trace, 0 if unknown. See FINSTRUMENT_PROCESS.
+    pid: int = 0
+    ppid: int = 0
+    # Time of the fork and thread of the parent that called fork(),
+    # 0 if the process was not forked from a traced process.
+    fork_time: int = 0
+    fork_thread: int = 0
+
+    @classmethod
+    def parse(cls, line: bytes) -> 'TraceMetadata':
+        """
+        e.g) b'# hoshingak sample=4 max_depth=0 filtered=1'
+             b'# hoshingak sample=1 max_depth=0 filtered=0 pid=12 ppid=11
+               fork_time=1234 fork_thread=11'
+        """
+        values = dict(token.split(b'=', 1)
+                      for token in line.split() if b'=' in token)
+        return cls(sample=max(int(values.get(b'sample', 1)), 1),
+                   max_depth=int(values.get(b'max_depth', 0)),
+                   filtered=values.get(b'filtered', b'0') != b'0',
+                   pid=int(values.get(b'pid', 0)),
+                   ppid=int(values.get(b'ppid', 0)),
+                   fork_time=int(values.get(b'fork_time', 0)),
+                   fork_thread=int(values.get(b'fork_thread', 0)))
+
+
+def weigh(events: Iterable[TraceEvent], sample: int,
+          stacks: Dict[int, List[int]]
+          ) -> Iterator[Tuple[TraceEvent, int]]:
+    """
+    Pairs each event with the number of calls it stands for: 'sample' for
+    a sampled call and its callees, 1 otherwise. An exit has the weight of
+    its enter, 0 if it has none.
+    :param sample: sampling rate of the trace.
+    :param stacks: weights of the open calls of each thread, kept between
+                calls like the call stacks of the graphs.
+    """
+    for event in events:
+        try:
+            stack = stacks[event[4]]
+        except KeyError:
+            stack = stacks[event[4]] = []
+        flag = event[2]
+        if flag == 'X':
+            yield event, stack.pop() if stack else 0
+        else:
+            weight = sample if flag == 'S' else stack[-1] if stack else 1
+            stack.append(weight)
+            yield event, weight
+
+
+class Progress:
+    """
+    Reports how fast a trace is being consumed.
+    """
+
+    def __init__(self, interval: float = 1.0, file: TextIO = sys.stderr):
+        """
+        :param interval: minimum number of seconds between two reports.
+        :param file: stream the reports are written to.
+        """
+        self.interval = interval
+        self.file = file
+        self.nbytes = 0
+        self.nevents = 0
+        self._start = time.perf_counter()
+        self._last = self._start
+
+    def update(self, nbytes: int, nevents: int):
+        self.nbytes += nbytes
+        self.nevents += nevents
+        now = time.perf_counter()
+        if now - self._last >= self.interval:
+            self._last = now
+            self.report(now)
+
+    def finish(self):
+        self.report(time.perf_counter())
+
+    def report(self, now: float):
+        elapsed = (now - self._start) or 1e-9
+        print(f'{self.nbytes} bytes, {self.nevents} events '
+              f'({self.nbytes / elapsed / (1 << 20):.2f} MiB/s, '
+              f'{self.nevents / elapsed:.0f} events/s)', file=self.file)
+
+
+class TextTraceReader:
+    """
+    Streams the 'addr call_site flag time thread' records written by the injection
+    library without loading the whole file in memory.
+    """
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, file: Union[str, bytes, PathLike],
+                 chunk_size: int = CHUNK_SIZE,
+                 progress: Optional[Progress] = None):
+        """
+        :param file: trace generated by GCC -finstrument-functions
+                    with injection code.
+        :param chunk_size: number of bytes read at once.
+        :param progress: receives the number of bytes and events consumed.
+        """
+        self.file = file
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.metadata = self.read_metadata()
+
+    def read_metadata(self) -> TraceMetadata:
+        # Written on the first line when filters are enabled.
+        with open_stream(self.file) as fp:
+            line = fp.readline()
+        if line.startswith(b'#'):
+            return TraceMetadata.parse(line)
+
+        return TraceMetadata()
+
+    def __iter__(self) -> Iterator[TraceEvent]:
+        with open_stream(self.file) as fp:
+            remainder = b''
+            # The metadata line is not an event.
+            header = True
+            while True:
+                chunk = fp.read(self.chunk_size)
+                if not chunk:
+                    break
+
+                lines = (remainder + chunk).split(b'\n')
+                # The last line may not be complete yet.
+                remainder = lines.pop()
+                yield from self.parse(lines)
+                if self.progress:
+                    skipped = header and bool(lines) \
+                        and lines[0].startswith(b'#')
+                    self.progress.update(len(chunk), len(lines) - skipped)
+                header = header and not lines
+
+            if remainder.strip():
+                yield from self.parse([remainder])
+                if self.progress and not remainder.startswith(b'#'):
+                    self.progress.update(0, 1)
+
+        if self.progress:
+            self.progress.finish()
+
+    @staticmethod
+    def parse(lines) -> Iterator[TraceEvent]:
+        for line in lines:
+            if line.startswith(b'#'):
+                continue
+
+            tokens = line.split()
+            # Traces written before thread ids were recorded have 4 fields.
+            if len(tokens) == 5:
+                addr, call_site, flag, time, thread = tokens
+            elif len(tokens) == 4:
+                addr, call_site, flag, time = tokens
+                thread = 0
+            else:
+                continue
+
+            yield TraceEvent(parse_address(addr), parse_address(call_site),
+                             ENTER_FLAGS.get(flag, 'X'), int(time),
+                             int(thread))
+
+
+class BinaryTraceReader:
+    """
+    Decodes the fixed-width records written with HOSHINGAK_FORMAT=binary.
+    See data/injection/injection.h for the layout.
+    """
+    MAGIC = b'HSGK'
+    HEADER = struct.Struct('<4sHHIHH')
+    RECORDS = {
+        1: struct.Struct('<QQqc7x'),
+        2: struct.Struct('<QQqc3xI'),
+    }
+    CHUNK_RECORDS = 1 << 15
+    # Header flags
+    MONOTONIC = 0x1
+    SAMPLED = 0x2
+    FILTERED = 0x4
+    DEPTH_LIMITED = 0x8
+    COMPRESSED = 0x10
+    PROCESS = 0x20
+    # Size of the compressed data and of the records of a frame.
+    FRAME = struct.Struct('<II')
+
+    def __init__(self, file: Union[str, bytes, PathLike],
+                 progress: Optional[Progress] = None,
+                 header: Optional[bytes] = None):
+        """
+        :param file: trace generated by GCC -finstrument-functions
+                    with injection code.
+        :param progress: receives the number of bytes and events consumed.
+        :param header: header already read from the file, followed by
+                    the process record if the header has PROCESS.
+        """
+        self.file = file
+        self.progress = progress
+        if header is None:
+            with open_stream(self.file) as fp:
+                header = fp.read(self.HEADER.size + max(
+                    record.size for record in self.RECORDS.values()))
+        self.version, self.flags, self.record, self.metadata = \
+            self.read_header(header)
+        # Offset of the first record or frame.
+        self.start = self.HEADER.size
+        if self.flags & self.PROCESS:
+            self.start += self.record.size
+
+    @classmethod
+    def header_size(cls, data: bytes) -> int:
+        """
+        :param data: beginning of a binary trace, at least HEADER.size bytes.
+        :return: size of the header and of the process record, if any.
+        """
+        _, _, record_size, flags, _, _ = cls.HEADER.unpack_from(data)
+        return cls.HEADER.size + (record_size if flags & cls.PROCESS else 0)
+
+    def read_header(self, header: bytes):
+        if len(header) < self.HEADER.size:
+            raise ValueError(f'{self.file} is too short to be a trace.')
+
+        magic, version, record_size, flags, sample, max_depth = \
+            self.HEADER.unpack_from(header)
+        if magic != self.MAGIC:
+            raise ValueError(f'{self.file} is not a binary trace.')
+
+        try:
+            record = self.RECORDS[version]
+        except KeyError:
+            raise ValueError(f'{self.file}: unsupported version {version}.')
+
+        if record.size != record_size:
+            raise ValueError(f'{self.file}: record size {record_size} does '
+                             f'not match version {version}.')
+
+        metadata = TraceMetadata(
+            sample=sample if flags & self.SAMPLED and sample > 1 else 1,
+            max_depth=max_depth if flags & self.DEPTH_LIMITED else 0,
+            filtered=bool(flags & self.FILTERED))
+        if flags & self.PROCESS:
+            if len(header) < self.HEADER.size + record.size:
+                raise ValueError(f'{self.file} is too short to be a trace.')
+            # The process record of version 1 has no thread.
+            pid, ppid, fork_time, _, *thread = \
+                record.unpack_from(header, self.HEADER.size)
+            metadata = metadata._replace(
+                pid=pid, ppid=ppid, fork_time=fork_time,
+                fork_thread=thread[0] if thread else 0)
+        return version, flags, record, metadata
+
+    def __iter__(self) -> Iterator[TraceEvent]:
+        for chunk in self.chunks():
+            yield from self.decode(chunk)
+            if self.progress:
+                self.progress.update(
+                    len(chunk), len(chunk) // self.record.size)
+
+        if self.progress:
+            self.progress.finish()
+
+    def chunks(self) -> Iterator[bytes]:
+        """
+        Yields the records a chunk at a time, never the whole file.
+        A record truncated by a crashed program is dropped.
+        """
+        if self.flags & self.COMPRESSED:
+            yield from self.frames()
+            return
+
+        step = self.CHUNK_RECORDS * self.record.size
+        if is_compressed(self.file):
+            with open_stream(self.file) as fp:
+                fp.read(self.start)
+                while True:
+                    chunk = fp.read(step)
+                    chunk = chunk[:len(chunk) - len(chunk) % self.record.size]
+                    if not chunk:
+                        break
+                    yield chunk
+            return
+
+        with open(self.file, 'rb') as fp, \
+                mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = self.start
+            stop = start + (len(mm) - start) \
+                // self.record.size * self.record.size
+            for offset in range(start, stop, step):
+                yield mm[offset:min(offset + step, stop)]
+
+    def frames(self) -> Iterator[bytes]:
+        """
+        Inflates the zlib frames written with HOSHINGAK_COMPRESS one by one.
+        """
+        with open_stream(self.file) as fp:
+            fp.read(self.start)
+            while True:
+                frame = fp.read(self.FRAME.size)
+                if len(frame) < self.FRAME.size:
+                    break
+                size, raw_size = self.FRAME.unpack(frame)
+                data = fp.read(size)
+                if len(data) < size:
+                    # Truncated by a crashed program.
+                    break
+                chunk = zlib.decompress(data, bufsize=raw_size)
+                yield chunk[:len(chunk) - len(chunk) % self.record.size]
+
+    def decode(self, chunk: bytes) -> Iterator[TraceEvent]:
+        if self.version == 1:
+            for address, call_site, time, flag \
+                    in self.record.iter_unpack(chunk):
+                yield TraceEvent(address, call_site,
+                                 ENTER_FLAGS.get(flag, 'X'), time)
+            return
+
+        for address, call_site, time, flag, thread \
+                in self.record.iter_unpack(chunk):
+            yield TraceEvent(address, call_site,
+                             ENTER_FLAGS.get(flag, 'X'), time, thread)
+
+
+class TraceFollower:
+    """
+    Reads a trace while the program is still writing it, like 'tail -f'.
+    Only the records appended since the last poll are held in memory.
+    """
+    INTERVAL = 0.5
+
+    def __init__(self, file: Union[str, bytes, PathLike],
+                 interval: float = INTERVAL,
+                 chunk_size: int = TextTraceReader.CHUNK_SIZE,
+                 progress: Optional[Progress] = None):
+        """
+        :param file: trace that may not exist yet.
+        :param interval: number of seconds to wait when no record is new.
+        :param chunk_size: maximum number of bytes read at once.
+        :param progress: receives the number of bytes and events consumed.
+        """
+        self.file = file
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.running = True
+        self.metadata = TraceMetadata()
+        # Incremented when the trace is replaced by a new run. The events
+        # of the new run start with empty call stacks.
+        self.restarts = 0
+
+    def stop(self):
+        self.running = False
+
+    def __iter__(self) -> Iterator[TraceEvent]:
+        for events in self.batches():
+            yield from events
+
+    def batches(self) -> Iterator[List[TraceEvent]]:
+        """
+        Yields the events appended since the previous batch.
+        An empty batch means that nothing was appended during the interval.
+        """
+        while self.running:
+            try:
+                fp = open(self.file, 'rb')
+            except FileNotFoundError:
+                time.sleep(self.interval)
+                yield []
+                continue
+
+            with fp:
+                if (yield from self._follow(fp)):
+                    self.restarts += 1
+
+    def _replaced(self, fp, prefix: bytes) -> bool:
+        """
+        :param prefix: first bytes read from fp, which hold the pid of the
+                    process when the trace has metadata.
+        :return: True if the program was restarted since fp was opened.
+        """
+        try:
+            stat = os.stat(self.file)
+        except FileNotFoundError:
+            return True
+        return stat.st_size < fp.tell() \
+            or stat.st_ino != os.fstat(fp.fileno()).st_ino \
+            or os.pread(fp.fileno(), len(prefix), 0) != prefix
+
+    def _follow(self, fp) -> Iterator[List[TraceEvent]]:
+        """
+        :return: True if the trace was replaced by a new run.
+        """
+        decode = None
+        size = 0
+        framed = False
+        remainder = b''
+        prefix = b''
+        while self.running:
+            # Checked before reading, not to take the records of a new
+            # run written over the trace for the rest of the old one.
+            if self._replaced(fp, prefix):
+                # The program was restarted; read the new trace.
+                return True
+            chunk = fp.read(self.chunk_size)
+            if not chunk:
+                time.sleep(self.interval)
+                yield []
+                continue
+
+            data = remainder + chunk
+            if decode is None:
+                if len(data) < len(XZ_MAGIC):
+                    remainder = data
+                    continue
+                if data.startswith(GZIP_MAGIC) or data.startswith(XZ_MAGIC):
+                    raise ValueError(f'{self.file}: gzip and xz traces '
+                                     f'cannot be followed.')
+                if data.startswith(BinaryTraceReader.MAGIC):
+                    if len(data) < BinaryTraceReader.HEADER.size or \
+                            len(data) < BinaryTraceReader.header_size(data):
+                        remainder = data
+                        continue
+                    start = BinaryTraceReader.header_size(data)
+                    prefix = data[:start]
+                    reader = BinaryTraceReader(self.file, header=prefix)
+                    data = data[start:]
+                    size = reader.record.size
+                    decode = reader.decode
+                    framed = bool(reader.flags & reader.COMPRESSED)
+                    self.metadata = reader.metadata
+                else:
+                    if data.startswith(b'#'):
+                        if b'\n' not in data:
+                            remainder = data
+                            continue
+                        prefix = data[:data.index(b'\n')]
+                        self.metadata = TraceMetadata.parse(prefix)
+                    decode = TextTraceReader.parse
+
+            if framed:
+                # Keep a frame that is not fully written yet.
+                events = []
+                frame = BinaryTraceReader.FRAME
+                offset = 0
+                while len(data) - offset >= frame.size:
+                    length, _ = frame.unpack_from(data, offset)
+                    if len(data) - offset - frame.size < length:
+                        break
+                    offset += frame.size
+                    records = zlib.decompress(data[offset:offset + length])
+                    events.extend(decode(records))
+                    offset += length
+                remainder = data[offset:]
+            elif size:
+                # Keep a record that is not fully written yet.
+                end = len(data) - len(data) % size
+                remainder = data[end:]
+                events = list(decode(data[:end]))
+            else:
+                lines = data.split(b'\n')
+                remainder = lines.pop()
+                events = list(decode(lines))
+
+            if self.progress:
+                self.progress.update(len(chunk), len(events))
+            yield events
+
+
+GZIP_MAGIC = b'\x1f\x8b'
+XZ_MAGIC = b'\xfd7zXZ\x00'
+
+
+def is_compressed(file: Union[str, bytes, PathLike]) -> bool:
+    with open(file, 'rb') as fp:
+        magic = fp.read(len(XZ_MAGIC))
+    return magic.startswith(GZIP_MAGIC) or magic.startswith(XZ_MAGIC)
+
+
+def open_stream(file: Union[str, bytes, PathLike]):
+    """
+    Opens a trace for reading in binary mode.
+    Files compressed with gzip or xz are inflated while being read.
+    """
+    with open(file, 'rb') as fp:
+        magic = fp.read(len(XZ_MAGIC))
+
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.open(file, 'rb')
+
+    if magic.startswith(XZ_MAGIC):
+        return lzma.open(file, 'rb')
+
+    return open(file, 'rb')
+
+
+def open_trace(file: Union[str, bytes, PathLike], **kwargs):
+    """
+    Returns a reader matching the format of the given trace,
+    which may be compressed with gzip or xz.
+    """
+    with open_stream(file) as fp:
+        magic = fp.read(len(BinaryTraceReader.MAGIC))
+
+    if magic == BinaryTraceReader.MAGIC:
+        return BinaryTraceReader(file, **kwargs)
+
+    return TextTraceReader(file, **kwargs)
+
+
+def parse_address(token: bytes) -> int:
+    # printf("%p") writes a null pointer as '(nil)'.
+    try:
+        return int(token, 16)
+    except ValueError:
+        return 0
@@ -0,0 +1,301 @@
+"""
+Call graph analysis with array operations instead of a loop over events.
+Requires NumPy.
+"""
+import os
+from array import array
+from os import PathLike
+from typing import Union, Optional, Dict, NamedTuple
+from hoshingak.core.store import GraphStore
+from hoshingak.core.trace import BinaryTraceReader, TextTraceReader, \
+    Progress, open_trace, is_compressed
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class CallTable(NamedTuple):
+    """
+    Every completed call of a trace, one row per matched enter/exit pair.
+    Indices refer to the event columns.
+    """
+    enter: 'np.ndarray'
+    exit: 'np.ndarray'
+    # Nesting depth of the call, 0 for the entry point of a thread.
+    depth: 'np.ndarray'
+    inclusive: 'np.ndarray'
+    exclusive: 'np.ndarray'
+    # Number of calls the call stands for in a sampled trace.
+    weight: 'np.ndarray'
+
+
+def require_numpy():
+    if np is None:
+        raise ImportError('The vectorized engine requires numpy.')
+
+
+def binary_dtype(version: int):
+    fields = [('address', '<u8'), ('call_site', '<u8'), ('time', '<i8'),
+              ('flag', 'S1')]
+    if version == 1:
+        fields.append(('padding', 'V7'))
+    else:
+        fields += [('padding', 'V3'), ('thread', '<u4')]
+    return np.dtype(fields)
+
+
+def load_columns(file: Union[str, bytes, PathLike],
+                 progress: Optional[Progress] = None
+                 ) -> Dict[str, 'np.ndarray']:
+    """
+    Reads a trace into one array per field:
+    address, call_site, time, thread, enter (True on enter events) and
+    sampled (True on the enter events of sampled calls).
+    'sample' is the sampling rate of the trace and 'pid' its process,
+    0 if unknown.
+    """
+    require_numpy()
+    reader = open_trace(file)
+    sample = reader.metadata.sample
+    pid = reader.metadata.pid
+    if isinstance(reader, BinaryTraceReader):
+        # Binary records map onto a structured dtype without parsing.
+        dtype = binary_dtype(reader.version)
+        if reader.flags & reader.COMPRESSED or is_compressed(file):
+            records = np.concatenate(
+                [np.frombuffer(chunk, dtype=dtype)
+                 for chunk in reader.chunks()] or [np.zeros(0, dtype)])
+            count = len(records)
+        else:
+            count = (os.path.getsize(file) - reader.start) \
+                // reader.record.size
+            records = np.fromfile(file, dtype=dtype, count=count,
+                                  offset=reader.start)
+        columns = {
+            'address': records['address'],
+            'call_site': records['call_site'],
+            'time': records['time'],
+            'thread': records['thread'] if reader.version > 1
+            else np.zeros(count, dtype=np.uint32),
+            'enter': records['flag'] != b'X',
+            'sampled': records['flag'] == b'S',
+            'sample': sample,
+            'pid': pid,
+        }
+        if progress:
+            progress.update(os.path.getsize(file), count)
+            progress.finish()
+        return columns
+
+    address, call_site, time, thread = (
+        array('Q'), array('Q'), array('q'), array('I'))
+    enter = bytearray()
+    sampled = bytearray()
+    for event in TextTraceReader(file, progress=progress):
+        address.append(event.address)
+        call_site.append(event.call_site)
+        time.append(event.time)
+        thread.append(event.thread)
+        enter.append(event.flag != 'X')
+        sampled.append(event.flag == 'S')
+
+    return {
+        'address': np.frombuffer(address, dtype=np.uint64),
+        'call_site': np.frombuffer(call_site, dtype=np.uint64),
+        'time': np.frombuffer(time, dtype=np.int64),
+        'thread': np.frombuffer(thread, dtype=np.uint32),
+        'enter': np.frombuffer(enter, dtype=np.bool_),
+        'sampled': np.frombuffer(sampled, dtype=np.bool_),
+        'sample': sample,
+        'pid': pid,
+    }
+
+
+def match_calls(columns: Dict[str, 'np.ndarray']):
+    """
+    Pairs each enter event with its exit event, thread by thread.
+    Exits without a matching enter are ignored, like CallGraph.extend().
+    :return: the CallTable, the index of the caller's enter event of
+                every event (-1 for the entry point of a thread and exits)
+                and the weight of every event.
+    """
+    require_numpy()
+    enter = columns['enter']
+    size = len(enter)
+    parents = np.full(size, -1, dtype=np.int64)
+    tables = []
+
+    threads = columns['thread']
+    for thread in np.unique(threads):
+        # Indices of the events of this thread, in trace order.
+        index = np.flatnonzero(threads == thread)
+        is_enter = enter[index]
+        step = np.where(is_enter, 1, -1)
+        depth = np.cumsum(step)
+        # An exit is unbalanced when it goes below every previous depth.
+        floor = np.minimum(np.minimum.accumulate(depth), 0)
+        floor = np.concatenate(([0], floor[:-1]))
+        valid = is_enter | (depth >= floor)
+
+        index = index[valid]
+        is_enter = is_enter[valid]
+        # Depth before an enter and after an exit: the level of the frame.
+        level = np.cumsum(step[valid]) - is_enter
+        count = len(index)
+        if not count:
+            continue
+
+        # Within a level, enters and exits alternate, so a call is an
+        # enter directly followed by an exit once sorted by level.
+        order = np.lexsort((np.arange(count), level))
+        paired = is_enter[order[:-1]] & ~is_enter[order[1:]] \
+            & (level[order[:-1]] == level[order[1:]])
+        enters = order[:-1][paired]
+        exits = order[1:][paired]
+
+        # The caller is the last enter one level up.
+        positions = np.flatnonzero(is_enter)
+        keys = np.sort(level[positions] * count + positions)
+        nested = positions[level[positions] > 0]
+        callers = keys[np.searchsorted(
+            keys, (level[nested] - 1) * count + nested) - 1] % count
+        parents[index[nested]] = index[callers]
+
+        tables.append((index[enters], index[exits], level[enters]))
+
+    if tables:
+        enters, exits, depth = (np.concatenate(column)
+                                for column in zip(*tables))
+    else:
+        enters = exits = depth = np.zeros(0, dtype=np.int64)
+
+    weights = sampled_weights(columns, parents)
+    times = columns['time']
+    inclusive = times[exits] - times[enters]
+    # Exclusive time: inclusive time minus that of the completed callees,
+    # which a sampled callee stands for 'sample' times.
+    calls = np.full(size, -1, dtype=np.int64)
+    calls[enters] = np.arange(len(enters))
+    callers = calls[parents[enters]]
+    callers[parents[enters] < 0] = -1
+    exclusive = inclusive.copy()
+    nested = callers >= 0
+    np.subtract.at(exclusive, callers[nested],
+                   inclusive[nested] * weights[enters[nested]]
+                   // weights[enters[callers[nested]]])
+    # Sampled callees are slower than the calls they stand for.
+    np.maximum(exclusive, 0, out=exclusive)
+
+    return CallTable(enters, exits, depth, inclusive, exclusive,
+                     weights[enters]), parents, weights
+
+
+def sampled_weights(columns: Dict[str, 'np.ndarray'],
+                    parents: 'np.ndarray') -> 'np.ndarray':
+    """
+    :return: the number of calls each event stands for: 'sample' for a
+                sampled call and its callees, 1 otherwise.
+    """
+    sampled = columns.get('sampled')
+    if sampled is None or not sampled.any():
+        return np.ones(len(parents), dtype=np.int64)
+
+    # Doubling over the ancestors: after k steps, each event knows
+    # whether one of its 2^k - 1 nearest callers was sampled.
+    sampled = sampled.copy()
+    ancestors = parents.copy()
+    nested = ancestors >= 0
+    while nested.any():
+        sampled[nested] |= sampled[ancestors[nested]]
+        ancestors[nested] = ancestors[ancestors[nested]]
+        nested = ancestors >= 0
+    return np.where(sampled, columns.get('sample', 1), 1).astype(np.int64)
+
+
+def first_seen(keys: 'np.ndarray'):
+    """
+    :return: the distinct keys in order of first appearance,
+                and the rank of each key in that order.
+    """
+    unique, first, inverse = np.unique(keys, return_index=True,
+                                       return_inverse=True)
+    order = np.argsort(first, kind='stable')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return unique[order], first[order], rank[inverse.reshape(-1)]
+
+
+def create_store(columns: Dict[str, 'np.ndarray'],
+                 symtab=None) -> GraphStore:
+    """
+    Same graph as GraphStore.extend() over the whole trace:
+    a node per call site with the call counts and CallStatistics
+    of its calls, and an edge per caller and callee pair.
+    """
+    require_numpy()
+    calls, parents, weights = match_calls(columns)
+    store = GraphStore(symtab)
+    enters = np.flatnonzero(columns['enter'])
+    if not len(enters):
+        return store
+
+    # The first node of the main thread must be main function in C,
+    # with call_site 0. The main thread has the id of the process.
+    keys = columns['call_site'][enters].copy()
+    threads = columns['thread'][enters]
+    pid = columns.get('pid', 0)
+    main = np.flatnonzero(threads == pid)[:1] if pid else 0
+    keys[main] = 0
+    call_sites, first, rows = first_seen(keys)
+    size = len(call_sites)
+    node_of = np.full(len(parents), -1, dtype=np.int64)
+    node_of[enters] = rows
+
+    nodes = node_of[calls.enter]
+    # A sampled call and its callees stand for 'sample' calls each.
+    counts = np.zeros(size, dtype=np.int64)
+    np.add.at(counts, nodes, calls.weight)
+    totals = np.zeros(size, dtype=np.int64)
+    np.add.at(totals, nodes, calls.inclusive * calls.weight)
+    exclusives = np.zeros(size, dtype=np.int64)
+    np.add.at(exclusives, nodes, calls.exclusive * calls.weight)
+    mins = np.full(size, np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(mins, nodes, calls.inclusive)
+    mins[counts == 0] = 0
+    maxs = np.zeros(size, dtype=np.int64)
+    np.maximum.at(maxs, nodes, calls.inclusive)
+
+    store.symbols = array('Q', columns['address'][enters][first]
+                          .astype(np.uint64).tobytes())
+    store.call_sites = array('Q', call_sites.astype(np.uint64).tobytes())
+    store.orders = array('Q', np.arange(1, size + 1, dtype=np.uint64)
+                         .tobytes())
+    store.calls = array('Q', np.bincount(rows, weights[enters], size)
+                        .astype(np.uint64).tobytes())
+    store.counts = array('Q', counts.astype(np.uint64).tobytes())
+    store.totals = array('q', totals.tobytes())
+    store.exclusives = array('q', exclusives.tobytes())
+    store.mins = array('q', mins.tobytes())
+    store.maxs = array('q', maxs.tobytes())
+
+    nested = enters[parents[enters] >= 0]
+    if len(nested):
+        sources = node_of[parents[nested]]
+        targets = node_of[nested]
+        edges, _, edge_rows = first_seen(sources << 32 | targets)
+        store.sources = array('I', (edges >> 32).astype(np.uint32).tobytes())
+        store.targets = array('I', (edges & 0xffffffff)
+                              .astype(np.uint32).tobytes())
+        store.edge_counts = array('Q', np.bincount(edge_rows,
+                                                   weights[nested])
+                                  .astype(np.uint64).tobytes())
+
+    # The first node entered by each thread.
+    _, thread_first, _ = first_seen(threads)
+    for position in thread_first:
+        store.roots[int(threads[position])] = int(rows[position])
+
+    store.reindex()
+    return store